@@ -20,7 +20,7 @@ import workers
 modules = {'arcpy': 'esri_worker', 'cx_Oracle': 'oracle_worker',
            'pyodbc': 'sql_worker', 'pyodbc': 'mysql_worker',
            'boto3': 'dynamodb_worker', 'pymongo': 'mongodb_worker',
-           'ogr': 'gdal_worker'}
+           'ogr': 'gdal_worker', 'psycopg2': 'postgresql_worker'}
 
 
 if __name__ == '__main__':
@@ -44,6 +44,11 @@ if __name__ == '__main__':
     else:
         from workers import base_job
         job = base_job.Job(sys.argv[1])
+        if job.checkpoints and not job.resume:
+            job.clear_checkpoints()
+        # A resumed run continues the delta run that was interrupted.
+        if job.delta and not job.resume:
+            job.begin_delta()
         if job.path:
             from workers import esri_worker
             esri_worker.run_job(job)
@@ -69,7 +74,16 @@ if __name__ == '__main__':
             elif 'MySQL' in job.sql_driver:
                 from workers import mysql_worker
                 mysql_worker.run_job(job)
+            elif job.sql_driver == 'PostgreSQL':
+                from workers import postgresql_worker
+                postgresql_worker.run_job(job)
         else:
             sys.stdout.write("No job information.")
             sys.exit(1)
+        if job.delta:
+            job.send_deletes()
+        job.report_metrics()
+        # The job is complete, so the next run starts from the beginning.
+        if job.checkpoints:
+            job.clear_checkpoints()
     sys.exit(0)
@@ -0,0 +1,130 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A local HTTP server serving canned ArcGIS feature service JSON for benchmarks.
+
+It answers the token, service, layer, count, fields and geojson query requests
+agol_worker makes. Each request waits latency seconds before it is answered,
+standing in for the round trip to ArcGIS Online, and responses are gzipped
+when the client accepts it.
+
+Usage: python agol_stub.py [--port 8010] [--rows 20000] [--layers 2] [--max-record-count 1000] [--latency 0.2]
+"""
+import re
+import gzip
+import json
+import time
+import urlparse
+import argparse
+import threading
+import StringIO
+import BaseHTTPServer
+import SocketServer
+
+SERVICE_NAME = 'Benchmark'
+FIELDS = [{'name': 'OBJECTID', 'type': 'esriFieldTypeOID'},
+          {'name': 'NAME', 'type': 'esriFieldTypeString'},
+          {'name': 'VALUE', 'type': 'esriFieldTypeDouble'},
+          {'name': 'UPDATED', 'type': 'esriFieldTypeDate'}]
+
+
+class FeatureServiceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    layer_path = re.compile(r'/FeatureServer/(\d+)(/query)?/?$')
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        time.sleep(self.server.latency)
+        if url.path.endswith('/FeatureServer'):
+            self.send_json({'layers': [{'id': l, 'name': 'layer{0}'.format(l)} for l in range(self.server.layers)],
+                            'tables': []})
+            return
+        match = self.layer_path.search(url.path)
+        if not match:
+            self.send_error(404)
+        elif not match.group(2):
+            self.send_json({'id': int(match.group(1)), 'maxRecordCount': self.server.max_record_count})
+        elif params.get('returnCountOnly', '').lower() == 'true':
+            self.send_json({'count': self.server.rows})
+        elif 'resultOffset' not in params:
+            self.send_json({'fields': FIELDS})
+        else:
+            offset = int(params['resultOffset'])
+            stop = min(offset + min(int(params['resultRecordCount']), self.server.max_record_count), self.server.rows)
+            self.send_json({'type': 'FeatureCollection',
+                            'crs': {'type': 'name', 'properties': {'name': 'EPSG:4326'}},
+                            'features': [feature(i) for i in range(offset, stop)]})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_json({})
+
+    def send_json(self, data):
+        body = json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=1) as fp:
+                fp.write(body)
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeatureServiceStub(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves rows features in each of layers layers on a background thread."""
+    daemon_threads = True
+
+    def __init__(self, port=0, rows=20000, layers=2, max_record_count=1000, latency=0.2):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FeatureServiceHandler)
+        self.rows = rows
+        self.layers = layers
+        self.max_record_count = max_record_count
+        self.latency = latency
+        self.portal_url = 'http://127.0.0.1:{0}'.format(self.server_address[1])
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def feature(i):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-100.0 + (i % 100) * 0.1, 40.0 + (i % 10) * 0.1]},
+            'properties': {'OBJECTID': i + 1, 'NAME': 'feature {0}'.format(i), 'VALUE': i * 1.5, 'UPDATED': 1420070400000 + i}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--layers', type=int, default=2)
+    parser.add_argument('--max-record-count', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+    stub = FeatureServiceStub(args.port, args.rows, args.layers, args.max_record_count, args.latency)
+    print('Serving {0}/arcgis/rest/services/{1}/FeatureServer'.format(stub.portal_url, SERVICE_NAME))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.close()
@@ -0,0 +1,62 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares rows/s of agol_worker for one and several pages in flight.
+
+Runs against the local feature service stub in agol_stub.py, which adds a fixed
+latency to every request.
+
+Usage: python bench_agol.py [--rows 20000] [--layers 2] [--max-record-count 1000] [--latency 0.2] [--threads 1 4 8]
+"""
+import os
+import time
+import argparse
+import common
+import agol_stub
+from workers import base_job, agol_worker
+
+
+def run(portal_url, rows, threads):
+    """Index the stub service and return rows/s."""
+    sink = common.Sink()
+    config = {'service_connection': {'server_url': portal_url, 'user_name': '', 'password': '', 'token': '',
+                                     'generate_token': 'false', 'service_name': agol_stub.SERVICE_NAME,
+                                     'service_type': 'Feature Service', 'folder_name': '', 'threads': threads},
+              'tables': [{'name': '*', 'action': 'INCLUDE'}],
+              'batch': {'size': 500}}
+    job_file = common.write_job(sink.address, config)
+    try:
+        job = base_job.Job(job_file)
+        start = time.time()
+        agol_worker.run_job(job)
+        sink.wait(rows)
+        return rows / (time.time() - start)
+    finally:
+        sink.close()
+        os.remove(job_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--layers', type=int, default=2)
+    parser.add_argument('--max-record-count', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+    stub = agol_stub.FeatureServiceStub(0, args.rows, args.layers, args.max_record_count, args.latency)
+    try:
+        for threads in args.threads:
+            print('threads {0:>3}: {1:>10.0f} rows/s'.format(threads, run(stub.portal_url, args.rows * args.layers, threads)))
+    finally:
+        stub.close()
@@ -0,0 +1,80 @@
+# (C) Copyright 2016 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares rows/s of dynamodb_worker for serial and segmented scans.
+
+Runs against DynamoDB Local or a moto server, e.g. "moto_server dynamodb -p 8000".
+The benchmark table is created and loaded on the first run.
+
+Usage: python bench_dynamodb.py [--endpoint-url http://localhost:8000] [--rows 20000] [--segments 1 2 4 8]
+"""
+import os
+import time
+import decimal
+import argparse
+import common
+import boto3
+from workers import base_job, dynamodb_worker
+
+TABLE_NAME = 'voyager_benchmark'
+
+
+def load_table(endpoint_url, rows):
+    """Create and load the benchmark table if it does not have the number of rows."""
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1', endpoint_url=endpoint_url)
+    if TABLE_NAME in [t.name for t in dynamodb.tables.all()]:
+        table = dynamodb.Table(TABLE_NAME)
+        if table.item_count == rows:
+            return
+        table.delete()
+        table.wait_until_not_exists()
+    table = dynamodb.create_table(TableName=TABLE_NAME,
+                                  KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+                                  AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'N'}],
+                                  ProvisionedThroughput={'ReadCapacityUnits': 1000, 'WriteCapacityUnits': 1000})
+    table.wait_until_exists()
+    with table.batch_writer() as batch:
+        for i in xrange(rows):
+            batch.put_item(Item={'id': i, 'name': 'item {0}'.format(i), 'value': decimal.Decimal(i) / 7,
+                                 'category': 'category {0}'.format(i % 10), 'notes': 'x' * 100})
+
+
+def run(endpoint_url, rows, segments):
+    """Index the benchmark table and return rows/s."""
+    sink = common.Sink()
+    config = {'dynamodb': {'endpoint_url': endpoint_url, 'region': 'us-east-1', 'segments': segments},
+              'tables': [{'name': TABLE_NAME, 'action': 'INCLUDE'}],
+              'batch': {'size': 500}}
+    job_file = common.write_job(sink.address, config)
+    try:
+        job = base_job.Job(job_file)
+        start = time.time()
+        dynamodb_worker.run_job(job)
+        sink.wait(rows)
+        return rows / (time.time() - start)
+    finally:
+        sink.close()
+        os.remove(job_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--endpoint-url', default='http://localhost:8000')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    load_table(args.endpoint_url, args.rows)
+    for segments in args.segments:
+        print('segments {0:>3}: {1:>10.0f} rows/s'.format(segments, run(args.endpoint_url, args.rows, segments)))
@@ -0,0 +1,94 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Microbenchmark of entry encoding for Oracle and SQL Server shaped rows.
+
+Compares json.dumps with a per-call encoder that rebuilds its lookup tables
+(the previous ObjectEncoder) against base_job.EntryEncoder with each backend
+that is installed.
+
+Usage: python bench_encoder.py [--rows 50000]
+"""
+import time
+import json
+import decimal
+import datetime
+import argparse
+import common
+from workers import base_job
+
+
+class PerCallEncoder(json.JSONEncoder):
+    """The previous ObjectEncoder: tables are rebuilt for every non-native value."""
+    def default(self, obj):
+        text_chars = ''.join(map(chr, [7, 8, 9, 10, 12, 13, 27] + range(0x20, 0x100)))
+        is_binary_string = lambda bytes: bool(bytes.translate(None, text_chars))
+        if isinstance(obj, decimal.Decimal):
+            return float(obj)
+        elif isinstance(obj, datetime.datetime):
+            try:
+                return obj.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            except ValueError:
+                return datetime.datetime.isoformat(obj) + 'Z'
+        elif isinstance(obj, memoryview):
+            if not is_binary_string(obj.tobytes()):
+                return str(obj)
+        return None
+
+
+def oracle_row(i):
+    """NUMBER, VARCHAR2, DATE and CLOB (fetched as text) columns with an SDO envelope."""
+    return {'id': 'BENCHMARK_SDE.PARCELS_{0}'.format(i), 'location': 'BENCHMARK', 'action': 'ADD',
+            'entry': {'geo': {'xmin': -105.1, 'ymin': 39.6, 'xmax': -104.9, 'ymax': 39.8},
+                      'fields': {'ff_OBJECTID': i, 'ff_AREA': i * 1.5, 'fs_OWNER': 'Owner {0}'.format(i),
+                                 'fs_ADDRESS': '{0} Main Street'.format(i), 'fd_UPDATED': datetime.datetime(2015, 1, 1, 12, 30),
+                                 'fd_CREATED': datetime.datetime(1899, 12, 31), 'meta_NOTES': 'x' * 200,
+                                 '_discoveryID': 'BENCHMARK_DISCOVERY', 'meta_table_name': 'SDE.PARCELS',
+                                 'format_type': 'Record', 'format': 'application/vnd.oracle.record'}}}
+
+
+def sql_server_row(i):
+    """int, numeric, datetime, nvarchar, bit and varbinary columns with a point."""
+    return {'id': 'BENCHMARK_wells_{0}'.format(i), 'location': 'BENCHMARK', 'action': 'ADD',
+            'entry': {'geo': {'lon': -98.5, 'lat': 35.2},
+                      'fields': {'fl_well_id': i, 'fu_depth': decimal.Decimal('1234.56'), 'fu_rate': decimal.Decimal('0.125'),
+                                 'fd_spud_date': datetime.datetime(2011, 5, 17), 'fs_operator': u'Op\xe9rateur {0}'.format(i),
+                                 'fb_active': True, 'meta_photo': bytearray('\x89PNG\x00\x01\x02'),
+                                 'meta_label': 'plain text label', '_discoveryID': 'BENCHMARK_DISCOVERY',
+                                 'format_type': 'Record', 'format': 'application/vnd.sqlserver.record'}}}
+
+
+def time_encoder(encode, rows):
+    start = time.time()
+    for row in rows:
+        encode(row)
+    return len(rows) / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    args = parser.parse_args()
+    for shape in (oracle_row, sql_server_row):
+        rows = [shape(i) for i in range(args.rows)]
+        print('{0}:'.format(shape.__doc__))
+        print('  {0:<30} {1:>10.0f} rows/s'.format('json.dumps, per-call tables',
+                                                   time_encoder(lambda r: json.dumps(r, cls=PerCallEncoder), rows)))
+        for name in sorted(base_job.backends):
+            try:
+                base_job.backends[name]()
+            except ImportError:
+                print('  {0:<30} {1:>10}'.format('EntryEncoder ' + name, 'not installed'))
+                continue
+            encoder = base_job.EntryEncoder('ADD', 'BENCHMARK', name)
+            print('  {0:<30} {1:>10.0f} rows/s'.format('EntryEncoder ' + name, time_encoder(encoder.encode, rows)))
@@ -0,0 +1,92 @@
+# (C) Copyright 2016 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares rows/s of gdal_worker for serial and layer-parallel reads of a multi-layer GeoPackage,
+with and without the geometry.
+
+The benchmark GeoPackage is written with OGR on the first run.
+
+Usage: python bench_gdal.py [--path voyager_benchmark.gpkg] [--layers 8] [--rows 20000] [--vertices 64]
+                            [--processes 1 2 4 8]
+"""
+import os
+import math
+import time
+import argparse
+import common
+from osgeo import ogr, osr
+from workers import gdal_worker
+
+
+def load_geopackage(path, layers, rows, vertices):
+    """Write the benchmark GeoPackage if it does not exist."""
+    if os.path.exists(path):
+        return
+    source = ogr.GetDriverByName('GPKG').CreateDataSource(path)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    for layer_number in range(layers):
+        layer = source.CreateLayer('layer_{0}'.format(layer_number), srs, ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn('name', ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn('value', ogr.OFTReal))
+        layer.CreateField(ogr.FieldDefn('category', ogr.OFTInteger))
+        layer.StartTransaction()
+        for i in xrange(rows):
+            x = -180 + (i % 360)
+            y = -80 + (i // 360) % 160
+            ring = ', '.join('{0} {1}'.format(x + 0.5 + 0.4 * math.cos(2 * math.pi * v / vertices),
+                                              y + 0.5 + 0.4 * math.sin(2 * math.pi * v / vertices))
+                             for v in range(vertices) + [0])
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetField('name', 'feature {0}'.format(i))
+            feature.SetField('value', i / 7.)
+            feature.SetField('category', i % 10)
+            feature.SetGeometry(ogr.CreateGeometryFromWkt('POLYGON (({0}))'.format(ring)))
+            layer.CreateFeature(feature)
+        layer.CommitTransaction()
+    source = None
+
+
+def run(path, rows, processes, geometry):
+    """Index the benchmark GeoPackage and return rows/s."""
+    sink = common.Sink()
+    config = {'url': path, 'tables': [{'name': '*', 'action': 'INCLUDE'}], 'batch': {'size': 500}}
+    if processes > 1:
+        config['multiprocessing'] = 'true'
+        config['processes'] = processes
+    if not geometry:
+        config['fields'] = {'include': ['*'], 'exclude': ['OGR_GEOMETRY']}
+    job_file = common.write_job(sink.address, config)
+    try:
+        start = time.time()
+        gdal_worker.run_job(job_file)
+        sink.wait(rows)
+        return rows / (time.time() - start)
+    finally:
+        sink.close()
+        os.remove(job_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default='voyager_benchmark.gpkg')
+    parser.add_argument('--layers', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--vertices', type=int, default=64)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    load_geopackage(args.path, args.layers, args.rows, args.vertices)
+    total = args.layers * args.rows
+    for processes in args.processes:
+        print('processes {0:>3}: {1:>10.0f} rows/s'.format(processes, run(args.path, total, processes, True)))
+    print('no geometry:   {0:>10.0f} rows/s'.format(run(args.path, total, 1, False)))
@@ -0,0 +1,102 @@
+# (C) Copyright 2016 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares files/s of reading GridFS metadata per file (GridFS.get) and with the files documents,
+and of mongodb_worker indexing a GridFS bucket with and without content extraction.
+
+Runs against a local mongod, e.g. "docker run -p 27017:27017 mongo:3.4".
+The benchmark bucket is created and loaded on the first run.
+
+Usage: python bench_gridfs.py [--uri mongodb://localhost:27017] [--files 10000] [--size 4096]
+"""
+import os
+import time
+import argparse
+import common
+import gridfs
+import pymongo
+from workers import base_job, mongodb_worker
+
+DATABASE_NAME = 'voyager_benchmark'
+BUCKET_NAME = 'bench'
+
+
+def load_bucket(uri, files, size):
+    """Create and load the benchmark bucket if it does not have the number of files."""
+    database = pymongo.MongoClient(uri)[DATABASE_NAME]
+    if database['{0}.files'.format(BUCKET_NAME)].count() == files:
+        return
+    database.drop_collection('{0}.files'.format(BUCKET_NAME))
+    database.drop_collection('{0}.chunks'.format(BUCKET_NAME))
+    bucket = gridfs.GridFS(database, BUCKET_NAME)
+    for i in xrange(files):
+        bucket.put('x' * size, filename='file_{0}.txt'.format(i),
+                   metadata={'name': 'file {0}'.format(i), 'category': 'category {0}'.format(i % 10), 'value': i / 7.})
+
+
+def read_per_file(uri):
+    """Read the metadata of each file with GridFS.get (one query per file) and return files/s."""
+    database = pymongo.MongoClient(uri)[DATABASE_NAME]
+    bucket = gridfs.GridFS(database, BUCKET_NAME)
+    start = time.time()
+    count = 0
+    for doc in database['{0}.files'.format(BUCKET_NAME)].find():
+        bucket.get(doc['_id']).metadata
+        count += 1
+    return count / (time.time() - start)
+
+
+def read_inline(uri, batch_size):
+    """Read the metadata of each file from the files documents and return files/s."""
+    database = pymongo.MongoClient(uri)[DATABASE_NAME]
+    start = time.time()
+    count = 0
+    for doc in database['{0}.files'.format(BUCKET_NAME)].find(batch_size=batch_size):
+        doc.get('metadata')
+        count += 1
+    return count / (time.time() - start)
+
+
+def run(uri, files, extract):
+    """Index the files collection of the benchmark bucket and return files/s."""
+    sink = common.Sink()
+    table = {'name': '{0}.files'.format(BUCKET_NAME), 'action': 'INCLUDE'}
+    if extract:
+        table['format'] = 'text/plain'
+    config = {'mongodb': {'client': uri, 'database': DATABASE_NAME, 'gridfs': 'true'},
+              'tables': [table],
+              'batch': {'size': 500}}
+    job_file = common.write_job(sink.address, config)
+    try:
+        job = base_job.Job(job_file)
+        start = time.time()
+        mongodb_worker.run_job(job)
+        sink.wait(files)
+        return files / (time.time() - start)
+    finally:
+        sink.close()
+        os.remove(job_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    load_bucket(args.uri, args.files, args.size)
+    print('metadata per file:  {0:>10.0f} files/s'.format(read_per_file(args.uri)))
+    print('metadata inline:    {0:>10.0f} files/s'.format(read_inline(args.uri, args.batch_size)))
+    print('worker:             {0:>10.0f} files/s'.format(run(args.uri, args.files, False)))
+    print('worker (extract):   {0:>10.0f} files/s'.format(run(args.uri, args.files, True)))
@@ -0,0 +1,67 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Microbenchmark of per-row field mapping.
+
+Compares resolving the mapping for every row with Job.map_fields and scanning
+the new fields (what the workers did) against a cached Job.mapping_plan.
+
+Usage: python bench_mapping.py [--rows 100000] [--width 40]
+"""
+import os
+import time
+import argparse
+import common
+from workers import base_job
+
+
+def per_row(job, table, columns, column_types, rows):
+    start = time.time()
+    for row in rows:
+        mapped_fields = dict(zip(job.map_fields(table, columns, column_types), row))
+        for nf in job.new_fields:
+            if nf['name'] == '*' or nf['name'] == table:
+                for k, v in nf['new_fields'].iteritems():
+                    mapped_fields[k] = v
+    return len(rows) / (time.time() - start)
+
+
+def planned(job, table, columns, column_types, rows):
+    start = time.time()
+    for row in rows:
+        mapping_plan = job.mapping_plan(table, columns, column_types)
+        mapped_fields = mapping_plan.project(row)
+        mapped_fields.update(mapping_plan.new_fields)
+    return len(rows) / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--width', type=int, default=40)
+    args = parser.parse_args()
+
+    column_types = dict(('col{0}'.format(c), ('int', 'numeric', 'date', 'nvarchar')[c % 4]) for c in range(args.width))
+    columns = sorted(column_types)
+    rows = [tuple(i * c for c in range(args.width)) for i in range(args.rows)]
+    config = {'tables': [{'name': '*', 'action': 'INCLUDE', 'map': {'col0': 'fl_id', 'col1': 'title'}},
+                         {'name': 'parcels', 'new_fields': {'fs_source': 'benchmark', 'fl_version': 2}}]}
+    job_file = common.write_job('', config)
+    try:
+        job = base_job.Job(job_file)
+        job.tables_to_keep()
+        print('{0} columns:'.format(args.width))
+        print('  {0:<30} {1:>10.0f} rows/s'.format('map_fields per row', per_row(job, 'parcels', columns, column_types, rows)))
+        print('  {0:<30} {1:>10.0f} rows/s'.format('mapping_plan', planned(job, 'parcels', columns, column_types, rows)))
+    finally:
+        os.remove(job_file)
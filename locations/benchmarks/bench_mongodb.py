@@ -0,0 +1,80 @@
+# (C) Copyright 2016 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares rows/s of mongodb_worker for _id range scans, batch sizes and projections.
+
+Runs against a local mongod, e.g. "docker run -p 27017:27017 mongo:3.4".
+The benchmark collection is created and loaded on the first run.
+
+Usage: python bench_mongodb.py [--uri mongodb://localhost:27017] [--rows 100000] [--ranges 1 2 4 8]
+                               [--batch-size 1000] [--fields name value]
+"""
+import os
+import time
+import argparse
+import common
+import pymongo
+from workers import base_job, mongodb_worker
+
+DATABASE_NAME = 'voyager_benchmark'
+COLLECTION_NAME = 'voyager_benchmark'
+
+
+def load_collection(uri, rows):
+    """Create and load the benchmark collection if it does not have the number of documents."""
+    collection = pymongo.MongoClient(uri)[DATABASE_NAME][COLLECTION_NAME]
+    if collection.count() == rows:
+        return
+    collection.drop()
+    documents = []
+    for i in xrange(rows):
+        documents.append({'_id': i, 'name': 'document {0}'.format(i), 'value': i / 7.,
+                          'category': 'category {0}'.format(i % 10), 'notes': 'x' * 100,
+                          'loc': {'type': 'Point', 'coordinates': [-100.0 + (i % 100), 40.0 + (i % 10)]}})
+        if len(documents) == 1000:
+            collection.insert_many(documents)
+            documents = []
+    if documents:
+        collection.insert_many(documents)
+
+
+def run(uri, rows, ranges, batch_size, fields):
+    """Index the benchmark collection and return rows/s."""
+    sink = common.Sink()
+    config = {'mongodb': {'client': uri, 'database': DATABASE_NAME, 'ranges': ranges, 'batch_size': batch_size},
+              'tables': [{'name': COLLECTION_NAME, 'action': 'INCLUDE'}],
+              'fields': {'include': fields},
+              'batch': {'size': 500}}
+    job_file = common.write_job(sink.address, config)
+    try:
+        job = base_job.Job(job_file)
+        start = time.time()
+        mongodb_worker.run_job(job)
+        sink.wait(rows)
+        return rows / (time.time() - start)
+    finally:
+        sink.close()
+        os.remove(job_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='mongodb://localhost:27017')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--ranges', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--fields', nargs='+', default=['*'])
+    args = parser.parse_args()
+    load_collection(args.uri, args.rows)
+    for ranges in args.ranges:
+        print('ranges {0:>3}: {1:>10.0f} rows/s'.format(ranges, run(args.uri, args.rows, ranges, args.batch_size, args.fields)))
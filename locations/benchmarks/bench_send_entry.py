@@ -0,0 +1,59 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares rows/s for single-entry and batched ZMQ frames from Job.send_entry.
+
+Usage: python bench_send_entry.py [--rows 100000] [--width 20] [--batch 1 100 500 1000] [--threaded]
+"""
+import os
+import time
+import argparse
+import common
+from workers import base_job
+
+
+def run(rows, width, batch_size, threaded=False):
+    """Send rows synthetic entries through a job and return (rows/s, frames)."""
+    sink = common.Sink()
+    config = {'batch': {'size': batch_size}}
+    if threaded:
+        config['sender'] = {'threaded': 'true'}
+    job_file = common.write_job(sink.address, config)
+    try:
+        job = base_job.Job(job_file)
+        job.connect_to_zmq()
+        entries = [common.make_entry(i, width) for i in range(min(rows, 1000))]
+        start = time.time()
+        for i in xrange(rows):
+            job.send_entry(entries[i % len(entries)])
+        job.flush_entries()
+        sink.wait(rows)
+        elapsed = time.time() - start
+        return rows / elapsed, sink.frames
+    finally:
+        sink.close()
+        os.remove(job_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--width', type=int, default=20)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 100, 500, 1000])
+    parser.add_argument('--threaded', action='store_true', help='also run with the background sender thread')
+    args = parser.parse_args()
+    for threaded in ([False, True] if args.threaded else [False]):
+        for size in args.batch:
+            rate, frames = run(args.rows, args.width, size, threaded)
+            print('{0} batch size {1:>5}: {2:>10.0f} rows/s in {3} frames'.format(
+                'threaded' if threaded else 'inline  ', size, rate, frames))
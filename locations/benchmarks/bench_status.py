@@ -0,0 +1,78 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the cost of status output for a table indexed at a high row rate.
+
+Compares status.Writer called every get_increment rows and for every row
+(what a fast table amounts to) against status.ProgressWriter called for every
+row. The output is piped to a child process that reads it, as the location
+runner's stdout is.
+
+Usage: python bench_status.py [--rows 1000000] [--interval 2]
+"""
+import sys
+import math
+import time
+import argparse
+import subprocess
+import common
+from workers.utils import status
+
+
+class CountingStream(object):
+    """Wraps a stream and counts the writes and flushes."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.writes = 0
+        self.flushes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.stream.write(data)
+
+    def flush(self):
+        self.flushes += 1
+        self.stream.flush()
+
+
+def run(writer, rows, every):
+    """Reports the progress of rows through writer every so many rows. Returns (rows/s, flushes)."""
+    reader = subprocess.Popen([sys.executable, '-c', 'import sys\nfor line in sys.stdin: pass'], stdin=subprocess.PIPE)
+    stream = CountingStream(reader.stdin)
+    writer._io = stream
+    start = time.time()
+    for i in xrange(1, rows + 1):
+        if isinstance(writer, status.ProgressWriter):
+            writer.progress('parcels', i, rows, 'benchmark', i * 100)
+        elif (i % every) == 0:
+            writer.send_percent(float(i) / rows, '{0}: {1:%}'.format('parcels', float(i) / rows), 'benchmark')
+    elapsed = time.time() - start
+    reader.stdin.close()
+    reader.wait()
+    return rows / elapsed, stream.flushes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--interval', type=float, default=2.)
+    args = parser.parse_args()
+
+    # The increment Job.get_increment returns.
+    increment = 10 ** max(int(math.log10(args.rows)) - 1, 0)
+    print('{0} rows:'.format(args.rows))
+    for label, writer, every in (('Writer every {0} rows'.format(increment), status.Writer(), increment),
+                                 ('Writer every row', status.Writer(), 1),
+                                 ('ProgressWriter every row', status.ProgressWriter(args.interval), 1)):
+        rate, flushes = run(writer, args.rows, every)
+        print('  {0:<30} {1:>10.0f} rows/s {2:>10} flushes'.format(label, rate, flushes))
@@ -0,0 +1,106 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers shared by the location worker benchmarks."""
+import os
+import sys
+import json
+import time
+import datetime
+import decimal
+import tempfile
+import threading
+import zmq
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Sink(object):
+    """A local ZMQ PULL socket standing in for the indexer. It counts the entries
+    it receives, whether they arrive one per frame or batched in an array.
+    """
+    def __init__(self):
+        self.address = ''
+        self.entries = 0
+        self.frames = 0
+        self.bytes = 0
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        socket = zmq.Context.instance().socket(zmq.PULL)
+        port = socket.bind_to_random_port('tcp://127.0.0.1')
+        self.address = 'tcp://127.0.0.1:{0}'.format(port)
+        self._ready.set()
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        while not self._stop.is_set():
+            if not poller.poll(100):
+                continue
+            frame = socket.recv()
+            self.frames += 1
+            self.bytes += len(frame)
+            try:
+                data = json.loads(frame)
+            except ValueError:
+                import msgpack
+                data = msgpack.unpackb(frame)
+            if isinstance(data, list):
+                self.entries += len(data)
+            else:
+                self.entries += 1
+        socket.close(linger=0)
+
+    def wait(self, count, timeout=300):
+        """Wait until count entries have been received. Returns False on timeout."""
+        end = time.time() + timeout
+        while self.entries < count:
+            if time.time() > end:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def write_job(address, config, location_id='BENCHMARK'):
+    """Write a job file that sends to the sink address and return its path."""
+    job = {'id': 'BENCHMARK_DISCOVERY',
+           'connection': {'indexer': address},
+           'location': {'id': location_id, 'name': location_id, 'type': 'TABLES', 'config': config}}
+    fd, job_file = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(job, fp)
+    return job_file
+
+
+def make_entry(i, width=20, location_id='BENCHMARK'):
+    """Return a synthetic record entry shaped like the ones the SQL workers send."""
+    fields = {'_discoveryID': 'BENCHMARK_DISCOVERY', 'format_type': 'Record',
+              'format': 'application/vnd.benchmark.record'}
+    for c in range(width):
+        if c % 4 == 0:
+            fields['fl_col{0}'.format(c)] = i * c
+        elif c % 4 == 1:
+            fields['fu_col{0}'.format(c)] = decimal.Decimal('{0}.{1}'.format(i, c))
+        elif c % 4 == 2:
+            fields['fd_col{0}'.format(c)] = datetime.datetime(2000, 1, 1) + datetime.timedelta(seconds=i)
+        else:
+            fields['fs_col{0}'.format(c)] = 'value {0} of row {1}'.format(c, i)
+    return {'id': '{0}_benchmark_{1}'.format(location_id, i), 'location': location_id, 'action': 'ADD',
+            'entry': {'geo': {'lon': -100.0 + (i % 100), 'lat': 40.0 + (i % 10)}, 'fields': fields}}
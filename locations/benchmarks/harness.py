@@ -0,0 +1,506 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark harness that drives each location worker against local stand-ins.
+
+Generates synthetic tables of a given row count, width (number of attribute
+columns) and geometry complexity (vertices per polygon), loads them into a
+local stand-in for each source and runs the worker's run_job in a fresh process
+against a local ZMQ sink. Records rows/s, peak RSS and the per-stage metrics of
+each run and writes them as JSON, so runs can be compared across versions.
+
+Stand-ins (a backend is skipped, and the reason recorded, if it is not available):
+  dynamodb   DynamoDB Local or "moto_server dynamodb -p 8000"  (--dynamodb-endpoint)
+  mongodb    a local mongod, e.g. "docker run -p 27017:27017 mongo:3.4"  (--mongodb-uri)
+  mysql      e.g. "docker run -p 3306:3306 -e MYSQL_ROOT_PASSWORD=bench mysql:5.7" with the MySQL ODBC driver
+  sqlserver  e.g. "docker run -p 1433:1433 -e ACCEPT_EULA=Y -e SA_PASSWORD=Bench_2014 mssql/server"
+  oracle     e.g. "docker run -p 1521:1521 -e ORACLE_PASSWORD=bench gvenzl/oracle-xe" with cx_Oracle
+  gdal       GDAL-readable files written with OGR (--gdal-driver, default GPKG)
+The SQL connections are given as "driver=...;server=...;database=...;uid=...;password=..."
+(and port and sid for Oracle).
+
+Usage: python harness.py [--backends dynamodb mongodb gdal] [--rows 10000] [--width 20] [--vertices 0 64]
+                         [--output results.json]
+       python harness.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import decimal
+import datetime
+import platform
+import argparse
+import resource
+import subprocess
+import multiprocessing
+import common
+from workers import base_job
+from workers.utils import metrics
+
+DATABASE_NAME = 'voyager_benchmark'
+COLUMN_TYPES = ('int', 'float', 'text', 'date')
+
+
+class Dataset(object):
+    """A synthetic table. Each row has an integer id, width attribute columns that cycle
+    through integer, float, text and date values and, if vertices is not 0, a polygon.
+    """
+    def __init__(self, rows, width, vertices, seed=0):
+        self.rows = rows
+        self.width = width
+        self.vertices = vertices
+        self.seed = seed
+        self.name = 'bench_{0}_{1}_{2}'.format(rows, width, vertices)
+        self.columns = [('col{0}'.format(c), COLUMN_TYPES[c % len(COLUMN_TYPES)]) for c in range(width)]
+
+    def __iter__(self):
+        """Yields (id, values, wkt) for each row. wkt is None without geometry."""
+        rnd = random.Random(self.seed)
+        start = datetime.datetime(2000, 1, 1)
+        for i in xrange(1, self.rows + 1):
+            values = []
+            for c, (name, column_type) in enumerate(self.columns):
+                if column_type == 'int':
+                    values.append(rnd.randint(0, 1000000))
+                elif column_type == 'float':
+                    values.append(round(rnd.uniform(-1000, 1000), 4))
+                elif column_type == 'text':
+                    values.append('value {0} of row {1} {2}'.format(c, i, 'x' * rnd.randint(0, 40)))
+                else:
+                    values.append(start + datetime.timedelta(seconds=rnd.randint(0, 500000000)))
+            yield i, values, self.polygon(rnd) if self.vertices else None
+
+    def polygon(self, rnd):
+        """Returns the WKT of a closed polygon of self.vertices vertices at a random location."""
+        x, y = rnd.uniform(-170, 170), rnd.uniform(-80, 80)
+        radius = rnd.uniform(0.01, 1)
+        points = ['{0:.6f} {1:.6f}'.format(x + radius * math.cos(2 * math.pi * v / self.vertices),
+                                           y + radius * math.sin(2 * math.pi * v / self.vertices))
+                  for v in range(self.vertices)]
+        return 'POLYGON (({0}, {1}))'.format(', '.join(points), points[0])
+
+
+def parse_connection(text):
+    """Parses "key=value;key=value" into a dictionary (values may be in braces)."""
+    connection = {}
+    for part in text.split(';'):
+        if '=' in part:
+            key, value = part.split('=', 1)
+            connection[key.strip().lower()] = value.strip()
+    return connection
+
+
+class Backend(object):
+    """A source and its stand-in: loads a dataset, returns the location config and runs the worker."""
+    name = ''
+
+    def unavailable(self):
+        """Returns why the stand-in cannot be used, or an empty string."""
+        return ''
+
+    def load(self, dataset):
+        raise NotImplementedError
+
+    def config(self, dataset):
+        raise NotImplementedError
+
+    def run(self, job):
+        raise NotImplementedError
+
+
+class DynamoDBBackend(Backend):
+    name = 'dynamodb'
+
+    def __init__(self, endpoint_url):
+        self.endpoint_url = endpoint_url
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+    def resource(self):
+        import boto3
+        return boto3.resource('dynamodb', region_name='us-east-1', endpoint_url=self.endpoint_url)
+
+    def unavailable(self):
+        try:
+            list(self.resource().tables.all())
+        except Exception as ex:
+            return repr(ex)
+        return ''
+
+    def load(self, dataset):
+        dynamodb = self.resource()
+        if dataset.name in [t.name for t in dynamodb.tables.all()]:
+            table = dynamodb.Table(dataset.name)
+            if table.item_count == dataset.rows:
+                return
+            table.delete()
+            table.wait_until_not_exists()
+        table = dynamodb.create_table(TableName=dataset.name,
+                                      KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+                                      AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'N'}],
+                                      ProvisionedThroughput={'ReadCapacityUnits': 1000, 'WriteCapacityUnits': 1000})
+        table.wait_until_exists()
+        with table.batch_writer() as batch:
+            for i, values, wkt in dataset:
+                item = {'id': i}
+                for (name, column_type), value in zip(dataset.columns, values):
+                    if column_type == 'float':
+                        value = decimal.Decimal(str(value))
+                    elif column_type == 'date':
+                        value = value.isoformat()
+                    item[name] = value
+                if wkt:
+                    item['wkt'] = wkt
+                batch.put_item(Item=item)
+
+    def config(self, dataset):
+        return {'dynamodb': {'endpoint_url': self.endpoint_url, 'region': 'us-east-1'},
+                'tables': [{'name': dataset.name, 'action': 'INCLUDE'}]}
+
+    def run(self, job):
+        from workers import dynamodb_worker
+        dynamodb_worker.run_job(job)
+
+
+class MongoDBBackend(Backend):
+    name = 'mongodb'
+
+    def __init__(self, uri):
+        self.uri = uri
+
+    def database(self):
+        import pymongo
+        return pymongo.MongoClient(self.uri, serverSelectionTimeoutMS=2000)[DATABASE_NAME]
+
+    def unavailable(self):
+        try:
+            self.database().client.server_info()
+        except Exception as ex:
+            return repr(ex)
+        return ''
+
+    def load(self, dataset):
+        collection = self.database()[dataset.name]
+        if collection.count() == dataset.rows:
+            return
+        collection.drop()
+        documents = []
+        for i, values, wkt in dataset:
+            document = dict(zip([name for name, column_type in dataset.columns], values))
+            document['_id'] = i
+            if wkt:
+                coordinates = [[[float(c) for c in point.split()] for point in wkt[10:-2].split(', ')]]
+                xs = [point[0] for point in coordinates[0]]
+                ys = [point[1] for point in coordinates[0]]
+                document['loc'] = {'type': 'Polygon', 'coordinates': coordinates,
+                                   'bbox': [min(xs), min(ys), max(xs), max(ys)]}
+            documents.append(document)
+            if len(documents) == 1000:
+                collection.insert_many(documents)
+                documents = []
+        if documents:
+            collection.insert_many(documents)
+
+    def config(self, dataset):
+        return {'mongodb': {'client': self.uri, 'database': DATABASE_NAME},
+                'tables': [{'name': dataset.name, 'action': 'INCLUDE'}]}
+
+    def run(self, job):
+        from workers import mongodb_worker
+        mongodb_worker.run_job(job)
+
+
+class SQLBackend(Backend):
+    """A SQL Server, MySQL or Oracle database, loaded over the job's own connection."""
+    types = {}
+    geometry = ''
+
+    def __init__(self, connection):
+        self.connection = parse_connection(connection) if connection else {}
+
+    def unavailable(self):
+        if not self.connection:
+            return 'no connection given'
+        try:
+            self.connect()
+        except Exception as ex:
+            return repr(ex)
+        return ''
+
+    def connect(self):
+        """Connects as the worker does (Job.connect_to_database) and returns the connection."""
+        job_file = common.write_job('', {'sql': {'connection': self.connection}})
+        try:
+            job = base_job.Job(job_file)
+            job.connect_to_database()
+            return job.db_connection
+        finally:
+            os.remove(job_file)
+
+    def load(self, dataset):
+        connection = self.connect()
+        cursor = connection.cursor()
+        try:
+            cursor.execute('select count(*) from {0}'.format(dataset.name))
+            if cursor.fetchone()[0] == dataset.rows:
+                return
+            cursor.execute('drop table {0}'.format(dataset.name))
+        except Exception:
+            pass
+        columns = ['OBJECTID {0} primary key'.format(self.types['int'])]
+        columns += ['{0} {1}'.format(name, self.types[column_type]) for name, column_type in dataset.columns]
+        names = ['OBJECTID'] + [name for name, column_type in dataset.columns]
+        params = [self.parameter(n) for n in range(len(names))]
+        if dataset.vertices:
+            columns.append('SHAPE {0}'.format(self.types['geometry']))
+            names.append('SHAPE')
+            params.append(self.geometry.format(self.parameter(len(params))))
+        cursor.execute('create table {0} ({1})'.format(dataset.name, ', '.join(columns)))
+        insert = 'insert into {0} ({1}) values ({2})'.format(dataset.name, ', '.join(names), ', '.join(params))
+        batch = []
+        for i, values, wkt in dataset:
+            batch.append([i] + values + ([wkt] if wkt else []))
+            if len(batch) == 1000:
+                cursor.executemany(insert, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+        connection.commit()
+
+    def parameter(self, n):
+        return '?'
+
+    def config(self, dataset):
+        return {'sql': {'connection': self.connection},
+                'tables': [{'name': dataset.name, 'action': 'INCLUDE'}]}
+
+
+class SQLServerBackend(SQLBackend):
+    name = 'sqlserver'
+    types = {'int': 'int', 'float': 'float', 'text': 'nvarchar(100)', 'date': 'datetime', 'geometry': 'geometry'}
+    geometry = 'geometry::STGeomFromText({0}, 4326)'
+
+    def run(self, job):
+        from workers import sql_worker
+        sql_worker.run_job(job)
+
+
+class MySQLBackend(SQLBackend):
+    name = 'mysql'
+    types = {'int': 'int', 'float': 'double', 'text': 'varchar(100)', 'date': 'datetime', 'geometry': 'geometry'}
+    geometry = 'GeomFromText({0}, 4326)'
+
+    def run(self, job):
+        from workers import mysql_worker
+        mysql_worker.run_job(job)
+
+
+class OracleBackend(SQLBackend):
+    name = 'oracle'
+    types = {'int': 'number(10)', 'float': 'binary_double', 'text': 'varchar2(100)', 'date': 'date',
+             'geometry': 'sdo_geometry'}
+    geometry = 'sdo_geometry({0}, 4326)'
+
+    def parameter(self, n):
+        return ':{0}'.format(n + 1)
+
+    def run(self, job):
+        from workers import oracle_worker
+        oracle_worker.run_job(job)
+
+
+class GDALBackend(Backend):
+    name = 'gdal'
+    extensions = {'GPKG': '.gpkg', 'ESRI Shapefile': '.shp', 'GeoJSON': '.geojson', 'SQLite': '.sqlite'}
+
+    def __init__(self, directory, driver='GPKG'):
+        self.directory = directory
+        self.driver = driver
+
+    def unavailable(self):
+        try:
+            from osgeo import ogr
+        except ImportError as ex:
+            return repr(ex)
+        if not ogr.GetDriverByName(self.driver):
+            return 'no OGR driver {0}'.format(self.driver)
+        return ''
+
+    def path(self, dataset):
+        return os.path.join(self.directory, dataset.name + self.extensions.get(self.driver, ''))
+
+    def load(self, dataset):
+        from osgeo import ogr, osr
+        path = self.path(dataset)
+        if os.path.exists(path):
+            return
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        source = ogr.GetDriverByName(self.driver).CreateDataSource(path)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        layer = source.CreateLayer(dataset.name, srs, ogr.wkbPolygon if dataset.vertices else ogr.wkbNone)
+        field_types = {'int': ogr.OFTInteger, 'float': ogr.OFTReal, 'text': ogr.OFTString, 'date': ogr.OFTDateTime}
+        for name, column_type in dataset.columns:
+            layer.CreateField(ogr.FieldDefn(name, field_types[column_type]))
+        layer.StartTransaction()
+        for i, values, wkt in dataset:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            for (name, column_type), value in zip(dataset.columns, values):
+                feature.SetField(name, value.isoformat() if column_type == 'date' else value)
+            if wkt:
+                feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt))
+            layer.CreateFeature(feature)
+        layer.CommitTransaction()
+        source = None
+
+    def config(self, dataset):
+        return {'url': self.path(dataset), 'tables': [{'name': '*', 'action': 'INCLUDE'}]}
+
+    def run(self, job):
+        from workers import gdal_worker
+        gdal_worker.run_job(job.job_file)
+
+
+def run_worker(backend, job_file, results):
+    """Runs a worker in this (child) process and puts its start time, peak RSS and metrics on results."""
+    try:
+        job = base_job.Job(job_file)
+        metrics.reset()
+        started = time.time()
+        backend.run(job)
+        job.flush_entries()
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        results.put({'started': started, 'peak_rss_kb': peak_rss, 'metrics': metrics.summary()})
+    except Exception as ex:
+        results.put({'error': repr(ex)})
+
+
+def run(backend, dataset, timeout):
+    """Runs the worker of a backend on a loaded dataset and returns its result."""
+    sink = common.Sink()
+    config = backend.config(dataset)
+    config['batch'] = {'size': 500}
+    job_file = common.write_job(sink.address, config)
+    result = {'backend': backend.name, 'table': dataset.name, 'rows': dataset.rows,
+              'width': dataset.width, 'vertices': dataset.vertices}
+    try:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_worker, args=(backend, job_file, results))
+        process.start()
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            result['error'] = 'timed out after {0} s'.format(timeout)
+            return result
+        child = results.get(timeout=10)
+        if 'error' in child:
+            result.update(child)
+            return result
+        sink.wait(dataset.rows, timeout=60)
+        seconds = time.time() - child['started']
+        result.update({'seconds': round(seconds, 3),
+                       'rows_per_second': round(dataset.rows / seconds, 1),
+                       'entries': sink.entries,
+                       'bytes': sink.bytes,
+                       'peak_rss_kb': child['peak_rss_kb'],
+                       'metrics': child['metrics']})
+        return result
+    finally:
+        sink.close()
+        os.remove(job_file)
+
+
+def version():
+    """Returns the git description of the checked out version, if there is one."""
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return ''
+
+
+def compare(before_file, after_file):
+    """Prints rows/s and peak RSS of two result files side by side."""
+    before, after = [json.load(open(f)) for f in (before_file, after_file)]
+    key = lambda r: (r['backend'], r['rows'], r['width'], r['vertices'])
+    previous = dict((key(r), r) for r in before['results'] if 'rows_per_second' in r)
+    print('{0:<40} {1:>12} {2:>12} {3:>8} {4:>12}'.format('{0} -> {1}'.format(before['version'], after['version']),
+                                                         'rows/s', 'rows/s', 'ratio', 'peak RSS MB'))
+    for r in after['results']:
+        if 'rows_per_second' not in r or key(r) not in previous:
+            continue
+        p = previous[key(r)]
+        print('{0:<40} {1:>12.0f} {2:>12.0f} {3:>8.2f} {4:>5.0f} {5:>6.0f}'.format(
+            '{0} {1}x{2} v{3}'.format(*key(r)), p['rows_per_second'], r['rows_per_second'],
+            r['rows_per_second'] / p['rows_per_second'], p['peak_rss_kb'] / 1024., r['peak_rss_kb'] / 1024.))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=['dynamodb', 'mongodb', 'mysql', 'sqlserver', 'oracle', 'gdal'])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000])
+    parser.add_argument('--width', type=int, nargs='+', default=[20])
+    parser.add_argument('--vertices', type=int, nargs='+', default=[0, 64])
+    parser.add_argument('--dynamodb-endpoint', default='http://localhost:8000')
+    parser.add_argument('--mongodb-uri', default='mongodb://localhost:27017')
+    parser.add_argument('--mysql', default='')
+    parser.add_argument('--sqlserver', default='')
+    parser.add_argument('--oracle', default='')
+    parser.add_argument('--gdal-driver', default='GPKG')
+    parser.add_argument('--directory', default=os.path.join(os.path.expanduser('~'), '.voyager', 'benchmark'))
+    parser.add_argument('--timeout', type=int, default=3600)
+    parser.add_argument('--output', default='')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    backends = {'dynamodb': lambda: DynamoDBBackend(args.dynamodb_endpoint),
+                'mongodb': lambda: MongoDBBackend(args.mongodb_uri),
+                'mysql': lambda: MySQLBackend(args.mysql),
+                'sqlserver': lambda: SQLServerBackend(args.sqlserver),
+                'oracle': lambda: OracleBackend(args.oracle),
+                'gdal': lambda: GDALBackend(args.directory, args.gdal_driver)}
+    report = {'version': version(), 'python': platform.python_version(), 'host': platform.node(),
+              'started': datetime.datetime.now().isoformat(), 'results': []}
+    for name in args.backends:
+        backend = backends[name]()
+        reason = backend.unavailable()
+        if reason:
+            print('{0:<10} skipped: {1}'.format(name, reason))
+            report['results'].append({'backend': name, 'skipped': reason})
+            continue
+        for rows in args.rows:
+            for width in args.width:
+                for vertices in args.vertices:
+                    dataset = Dataset(rows, width, vertices)
+                    backend.load(dataset)
+                    result = run(backend, dataset, args.timeout)
+                    report['results'].append(result)
+                    if 'error' in result:
+                        print('{0:<10} {1:<28} error: {2}'.format(name, dataset.name, result['error']))
+                    else:
+                        print('{0:<10} {1:<28} {2:>10.0f} rows/s {3:>8.0f} MB peak RSS'.format(
+                            name, dataset.name, result['rows_per_second'], result['peak_rss_kb'] / 1024.))
+
+    output = args.output or 'results-{0}.json'.format(datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    print('Results written to {0}'.format(output))
@@ -0,0 +1,118 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import collections
+sys.path.append(os.path.dirname(os.getcwd()))
+from workers.utils import store
+
+
+class TestChangeStore(unittest.TestCase):
+    """Test case for the delta indexing change store."""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'changes.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_changed_and_deleted(self):
+        """Test only new and changed entries are reported and unseen entries are deleted."""
+        changes = store.ChangeStore(self.path, 'LOCATION')
+        self.assertEqual(1, changes.begin_run())
+        self.assertEqual([True, True, True], [changes.changed(i, 'a') for i in ('1', '2', '3')])
+        self.assertEqual([], changes.deleted())
+        changes.close()
+
+        changes = store.ChangeStore(self.path, 'LOCATION')
+        self.assertEqual(2, changes.begin_run())
+        self.assertFalse(changes.changed('1', 'a'))
+        self.assertTrue(changes.changed('2', 'b'))
+        self.assertTrue(changes.changed('4', 'a'))
+        self.assertEqual(['3'], changes.deleted())
+        changes.close()
+
+    def test_seen_after_send(self):
+        """Test an entry checked with is_changed is only kept once it is marked as seen."""
+        changes = store.ChangeStore(self.path, 'LOCATION')
+        changes.begin_run()
+        self.assertTrue(changes.is_changed('1', 'a'))
+        changes.seen([('2', 'a')])
+        changes.close()
+
+        changes = store.ChangeStore(self.path, 'LOCATION')
+        changes.begin_run()
+        self.assertTrue(changes.is_changed('1', 'a'))
+        self.assertFalse(changes.is_changed('2', 'a'))
+        changes.close()
+
+    def test_failures(self):
+        """Test the tables that failed are kept for the current run only."""
+        changes = store.ChangeStore(self.path, 'LOCATION')
+        changes.begin_run()
+        changes.fail('STATES')
+        other = store.ChangeStore(self.path, 'LOCATION')
+        self.assertEqual(['STATES'], other.failures())
+        other.close()
+        changes.begin_run()
+        self.assertEqual([], changes.failures())
+        changes.close()
+
+    def test_locations(self):
+        """Test the runs and entries of each location are kept apart."""
+        changes = store.ChangeStore(self.path, 'LOCATION')
+        changes.begin_run()
+        changes.changed('1', 'a')
+        other = store.ChangeStore(self.path, 'OTHER')
+        other.begin_run()
+        self.assertTrue(other.changed('1', 'a'))
+        self.assertEqual([], other.deleted())
+        changes.close()
+        other.close()
+
+    def test_checkpoints(self):
+        """Test checkpoints are saved, read back and cleared per location."""
+        checkpoints = store.CheckpointStore(self.path, 'LOCATION')
+        self.assertEqual((None, False), checkpoints.get('STATES'))
+        checkpoints.save({'STATES': ([42, 7], False), 'CITIES': (None, True)})
+        checkpoints.close()
+
+        checkpoints = store.CheckpointStore(self.path, 'LOCATION')
+        self.assertEqual(([42, 7], False), checkpoints.get('STATES'))
+        self.assertEqual((None, True), checkpoints.get('CITIES'))
+        self.assertEqual((None, False), store.CheckpointStore(self.path, 'OTHER').get('STATES'))
+        checkpoints.clear()
+        self.assertEqual((None, False), checkpoints.get('STATES'))
+        checkpoints.close()
+
+    def test_catalog_snapshot(self):
+        """Test a catalog snapshot is only returned for the fingerprint it was saved with, in order."""
+        catalogs = store.CatalogStore(self.path, 'LOCATION')
+        self.assertIsNone(catalogs.get('1:2016-01-01'))
+        tables = collections.OrderedDict([('STATES', {'columns': [['NAME', 'varchar', True]]}), ('CITIES', {})])
+        catalogs.save('1:2016-01-01', {'tables': tables})
+        catalogs.close()
+
+        catalogs = store.CatalogStore(self.path, 'LOCATION')
+        snapshot = catalogs.get('1:2016-01-01')
+        self.assertEqual([['NAME', 'varchar', True]], snapshot['tables']['STATES']['columns'])
+        self.assertEqual(['STATES', 'CITIES'], snapshot['tables'].keys())
+        self.assertIsNone(catalogs.get('2:2016-01-02'))
+        self.assertIsNone(store.CatalogStore(self.path, 'OTHER').get('1:2016-01-01'))
+        catalogs.close()
+
+    def test_resume_tokens(self):
+        """Test resume tokens are kept per collection and location until they are deleted."""
+        tokens = store.ResumeTokenStore(self.path, 'LOCATION')
+        self.assertIsNone(tokens.get('zips'))
+        tokens.save('zips', '{"_data": "825A"}')
+        tokens.save('zips', '{"_data": "825B"}')
+        tokens.close()
+
+        tokens = store.ResumeTokenStore(self.path, 'LOCATION')
+        self.assertEqual('{"_data": "825B"}', tokens.get('zips'))
+        self.assertIsNone(store.ResumeTokenStore(self.path, 'OTHER').get('zips'))
+        tokens.delete('zips')
+        self.assertIsNone(tokens.get('zips'))
+        tokens.close()
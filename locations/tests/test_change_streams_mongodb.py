@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.dirname(os.getcwd()))
+from bson import json_util
+import pymongo
+from workers import base_job, mongodb_worker
+
+
+class TestMongoDBChangeStreams(unittest.TestCase):
+    """Test case for indexing MongoDB changes (requires a local single node replica set named rs0,
+    e.g. "mongod --replSet rs0" and rs.initiate()).
+    """
+    @classmethod
+    def setUpClass(self):
+        job = base_job.Job(os.path.join(os.getcwd(), 'mongodb_change_stream.json'))
+        job.connect_to_database()
+        job.db_connection.drop_collection('changes')
+        job.db_connection['changes'].insert_one({'_id': 1, 'name': 'Denver'})
+
+    def setUp(self):
+        self.job = base_job.Job(os.path.join(os.getcwd(), 'mongodb_change_stream.json'))
+        self.job.connect_to_database()
+        self.col = self.job.db_connection['changes']
+        self.mapper = mongodb_worker.DocumentMapper(self.job, self.col, 'changes')
+
+    def next_entry(self, stream):
+        """Waits for the next change and returns its entry."""
+        change = None
+        while not change:
+            change = stream.try_next()
+        return mongodb_worker.change_entry(self.job, self.mapper, change, {}, None)
+
+    def test_change_entries(self):
+        """Test inserts, updates and replaces are indexed and deletes are deleted. Each change is read
+        right after its write, because the document of an update is looked up when the change is read.
+        """
+        stream = mongodb_worker.watch(self.job, self.col)
+        entries = []
+        self.col.insert_one({'_id': 2, 'name': 'Boulder'})
+        entries.append(self.next_entry(stream))
+        self.col.update_one({'_id': 2}, {'$set': {'name': 'Golden'}})
+        entries.append(self.next_entry(stream))
+        self.col.replace_one({'_id': 1}, {'name': 'Aurora'})
+        entries.append(self.next_entry(stream))
+        self.col.delete_one({'_id': 2})
+        entries.append(self.next_entry(stream))
+        stream.close()
+        self.assertEqual(['ADD', 'ADD', 'ADD', 'DELETE'], [e['action'] for e in entries])
+        self.assertEqual(['2', '2', '1', '2'], [e['id'] for e in entries])
+        self.assertEqual('Golden', entries[1]['entry']['fields']['fs_name'])
+        self.assertEqual('Aurora', entries[2]['entry']['fields']['fs_name'])
+
+    def test_update_of_deleted_document(self):
+        """Test an update is deleted if the document was deleted before the change is read."""
+        stream = mongodb_worker.watch(self.job, self.col)
+        self.col.insert_one({'_id': 4, 'name': 'Boulder'})
+        self.col.update_one({'_id': 4}, {'$set': {'name': 'Golden'}})
+        self.col.delete_one({'_id': 4})
+        entries = [self.next_entry(stream) for _ in range(3)]
+        stream.close()
+        self.assertEqual(['ADD', 'DELETE', 'DELETE'], [e['action'] for e in entries])
+
+    def test_query_filter(self):
+        """Test a document that no longer matches the table query is deleted."""
+        stream = mongodb_worker.watch(self.job, self.col)
+        self.col.insert_one({'_id': 3, 'name': 'Pueblo'})
+        change = None
+        while not change:
+            change = stream.try_next()
+        stream.close()
+        entry = mongodb_worker.change_entry(self.job, self.mapper, change, {'name': 'Denver'}, None)
+        self.assertEqual(('3', 'DELETE'), (entry['id'], entry['action']))
+
+    def test_expired_token(self):
+        """Test a resume token that is not in the oplog cannot be resumed (the collection is scanned)."""
+        stream = mongodb_worker.watch(self.job, self.col)
+        token = stream.resume_token
+        stream.close()
+        self.assertIsNotNone(json_util.loads(json_util.dumps(token)))
+        expired = {'_data': '8200000001000000012B0229296E04'}
+        with self.assertRaises(pymongo.errors.OperationFailure):
+            stream = mongodb_worker.watch(self.job, self.col, expired)
+            stream.try_next()
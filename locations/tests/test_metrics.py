@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.dirname(os.getcwd()))
+from workers.utils import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Test case for the per-table and per-stage metrics."""
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+
+    def test_stages_and_counts(self):
+        """Test stages and counts are totalled per table and for the job."""
+        self.metrics.set_table('STATES')
+        for row in self.metrics.timed('fetch', range(3)):
+            self.metrics.stop('map', self.metrics.start())
+            self.metrics.count('bytes', 10)
+        self.metrics.set_table('CITIES')
+        self.metrics.count('bytes', 5)
+        summary = self.metrics.summary()
+        self.assertEqual(4, summary['tables']['STATES']['stages']['fetch']['calls'])
+        self.assertEqual(3, summary['tables']['STATES']['stages']['map']['calls'])
+        self.assertEqual({'bytes': 30}, summary['tables']['STATES']['counts'])
+        self.assertEqual({'bytes': 35}, summary['counts'])
+
+    def test_disabled(self):
+        """Test nothing is collected when metrics are disabled."""
+        self.metrics.configure(enabled=False)
+        self.metrics.stop('map', self.metrics.start())
+        self.metrics.count('bytes', 10)
+        self.assertEqual([1, 2], list(self.metrics.timed('fetch', [1, 2])))
+        self.assertEqual({}, self.metrics.summary()['tables'])
+
+    def test_merge(self):
+        """Test the summary of a pool process is added to the totals."""
+        other = metrics.Metrics()
+        other.set_table('STATES')
+        other.stop('map', other.start())
+        other.count('entries', 2)
+        self.metrics.set_table('STATES')
+        self.metrics.count('entries', 1)
+        self.metrics.merge(other.summary())
+        self.metrics.merge(None)
+        summary = self.metrics.summary()
+        self.assertEqual(1, summary['stages']['map']['calls'])
+        self.assertEqual(3, summary['counts']['entries'])
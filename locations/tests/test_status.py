@@ -0,0 +1,54 @@
+import os
+import sys
+import unittest
+import StringIO
+sys.path.append(os.path.dirname(os.getcwd()))
+from workers.utils import status
+
+
+class TestProgressWriter(unittest.TestCase):
+    """Test case for the throttled status writer."""
+    def setUp(self):
+        self.writer = status.ProgressWriter(interval=60)
+        self.writer._io = StringIO.StringIO()
+
+    def lines(self):
+        return self.writer._io.getvalue().splitlines()
+
+    def test_line_protocol(self):
+        """Test a percent update is written as one status line."""
+        status.Writer.send_percent(self.writer, 0.5, 'STATES: 50%', 'sql_server')
+        self.assertEqual(['>>STATUS>>M=STATES: 50%>>P=0.500>>N=sql_server>>STATUS'], self.lines())
+
+    def test_coalesced(self):
+        """Test updates within the interval are held until the table completes or the writer is flushed."""
+        for i in range(1, 1001):
+            self.writer.progress('STATES', i, 2000, 'sql_server', i * 100)
+        self.assertEqual(1, len(self.lines()))
+        self.writer.send_percent(0.75, 'STATES: 75%', 'sql_server')
+        self.writer.flush()
+        self.assertEqual(2, len(self.lines()))
+        self.assertIn('>>P=0.750', self.lines()[-1])
+        self.writer.progress('STATES', 2000, 2000, 'sql_server')
+        self.assertIn('>>P=1.000', self.lines()[-1])
+        self.assertIn('rows/s', self.lines()[-1])
+
+    def test_flush_progress(self):
+        """Test the last held progress update is sent when the writer is flushed."""
+        for i in range(1, 1501):
+            self.writer.progress('STATES', i, 2000, 'sql_server', i * 100)
+        self.writer.flush()
+        self.assertEqual(2, len(self.lines()))
+        self.assertIn('M=STATES: 75.0% (', self.lines()[-1])
+        self.assertIn('>>P=0.750', self.lines()[-1])
+        self.writer.flush()
+        self.assertEqual(2, len(self.lines()))
+
+    def test_estimated_total(self):
+        """Test a table that passes its estimated row count stays below 100% until it completes."""
+        self.writer.interval = 0
+        self.writer.progress('STATES', 2500, 2000, 'sql_server')
+        self.assertIn('>>P=0.990', self.lines()[-1])
+        self.assertNotIn('ETA', self.lines()[-1])
+        self.writer.progress('STATES', 3000, 3000, 'sql_server')
+        self.assertIn('>>P=1.000', self.lines()[-1])
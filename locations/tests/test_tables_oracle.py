@@ -46,3 +46,17 @@ class TestOracleTables(unittest.TestCase):
         job = base_job.Job(os.path.join(os.getcwd(), 'tables_wildcards_oracle.json'))
         job.connect_to_database()
         self.assertEqual(['RUNWAYA', 'RUNWAYL'], sorted(oracle_worker.get_tables(job)))
+
+    def test_table_chunks(self):
+        """Test the ROWID hash chunks of a split table cover each row once."""
+        job = base_job.Job(os.path.join(os.getcwd(), 'split_table_oracle.json'))
+        job.connect_to_database()
+        self.assertEqual(['RUNWAYL'], oracle_worker.get_tables(job))
+        chunks = job.get_table_split('RUNWAYL')[0]
+        self.assertEqual(4, chunks)
+        row_count = job.execute_query("select count(*) from RUNWAYL").fetchone()[0]
+        chunk_counts = []
+        for chunk in range(chunks):
+            qry = oracle_worker.get_select(['count(*)'], 'RUNWAYL', oracle_worker.get_chunk_filter(chunks, chunk))
+            chunk_counts.append(job.execute_query(qry).fetchone()[0])
+        self.assertEqual(row_count, sum(chunk_counts))
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.dirname(os.getcwd()))
+from workers import base_job, postgresql_worker
+
+
+class TestPostgreSQLTables(unittest.TestCase):
+    """Test case for indexing PostgreSQL tables (requires a local PostgreSQL database named test with PostGIS)."""
+    @classmethod
+    def setUpClass(self):
+        job = base_job.Job(os.path.join(os.getcwd(), 'postgresql_all.json'))
+        job.connect_to_database()
+        job.db_cursor.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+        job.db_cursor.execute('DROP TABLE IF EXISTS states, cities')
+        job.db_cursor.execute('CREATE TABLE states (id integer PRIMARY KEY, name varchar(50), geom geometry(Polygon, 4326))')
+        job.db_cursor.execute('CREATE TABLE cities (name text, population bigint, geom geometry(Point, 4326))')
+        job.db_cursor.execute("INSERT INTO states VALUES (1, 'Colorado', "
+                              "ST_GeomFromText('POLYGON((-109 37, -102 37, -102 41, -109 41, -109 37))', 4326))")
+        job.db_cursor.execute("INSERT INTO cities VALUES ('Denver', 715522, ST_GeomFromText('POINT(-104.99 39.74)', 4326))")
+        job.db_cursor.execute('ANALYZE states')
+        job.db_connection.commit()
+
+    def test_all_tables(self):
+        """Test all tables are returned for indexing."""
+        job = base_job.Job(os.path.join(os.getcwd(), 'postgresql_all.json'))
+        job.connect_to_database()
+        tables = postgresql_worker.get_tables(job)
+        self.assertIn(('public', 'states'), tables)
+        self.assertIn(('public', 'cities'), tables)
+        self.assertNotIn(('public', 'spatial_ref_sys'), tables)
+
+    def test_one_table(self):
+        """Test one table and its columns are returned for indexing."""
+        job = base_job.Job(os.path.join(os.getcwd(), 'postgresql_one.json'))
+        job.connect_to_database()
+        tables = postgresql_worker.get_tables(job)
+        self.assertEqual([('public', 'states')], tables.keys())
+        columns = tables[('public', 'states')]['columns']
+        self.assertEqual(['id', 'name', 'geom'], [c.name for c in columns])
+        self.assertTrue(columns[0].primary_key)
+        self.assertEqual('geometry(Polygon,4326)', columns[2].full_type)
+        self.assertEqual(1, tables[('public', 'states')]['row_count'])
+
+    def test_geometry(self):
+        """Test the SRID and envelope of a geometry column are read from PostGIS."""
+        job = base_job.Job(os.path.join(os.getcwd(), 'postgresql_one.json'))
+        job.connect_to_database()
+        column = postgresql_worker.get_tables(job)[('public', 'states')]['columns'][2]
+        self.assertEqual(4326, postgresql_worker.get_srid(job, 'public.states', column))
+        job.db_cursor.execute('SELECT {0} FROM states'.format(', '.join(postgresql_worker.get_geometry_select(job, column))))
+        self.assertEqual((-109, 37, -102, 41, 'POLYGON'), job.db_cursor.fetchone()[:5])
+
@@ -29,3 +29,10 @@ class TestSQLServerTables(unittest.TestCase):
         job = base_job.Job(os.path.join(os.getcwd(), 'sql_server_include_exclude.json'))
         job.connect_to_database()
         self.assertEqual([u'STATES_TABLE', u'STATES', u'CITIES', u'RIVERS'], sql_worker.get_tables(job))
+
+    def test_table_split(self):
+        """Test the split count and split column of a table."""
+        job = base_job.Job(os.path.join(os.getcwd(), 'sql_server_split.json'))
+        job.tables_to_keep()
+        self.assertEqual((8, 'OBJECTID'), job.get_table_split('STATES'))
+        self.assertEqual((1, ''), job.get_table_split('CITIES'))
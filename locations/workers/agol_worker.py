@@ -15,11 +15,14 @@ from __future__ import division
 import os
 import copy
 import datetime
+import itertools
+import Queue
+from multiprocessing.pool import ThreadPool
 from collections import OrderedDict
 import hashlib
 from utils import status
 
-status_writer = status.Writer()
+status_writer = status.ProgressWriter()
 
 
 class NullGeometry(Exception):
@@ -51,7 +54,6 @@ def index_service(connection_info):
     geometry_ops = worker_utils.GeometryOps()
     geo_json_converter = worker_utils.GeoJSONConverter()
     job.connect_to_zmq()
-    entry = {}
     items = {}
     url = ''
 
@@ -77,7 +79,8 @@ def index_service(connection_info):
         verify_ssl = True
 
     # Create the ArcGIS service helper and get the service url and the service items (layers/tables).
-    ags_helper = worker_utils.ArcGISServiceHelper(connection_url, user_name, password, verify_ssl, instance=instance)
+    ags_helper = worker_utils.ArcGISServiceHelper(connection_url, user_name, password, verify_ssl, instance=instance,
+                                                  pool_size=get_threads(connection_info))
     try:
         if token == '' and generate_token == 'false':
             url, items = ags_helper.find_item_url(service_name, service_type, folder_name)
@@ -114,18 +117,17 @@ def index_service(connection_info):
         else:
             layers_process += [l for l in layers if lk[0] == l['name']]
 
-    # Index the records for each layer and table within a feature or map service.
+    # Gather the fields, filter, row count and page size of each layer and table within the service.
     skip_tables = job.tables_to_skip()
+    service_layers = []
     for layer in layers_process:
         if layer['name'] in skip_tables:
             continue
-        i = 0.
-        geo = {}
         layer_id = layer['id']
         layer_name = layer['name']
-        mapped_attributes = OrderedDict()
-
-        status_writer.send_status('Indexing {0}...'.format((url, layer_name)))
+        checkpoint_name = '{0}/{1}'.format(url, layer_id)
+        if job.is_done(checkpoint_name):
+            continue
 
         # Get the list of fields and field types.
         fields_types = {}
@@ -137,7 +139,7 @@ def index_service(connection_info):
         for f in fields:
             fields_types[f['name']] = f['type']
 
-        # Check if the layer is empty and ensure to get all features, not just first 1000 (esri default).
+        # Check if the layer is empty and ensure to get all features, not just the first page (maxRecordCount).
         query = job.get_table_query(layer_name)
         if query:
             where_clause = query
@@ -146,227 +148,303 @@ def index_service(connection_info):
         else:
             where_clause = "1=1"
 
+        page_size = ags_helper.get_max_record_count(url, layer_id, ags_helper.token)
         try:
-            groups, row_count = ags_helper.get_item_row_count(url, layer_id, ags_helper.token, where_clause)
+            groups, row_count = ags_helper.get_item_row_count(url, layer_id, ags_helper.token, where_clause, page_size)
         except Exception:
             where_clause = "1=1"
-            groups, row_count = ags_helper.get_item_row_count(url, layer_id, ags_helper.token, where_clause)
+            groups, row_count = ags_helper.get_item_row_count(url, layer_id, ags_helper.token, where_clause, page_size)
 
-        oid_field_name = ags_helper.oid_field_name
         if not row_count:
             status_writer.send_status("Layer {0} has no features.".format(layer_name))
             continue
+
+        # Resume from the first page that was not indexed.
+        resume_offset = job.get_checkpoint(checkpoint_name) or 0
+        groups = [group for group in groups if group >= resume_offset]
+
+        status_writer.send_status('Indexing {0}...'.format((url, layer_name)))
+        service_layers.append({'layer': layer, 'url': url, 'fields_types': fields_types, 'where': where_clause,
+                               'page_size': page_size, 'groups': groups, 'row_count': row_count,
+                               'checkpoint': checkpoint_name, 'pending': set(groups),
+                               'increment': float(job.get_increment(row_count)), 'processed': 0,
+                               'geo': {}, 'mapped_attributes': OrderedDict()})
+
+    # Index the records for each layer and table within a feature or map service.
+    for service_layer, group, rows in fetch_pages(ags_helper, service_layers, get_threads(connection_info)):
+        index_page(service_layer, group, rows, geo_json_converter, geometry_ops)
+        # Pages complete out of order, so the checkpoint is the offset of the first page still pending.
+        pending = service_layer['pending']
+        pending.discard(group)
+        if pending:
+            job.checkpoint(service_layer['checkpoint'], min(pending))
         else:
-            increment = float(job.get_increment(row_count))
-
-        for group in groups:
-            rows = ags_helper.get_item_rows(url, layer_id, ags_helper.token, where=where_clause, resultOffset=group, resultRecordCount=1000, response_format='geojson')
-            features = None
-            if 'features' in rows:
-                features = rows['features']
-            if not features:
-                status_writer.send_status("Layer {0} has no features.".format(layer_name))
-                continue
-            if 'properties' in features[0]:
-                attributes = OrderedDict(features[0]['properties'])
-            elif 'attributes' in features[0]:
-                attributes = OrderedDict(features[0]['attributes'])
-            else:
-                status_writer.send_status("Layer {0} has no attributes.".format(layer_name))
-
-            if 'geometry' in features[0] and features[0]['geometry']:
-                if 'type' in features[0]['geometry']:
-                    geometry_type = features[0]['geometry']['type']
-                elif 'rings' in features[0]['geometry']:
-                    geometry_type = 'Rings'
-                elif 'paths' in features[0]['geometry']:
-                    geometry_type = 'Paths'
-                elif 'x' in features[0]['geometry'] and 'y' in features[0]['geometry']:
-                    geometry_type = 'Point'
+            job.checkpoint(service_layer['checkpoint'], None, done=True)
+    job.flush_entries()
+
+
+def get_threads(connection_info):
+    """Returns the number of pages to request at the same time (default is 4)."""
+    try:
+        return max(int(connection_info['threads']), 1)
+    except (KeyError, ValueError):
+        return 4
+
+
+def get_page(args):
+    """Request one page of features for a layer. Errors are returned so they can be raised by the caller."""
+    ags_helper, service_layer, group = args
+    try:
+        rows = ags_helper.get_item_rows(service_layer['url'], service_layer['layer']['id'], ags_helper.token,
+                                        where=service_layer['where'], resultOffset=group,
+                                        resultRecordCount=service_layer['page_size'], response_format='geojson')
+    except Exception as ex:
+        rows = ex
+    return service_layer, group, rows
+
+
+def fetch_pages(ags_helper, service_layers, threads):
+    """Yields (service layer, offset, rows) for every page of every layer as the pages arrive.
+    Up to threads pages are requested at once, and no more than twice that are held in memory.
+    """
+    tasks = ((ags_helper, service_layer, group) for service_layer in service_layers for group in service_layer['groups'])
+    pages = Queue.Queue()
+    pool = ThreadPool(threads)
+    try:
+        pending = 0
+        for task in itertools.islice(tasks, threads * 2):
+            pool.apply_async(get_page, (task,), callback=pages.put)
+            pending += 1
+        while pending:
+            service_layer, group, rows = pages.get()
+            pending -= 1
+            if isinstance(rows, Exception):
+                raise rows
+            for task in itertools.islice(tasks, 1):
+                pool.apply_async(get_page, (task,), callback=pages.put)
+                pending += 1
+            yield service_layer, group, rows
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def index_page(service_layer, group, rows, geo_json_converter, geometry_ops):
+    """Index one page of features or records from a service layer or table."""
+    entry = {}
+    layer = service_layer['layer']
+    layer_id = layer['id']
+    layer_name = layer['name']
+    url = service_layer['url']
+    fields_types = service_layer['fields_types']
+    row_count = service_layer['row_count']
+    geo = service_layer['geo']
+    mapped_attributes = service_layer['mapped_attributes']
+
+    features = None
+    if 'features' in rows:
+        features = rows['features']
+    if not features:
+        status_writer.send_status("Layer {0} has no features.".format(layer_name))
+        return
+    if 'properties' in features[0]:
+        attributes = OrderedDict(features[0]['properties'])
+    elif 'attributes' in features[0]:
+        attributes = OrderedDict(features[0]['attributes'])
+    else:
+        status_writer.send_status("Layer {0} has no attributes.".format(layer_name))
+
+    if 'geometry' in features[0] and features[0]['geometry']:
+        if 'type' in features[0]['geometry']:
+            geometry_type = features[0]['geometry']['type']
+        elif 'rings' in features[0]['geometry']:
+            geometry_type = 'Rings'
+        elif 'paths' in features[0]['geometry']:
+            geometry_type = 'Paths'
+        elif 'x' in features[0]['geometry'] and 'y' in features[0]['geometry']:
+            geometry_type = 'Point'
+    else:
+        geometry_type = 'Table'
+    if 'crs' in rows:
+        if ':' in rows['crs']['properties']['name']:
+            geo['srid'] = rows['crs']['properties']['name'].split(':')[1]
+        else:
+            geo['srid'] = rows['crs']['properties']['name']
+    elif 'spatialReference' in rows:
+        geo['srid'] = rows['spatialReference']['wkid']
+    # Map the field and it's value.
+    if not job.fields_to_keep == ['*']:
+        for fk in job.fields_to_keep:
+            mapped_fields = dict((name, val) for name, val in attributes.items() if fk in name)
+            if job.fields_to_skip:
+                for fs in job.fields_to_skip:
+                    [mapped_fields.pop(name) for name in attributes if name in fs]
+    else:
+        mapped_fields = copy.deepcopy(attributes)
+
+    date_fields = set()
+    field_map = None
+    for mapping in job.field_mapping:
+        if mapping['name'] == layer_name:
+            field_map = mapping['map']
+            break
+
+    if not field_map:
+        for mapping in job.field_mapping:
+            if mapping['name'] == '*':
+                field_map = mapping['map']
+                break
+
+    if field_map:
+        for k, v in mapped_fields.items():
+            if k in field_map:
+                new_field = field_map[k]
+                mapped_attributes[new_field] = mapped_fields.pop(k)
             else:
-                geometry_type = 'Table'
-            if 'crs' in rows:
-                if ':' in rows['crs']['properties']['name']:
-                    geo['srid'] = rows['crs']['properties']['name'].split(':')[1]
+                field_type = job.default_mapping(fields_types[k])
+                if field_type == 'fd_':
+                    # Because dates are being returned as longs.
+                    mapped_attributes[field_type + k] = v
+                    date_fields.add(field_type + k)
                 else:
-                    geo['srid'] = rows['crs']['properties']['name']
-            elif 'spatialReference' in rows:
-                geo['srid'] = rows['spatialReference']['wkid']
-            # Map the field and it's value.
-            if not job.fields_to_keep == ['*']:
-                for fk in job.fields_to_keep:
-                    mapped_fields = dict((name, val) for name, val in attributes.items() if fk in name)
-                    if job.fields_to_skip:
-                        for fs in job.fields_to_skip:
-                            [mapped_fields.pop(name) for name in attributes if name in fs]
+                    mapped_attributes[field_type + k] = mapped_fields.pop(k)
+    else:
+        for k, v in mapped_fields.items():
+            field_type = job.default_mapping(fields_types[k])
+            if field_type == 'fd_':
+                # Because dates are being returned as longs.
+                mapped_attributes[field_type + k] = v
+                date_fields.add(field_type + k)
             else:
-                mapped_fields = copy.deepcopy(attributes)
-
-            # This will generate the field mapping dictionary.
-            job.tables_to_keep()
-
-            date_fields = set()
-            field_map = None
-            for mapping in job.field_mapping:
-                if mapping['name'] == layer_name:
-                    field_map = mapping['map']
-                    break
-
-            if not field_map:
-                for mapping in job.field_mapping:
-                    if mapping['name'] == '*':
-                        field_map = mapping['map']
-                        break
-
-            if field_map:
-                for k, v in mapped_fields.items():
-                    if k in field_map:
-                        new_field = field_map[k]
-                        mapped_attributes[new_field] = mapped_fields.pop(k)
-                    else:
-                        field_type = job.default_mapping(fields_types[k])
-                        if field_type == 'fd_':
-                            # Because dates are being returned as longs.
-                            mapped_attributes[field_type + k] = v
-                            date_fields.add(field_type + k)
-                        else:
-                            mapped_attributes[field_type + k] = mapped_fields.pop(k)
+                mapped_attributes[field_type + k] = mapped_fields.pop(k)
+
+    # Pages arrive out of order, so the id counter is the end offset of this page rather than a running total.
+    i = group + len(features)
+    if geometry_type == 'Table':
+        for x, row in enumerate(features):
+            hash_obj = hashlib.md5(os.path.join(url, '{0}_{1}_{2}_{3}'.format(job.location_id, layer_name, float(i), x)))
+            entry['id'] = hash_obj.hexdigest()
+            entry['location'] = job.location_id
+            entry['action'] = job.action_type
+            if 'properties' in row:
+                mapped_fields = dict(zip(mapped_attributes.keys(), row['properties'].values()))
             else:
-                for k, v in mapped_fields.items():
-                    field_type = job.default_mapping(fields_types[k])
-                    if field_type == 'fd_':
-                        # Because dates are being returned as longs.
-                        mapped_attributes[field_type + k] = v
-                        date_fields.add(field_type + k)
+                mapped_fields = dict(zip(mapped_attributes.keys(), row['attributes'].values()))
+            # Convert longs to datetime.
+            for df in date_fields:
+                mapped_fields[df] = get_date(mapped_fields[df])
+            mapped_fields['id'] = entry['id']
+            mapped_fields['meta_table_name'] = layer_name
+            mapped_fields['_discoveryID'] = job.discovery_id
+            mapped_fields['format_category'] = 'GIS'
+            mapped_fields['format_type'] = 'Service Layer Record'
+            mapped_fields['format'] = 'application/vnd.esri.service.layer.record'
+            entry['entry'] = {'fields': mapped_fields}
+            job.send_entry(entry)
+    else:
+        # Faster to do one if check for geometry type then to condense code and check in every iteration.
+        if geometry_type == 'Point':
+            for x, feature in enumerate(features, 1):
+                if 'type' not in feature['geometry']:
+                    pt = feature['geometry']
+                    geo['lon'] = pt['x']
+                    geo['lat'] = pt['y']
+                else:
+                    geo['wkt'] = geo_json_converter.convert_to_wkt(feature['geometry'], 14)
+                hash_obj = hashlib.md5(os.path.join(url, '{0}_{1}_{2}_{3}'.format(job.location_id, layer_name, int(i), x)))
+                entry['id'] = hash_obj.hexdigest()
+                entry['location'] = job.location_id
+                entry['action'] = job.action_type
+                if 'properties' in feature:
+                    mapped_fields = dict(zip(mapped_attributes.keys(), feature['properties'].values()))
+                else:
+                    mapped_fields = dict(zip(mapped_attributes.keys(), feature['attributes'].values()))
+                # Convert longs to datetime.
+                for df in date_fields:
+                    mapped_fields[df] = get_date(mapped_fields[df])
+                mapped_fields['id'] = entry['id']
+                mapped_fields['_discoveryID'] = job.discovery_id
+                mapped_fields['geometry_type'] = 'Point'
+                mapped_fields['meta_table_name'] = layer_name
+                mapped_fields['format_category'] = 'GIS'
+                mapped_fields['format_type'] = 'Service Layer Feature'
+                mapped_fields['format'] = 'application/vnd.esri.service.layer.record'
+                entry['entry'] = {'geo': geo, 'fields': mapped_fields}
+                job.send_entry(entry)
+        else:
+            generalize_value = job.generalize_value
+            for x, feature in enumerate(features, 1):
+                try:
+                    # geometry = make_feature(feature)  # Catch possible null geometries.
+                    if geometry_type == 'Rings':
+                        geometry = geo_json_converter.create_polygon(feature['geometry']['rings'][0])
+                    elif geometry_type == 'Paths':
+                        geometry = geo_json_converter.create_polyline(feature['geometry']['paths'][0])
+                    elif geometry_type == 'LineString':
+                        geometry = geo_json_converter.create_polyline(feature['geometry']['coordinates'])
                     else:
-                        mapped_attributes[field_type + k] = mapped_fields.pop(k)
-
-            i += len(features)
-            if geometry_type == 'Table':
-                for x, row in enumerate(features):
-                    hash_obj = hashlib.md5(os.path.join(url, '{0}_{1}_{2}_{3}'.format(job.location_id, layer_name, i, x)))
-                    entry['id'] = hash_obj.hexdigest()
-                    entry['location'] = job.location_id
-                    entry['action'] = job.action_type
-                    if 'properties' in row:
-                        mapped_fields = dict(zip(mapped_attributes.keys(), row['properties'].values()))
+                        geometry = geo_json_converter.convert_to_wkt(feature['geometry'], 14)
+                except RuntimeError:
+                    continue
+
+                # if generalize_value > 0.9:
+                #     geo['xmin'], geo['xmax'] = geometry.extent.XMin, geometry.extent.XMax
+                #     geo['ymin'], geo['ymax'] = geometry.extent.YMin, geometry.extent.YMax
+                if geometry:
+                    if generalize_value == 0 or generalize_value == 0.0:
+                        if isinstance(geometry, str):
+                            geo['wkt'] = geometry
+                        else:
+                            geo['wkt'] = geometry.WKT
                     else:
-                        mapped_fields = dict(zip(mapped_attributes.keys(), row['attributes'].values()))
+                        if geometry_ops:
+                            geo['wkt'] = geometry_ops.generalize_geometry(geometry, generalize_value)
+                        else:
+                            geo['wkt'] = geometry.WKT
+                        # geo['xmin'], geo['xmax'] = geometry.extent.XMin, geometry.extent.XMax
+                        # geo['ymin'], geo['ymax'] = geometry.extent.YMin, geometry.extent.YMax
+
+                hash_obj = hashlib.md5(os.path.join(url, '{0}_{1}_{2}_{3}'.format(job.location_id, layer_name, int(i), x)))
+                entry['id'] = hash_obj.hexdigest()
+                entry['location'] = job.location_id
+                entry['action'] = job.action_type
+                if 'properties' in feature:
+                    mapped_fields = dict(zip(mapped_attributes.keys(), OrderedDict(feature['properties']).values()))
+                else:
+                    mapped_fields = dict(
+                        zip(mapped_attributes.keys(), OrderedDict(feature['attributes']).values()))
+                try:
                     # Convert longs to datetime.
                     for df in date_fields:
                         mapped_fields[df] = get_date(mapped_fields[df])
-                    mapped_fields['id'] = entry['id']
+                    if geometry_type in ('Paths', 'LineString'):
+                        mapped_fields['geometry_type'] = 'Polyline'
+                    elif geometry_type == 'Rings':
+                        mapped_fields['geometry_type'] = 'Polygon'
+                    else:
+                        mapped_fields['geometry_type'] = geometry_type
                     mapped_fields['meta_table_name'] = layer_name
-                    mapped_fields['_discoveryID'] = job.discovery_id
+                    try:
+                        mapped_fields['meta_table_path'] = layer['path']
+                    except KeyError:
+                        layer['path'] = url + '/' + str(layer_id)
+                        mapped_fields['meta_table_path'] = layer['path']
+                    mapped_fields['id'] = entry['id']
+                    mapped_fields['meta_table_location'] = os.path.dirname(layer['path'])
                     mapped_fields['format_category'] = 'GIS'
-                    mapped_fields['format_type'] = 'Service Layer Record'
+                    mapped_fields['format_type'] = 'Service Layer Feature'
                     mapped_fields['format'] = 'application/vnd.esri.service.layer.record'
-                    entry['entry'] = {'fields': mapped_fields}
+                    mapped_fields['_discoveryID'] = job.discovery_id
+                    entry['entry'] = {'geo': geo, 'fields': mapped_fields}
                     job.send_entry(entry)
-                    if (x % increment) == 0:
-                        status_writer.send_percent(i / row_count, "{0} {1:%}".format(layer_name, i / row_count), 'agol_worker')
-            else:
-                # Faster to do one if check for geometry type then to condense code and check in every iteration.
-                if geometry_type == 'Point':
-                    for x, feature in enumerate(features, 1):
-                        if 'type' not in feature['geometry']:
-                            pt = feature['geometry']
-                            geo['lon'] = pt['x']
-                            geo['lat'] = pt['y']
-                        else:
-                            geo['wkt'] = geo_json_converter.convert_to_wkt(feature['geometry'], 14)
-                        hash_obj = hashlib.md5(os.path.join(url, '{0}_{1}_{2}_{3}'.format(job.location_id, layer_name, int(i), x)))
-                        entry['id'] = hash_obj.hexdigest()
-                        entry['location'] = job.location_id
-                        entry['action'] = job.action_type
-                        if 'properties' in feature:
-                            mapped_fields = dict(zip(mapped_attributes.keys(), feature['properties'].values()))
-                        else:
-                            mapped_fields = dict(zip(mapped_attributes.keys(), feature['attributes'].values()))
-                        # Convert longs to datetime.
-                        for df in date_fields:
-                            mapped_fields[df] = get_date(mapped_fields[df])
-                        mapped_fields['id'] = entry['id']
-                        mapped_fields['_discoveryID'] = job.discovery_id
-                        mapped_fields['geometry_type'] = 'Point'
-                        mapped_fields['meta_table_name'] = layer_name
-                        mapped_fields['format_category'] = 'GIS'
-                        mapped_fields['format_type'] = 'Service Layer Feature'
-                        mapped_fields['format'] = 'application/vnd.esri.service.layer.record'
-                        entry['entry'] = {'geo': geo, 'fields': mapped_fields}
-                        job.send_entry(entry)
-                        if (x % increment) == 0:
-                            status_writer.send_percent(i / row_count, "{0} {1:%}".format(layer_name, i / row_count), 'agol_worker')
-                else:
-                    generalize_value = job.generalize_value
-                    for x, feature in enumerate(features, 1):
-                        try:
-                            # geometry = make_feature(feature)  # Catch possible null geometries.
-                            if geometry_type == 'Rings':
-                                geometry = geo_json_converter.create_polygon(feature['geometry']['rings'][0])
-                            elif geometry_type == 'Paths':
-                                geometry = geo_json_converter.create_polyline(feature['geometry']['paths'][0])
-                            elif geometry_type == 'LineString':
-                                geometry = geo_json_converter.create_polyline(feature['geometry']['coordinates'])
-                            else:
-                                geometry = geo_json_converter.convert_to_wkt(feature['geometry'], 14)
-                        except RuntimeError:
-                            continue
-
-                        # if generalize_value > 0.9:
-                        #     geo['xmin'], geo['xmax'] = geometry.extent.XMin, geometry.extent.XMax
-                        #     geo['ymin'], geo['ymax'] = geometry.extent.YMin, geometry.extent.YMax
-                        if geometry:
-                            if generalize_value == 0 or generalize_value == 0.0:
-                                if isinstance(geometry, str):
-                                    geo['wkt'] = geometry
-                                else:
-                                    geo['wkt'] = geometry.WKT
-                            else:
-                                if geometry_ops:
-                                    geo['wkt'] = geometry_ops.generalize_geometry(geometry, generalize_value)
-                                else:
-                                    geo['wkt'] = geometry.WKT
-                                # geo['xmin'], geo['xmax'] = geometry.extent.XMin, geometry.extent.XMax
-                                # geo['ymin'], geo['ymax'] = geometry.extent.YMin, geometry.extent.YMax
-
-                        hash_obj = hashlib.md5(os.path.join(url, '{0}_{1}_{2}_{3}'.format(job.location_id, layer_name, int(i), x)))
-                        entry['id'] = hash_obj.hexdigest()
-                        entry['location'] = job.location_id
-                        entry['action'] = job.action_type
-                        if 'properties' in feature:
-                            mapped_fields = dict(zip(mapped_attributes.keys(), OrderedDict(feature['properties']).values()))
-                        else:
-                            mapped_fields = dict(
-                                zip(mapped_attributes.keys(), OrderedDict(feature['attributes']).values()))
-                        try:
-                            # Convert longs to datetime.
-                            for df in date_fields:
-                                mapped_fields[df] = get_date(mapped_fields[df])
-                            if geometry_type in ('Paths', 'LineString'):
-                                mapped_fields['geometry_type'] = 'Polyline'
-                            elif geometry_type == 'Rings':
-                                mapped_fields['geometry_type'] = 'Polygon'
-                            else:
-                                mapped_fields['geometry_type'] = geometry_type
-                            mapped_fields['meta_table_name'] = layer_name
-                            try:
-                                mapped_fields['meta_table_path'] = layer['path']
-                            except KeyError:
-                                layer['path'] = url + '/' + str(layer_id)
-                                mapped_fields['meta_table_path'] = layer['path']
-                            mapped_fields['id'] = entry['id']
-                            mapped_fields['meta_table_location'] = os.path.dirname(layer['path'])
-                            mapped_fields['format_category'] = 'GIS'
-                            mapped_fields['format_type'] = 'Service Layer Feature'
-                            mapped_fields['format'] = 'application/vnd.esri.service.layer.record'
-                            mapped_fields['_discoveryID'] = job.discovery_id
-                            entry['entry'] = {'geo': geo, 'fields': mapped_fields}
-                            job.send_entry(entry)
-                        except KeyError:
-                            job.send_entry(entry)
-                        if (i % increment) == 0:
-                            status_writer.send_percent(i / row_count, "{0} {1:%}".format(layer_name, i / row_count), 'agol_worker')
+                except KeyError:
+                    job.send_entry(entry)
+
+    service_layer['processed'] += len(features)
+    processed = service_layer['processed']
+    if (processed % service_layer['increment']) < len(features) or processed == row_count:
+        status_writer.send_percent(processed / row_count, "{0} {1:%}".format(layer_name, processed / row_count), 'agol_worker')
 
 
 def run_job(esri_job):
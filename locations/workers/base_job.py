@@ -17,51 +17,291 @@ import datetime
 import copy
 import math
 import sys
+import time
 import decimal
+import threading
+import operator
+import hashlib
+import uuid
+from itertools import izip
+import Queue
 import zmq
+from utils import status
+from utils import store
+from utils import metrics
+
+
+# Queued by flush_entries() to tell the sender thread to send the current batch.
+_FLUSH = object()
+
+
+def _snapshot(obj):
+    """Copy the dicts and lists of an entry so a worker can reuse them while
+    the copy waits in the send queue. Values are not copied.
+    """
+    if isinstance(obj, dict):
+        return dict((k, _snapshot(v)) for k, v in obj.iteritems())
+    elif isinstance(obj, list):
+        return [_snapshot(v) for v in obj]
+    return obj
+
+
+# Characters found in text. A byte string with any other character is treated as binary.
+_TEXT_CHARS = ''.join(map(chr, [7, 8, 9, 10, 12, 13, 27] + range(0x20, 0x100)))
+
+
+def is_binary_string(data):
+    """Returns True if a byte string contains binary (non-text) characters."""
+    return bool(data.translate(None, _TEXT_CHARS))
+
+
+def _encode_decimal(obj):
+    return float(obj)
+
+
+def _encode_datetime(obj):
+    # Format date to iso 8601
+    try:
+        if obj.tzinfo:
+            return obj.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')
+        else:
+            return obj.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        # For dates before 1900.
+        date_str = datetime.datetime.isoformat(obj) + 'Z'
+        return date_str
+    except Exception:
+        return list(obj.timetuple())[0:6]
+
+
+def _encode_memoryview(obj):
+    if not is_binary_string(obj.tobytes()):
+        return str(obj)
+    else:
+        return None
+
+
+def _encode_buffer(obj):
+    if not is_binary_string(str(obj)):
+        return str(obj)
+    else:
+        return None
+
+
+def _encode_lob(obj):
+    import cx_Oracle
+    if not is_binary_string(cx_Oracle.LOB.read(obj, 1024)):
+        return str(obj)
+    else:
+        return None
+
+
+def _encode_unknown(obj):
+    """Values of unsupported types are indexed as null."""
+    return None
+
+
+# Handlers for non-native types, keyed by type.
+_type_handlers = {decimal.Decimal: _encode_decimal,
+                  datetime.datetime: _encode_datetime,
+                  memoryview: _encode_memoryview}
+
+# Handler found for each type seen so far (including subclasses of registered types).
+_resolved_handlers = {}
+
+
+def register_type(types, handler):
+    """Register a function that converts values of the given type(s) to a serializable value."""
+    if not isinstance(types, (list, tuple)):
+        types = (types,)
+    for t in types:
+        _type_handlers[t] = handler
+    _resolved_handlers.clear()
+
+
+def register_oracle_types():
+    """Register handlers for cx_Oracle LOB values."""
+    os.environ["NLS_LANG"] = ".AL32UTF8"
+    try:
+        import cx_Oracle
+    except ImportError:
+        return
+    register_type(cx_Oracle.LOB, _encode_lob)
+    if isinstance(cx_Oracle.CLOB, type):
+        register_type(cx_Oracle.CLOB, str)
+    # BLOB values fetched inline (see oracle_lob_handler).
+    register_type(buffer, _encode_buffer)
+
+
+def oracle_lob_handler(lob_size):
+    """Returns a cx_Oracle output type handler that fetches CLOB, NCLOB and BLOB values inline with
+    the rows, instead of as LOB locators that are read with a round trip per value. CLOB values
+    longer than lob_size bytes (UTF-8) are truncated on a character boundary and larger BLOB values
+    are skipped (indexed as null). Long and binary variables grow to the size of each value, so
+    an oversized value is still fetched in full before it is truncated or skipped.
+    """
+    import cx_Oracle
+
+    def clob_value(value):
+        if value is not None and len(value) > lob_size:
+            metrics.count('lobs_truncated')
+            if isinstance(value, str):
+                # UTF-8 (see NLS_LANG), so a character cut in two at the end is dropped.
+                return value[:lob_size].decode('utf-8', 'ignore')
+            return value[:lob_size]
+        return value
+
+    def blob_value(value):
+        if value is not None and len(value) > lob_size:
+            metrics.count('lobs_skipped')
+            return None
+        return buffer(value) if value is not None else None
+
+    def handler(cursor, name, default_type, size, precision, scale):
+        if default_type in (cx_Oracle.CLOB, cx_Oracle.NCLOB):
+            return cursor.var(cx_Oracle.LONG_STRING, arraysize=cursor.arraysize, outconverter=clob_value)
+        elif default_type == cx_Oracle.BLOB:
+            return cursor.var(cx_Oracle.LONG_BINARY, arraysize=cursor.arraysize, outconverter=blob_value)
+    return handler
+
+
+def register_postgresql_types():
+    """Register handlers for psycopg2 values (dates, times, UUIDs and bytea)."""
+    register_type((datetime.date, datetime.time), lambda obj: obj.isoformat())
+    register_type(uuid.UUID, str)
+    register_type(buffer, _encode_buffer)
+
+
+def encode_object(obj):
+    """Returns a serializable value for a non-native object."""
+    handler = _resolved_handlers.get(type(obj))
+    if handler is None:
+        handler = _encode_unknown
+        for t in type(obj).__mro__:
+            if t in _type_handlers:
+                handler = _type_handlers[t]
+                break
+        _resolved_handlers[type(obj)] = handler
+    return handler(obj)
 
 
 class ObjectEncoder(json.JSONEncoder):
     """Support non-native Python types for JSON serialization."""
     def default(self, obj):
-        text_chars = ''.join(map(chr, [7, 8, 9, 10, 12, 13, 27] + range(0x20, 0x100)))
-        is_binary_string = lambda bytes: bool(bytes.translate(None, text_chars))
-
-        if isinstance(obj, (list, dict, str, unicode, int, float, bool, type(None))):
-            return json.JSONEncoder.default(self, obj)
-        elif isinstance(obj, decimal.Decimal):
-            return float(obj)
-        elif isinstance(obj, datetime.datetime):
-            # Format date to iso 8601
-            try:
-                if obj.tzinfo:
-                    return obj.strftime('%Y-%m-%dT%H:%M:%S.%f%Z')
-                else:
-                    return obj.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-            except ValueError:
-                # For dates before 1900.
-                date_str = datetime.datetime.isoformat(obj) + 'Z'
-                return date_str
-            except Exception:
-                return list(obj.timetuple())[0:6]
-        elif isinstance(obj, memoryview):
-            if not is_binary_string(obj.tobytes()):
-                return str(obj)
-            else:
-                return None
+        return encode_object(obj)
+
+
+class JSONBackend(object):
+    """Serializes entries as JSON using the standard library."""
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = ObjectEncoder()
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+    def join_members(self, members):
+        """Returns an object from encoded (key, value) pairs."""
+        return '{{{0}}}'.format(', '.join('{0}: {1}'.format(k, v) for k, v in members))
+
+    def frame(self, items):
+        """Returns one frame for a list of encoded entries."""
+        return '[{0}]'.format(','.join(items))
+
+
+class SimpleJSONBackend(JSONBackend):
+    """Serializes entries as JSON using simplejson and its C speedups."""
+    name = 'simplejson'
+
+    def __init__(self):
+        import simplejson
+        self._encoder = simplejson.JSONEncoder(default=encode_object, use_decimal=False)
+
+
+class MsgPackBackend(object):
+    """Serializes entries with MessagePack. Frames are msgpack maps or arrays of maps.
+    Binary values (bytearray, memoryview) are sent as msgpack bin values.
+    """
+    name = 'msgpack'
+
+    def __init__(self):
+        import msgpack
+        self._packer = msgpack.Packer(default=encode_object)
+
+    def dumps(self, obj):
+        return self._packer.pack(obj)
+
+    def join_members(self, members):
+        return self._packer.pack_map_header(len(members)) + ''.join(k + v for k, v in members)
+
+    def frame(self, items):
+        return self._packer.pack_array_header(len(items)) + ''.join(items)
+
+
+backends = {'json': JSONBackend, 'simplejson': SimpleJSONBackend, 'msgpack': MsgPackBackend}
 
+
+class EntryEncoder(object):
+    """Encodes the entries of a job. The action and location members, which are the same
+    for every entry, are encoded once and only the rest of each entry is serialized.
+    """
+    def __init__(self, action_type, location_id, backend='json'):
         try:
-            os.environ["NLS_LANG"] = ".AL32UTF8"
-            import cx_Oracle
-            if isinstance(obj, cx_Oracle.LOB):
-                if not is_binary_string(cx_Oracle.LOB.read(obj, 1024)):
-                    return str(obj)
-                else:
-                    return None
-            elif isinstance(obj, cx_Oracle.CLOB):
-                return str(obj)
-        except ImportError:
-            return
+            self.backend = backends[backend]()
+        except (KeyError, ImportError):
+            status.Writer().send_status('Encoder {0} is not available, using json.'.format(backend))
+            self.backend = JSONBackend()
+        self._action_type = action_type
+        self._location_id = location_id
+        dumps = self.backend.dumps
+        self._envelope = [(dumps('action'), dumps(action_type)), (dumps('location'), dumps(location_id))]
+        self._keys = {}
+
+    def encode(self, entry):
+        """Returns the encoded entry."""
+        if entry.get('action') != self._action_type or entry.get('location') != self._location_id:
+            return self.backend.dumps(entry)
+        dumps = self.backend.dumps
+        members = list(self._envelope)
+        for key, value in entry.iteritems():
+            if key == 'action' or key == 'location':
+                continue
+            try:
+                encoded_key = self._keys[key]
+            except KeyError:
+                encoded_key = self._keys[key] = dumps(key)
+            members.append((encoded_key, dumps(value)))
+        return self.backend.join_members(members)
+
+    def frame(self, items):
+        """Returns one frame for a list of encoded entries."""
+        return self.backend.frame(items)
+
+
+class MappingPlan(object):
+    """The field mapping of a table compiled for a list of columns. The output names,
+    the positions of the columns to keep and the new fields are resolved once and each
+    row is then mapped with a positional projection.
+    """
+    def __init__(self, names, positions, new_fields):
+        self.fields = names
+        self.positions = positions
+        self.new_fields = new_fields
+        if not positions:
+            self._values = lambda row: ()
+        elif positions == range(positions[0], positions[0] + len(positions)):
+            start, stop = positions[0], positions[0] + len(positions)
+            self._values = lambda row: row[start:stop]
+        elif len(positions) == 1:
+            position = positions[0]
+            self._values = lambda row: (row[position],)
+        else:
+            self._values = operator.itemgetter(*positions)
+
+    def project(self, row):
+        """Returns the mapped fields of a row."""
+        return dict(izip(self.fields, self._values(row)))
 
 
 class Job(object):
@@ -77,21 +317,51 @@ class Job(object):
         self.db_query = None
         self.zmq_socket = None
 
+        self.__batch = []
+        self.__batch_seen = []
+        self.__batch_bytes = 0
+        self.__batch_started = 0
+        self.__send_error = None
+        self.__batch_limits = (1, 0, 0)
+        self.__encoder = None
+        self.__send_queue = None
+        self.__sender = None
+        self.__send_stats = {'stall': 0., 'idle': 0., 'reported': 0.}
+        self.__changes = None
+        self.__discovery_token = ''
+        self.__row_id_prefixes = ()
+        self.__bytes_sent = 0
+        self.__checkpoint_db = None
+        self.__checkpoints = {}
+        self.__checkpoint_saved = time.time()
+        self.__catalog = {}
+        self.__catalog_fingerprint = None
+        self.__catalog_changed = False
+
         self.__sql_server_connection_str = ''
         self.__field_mapping = []
         self.__new_fields = []
         self.__joins = []
         self.__table_constraints = []
         self.__table_queries = []
+        self.__table_splits = []
+        self.__table_extents = []
+        self.__mapping_plans = {}
         self.__get_domains()
         self.__related_tables = []
         self.__format = None
+        metrics.configure(self.metrics_enabled, self.metrics_interval, self.__report_snapshot)
 
     def __del__(self):
         """Close open connections, streams, etc. after all references to Job are deleted."""
         try:
             if self.zmq_socket:
+                self.flush_entries()
                 self.zmq_socket.close()
+            if self.__changes:
+                self.__changes.close()
+            if self.__checkpoint_db:
+                self.__checkpoint_db.close()
             if self.db_connection:
                 self.db_connection.close()
         except TypeError:
@@ -144,6 +414,8 @@ class Job(object):
     def field_types(self):
         if self.drvr == 'Oracle':
             import cx_Oracle
+            # The catalog snapshot keeps the names of the types: NVARCHAR2 and NCHAR columns are
+            # UNICODE and FIXED_UNICODE in cx_Oracle 5, NCHAR and FIXED_NCHAR in later versions.
             return {cx_Oracle.STRING: 'fs_',
                     'STRING': 'fs_',
                     cx_Oracle.FIXED_CHAR: 'fs_',
@@ -155,7 +427,12 @@ class Job(object):
                     'DATETIME': 'fd_',
                     cx_Oracle.TIMESTAMP: 'fd_',
                     'TIMESTAMP': 'fd_',
-                    cx_Oracle.UNICODE: 'fs_'}
+                    cx_Oracle.UNICODE: 'fs_',
+                    'UNICODE': 'fs_',
+                    'NCHAR': 'fs_',
+                    cx_Oracle.FIXED_UNICODE: 'fs_',
+                    'FIXED_UNICODE': 'fs_',
+                    'FIXED_NCHAR': 'fs_'}
         else:
             import bson
             return {'STRING': 'fs_',
@@ -197,6 +474,14 @@ class Job(object):
                     'text': 'fs_',
                     'ntext': 'fs_',
                     'decimal': 'ff_',
+                    'character varying': 'fs_',
+                    'character': 'fs_',
+                    'double precision': 'fu_',
+                    'real': 'ff_',
+                    'boolean': 'fb_',
+                    'timestamp without time zone': 'fd_',
+                    'timestamp with time zone': 'fd_',
+                    'uuid': 'fs_',
                     'esriFieldTypeOID': 'fl_',
                     'esriFieldTypeDate': 'fd_',
                     'esriFieldTypeDouble': 'fu_',
@@ -207,10 +492,18 @@ class Job(object):
     def table_constraints(self):
         return self.__table_constraints
 
+    @property
+    def table_splits(self):
+        return self.__table_splits
+
     @property
     def table_queries(self):
         return self.__table_queries
 
+    @property
+    def table_extents(self):
+        return self.__table_extents
+
     @property
     def action_type(self):
         """Returns the action type."""
@@ -248,6 +541,209 @@ class Job(object):
         except KeyError:
             return False
 
+    @property
+    def delta(self):
+        """Index only new and changed entries and delete the entries that are gone (delta indexing)."""
+        try:
+            return self.job['location']['config']['delta']['enabled'] == 'true'
+        except KeyError:
+            return False
+
+    @property
+    def delta_store(self):
+        """Path of the SQLite database that records the entries indexed for delta indexing."""
+        try:
+            return self.job['location']['config']['delta']['store']
+        except KeyError:
+            return os.path.join(os.path.expanduser('~'), '.voyager', 'changes.db')
+
+    @property
+    def catalog_cache(self):
+        """Reuse a snapshot of the schema catalog across runs while the schema is unchanged."""
+        try:
+            return self.job['location']['config']['catalog']['enabled'] == 'true'
+        except KeyError:
+            return False
+
+    @property
+    def catalog_store(self):
+        """Path of the SQLite database that holds the catalog snapshots."""
+        try:
+            return self.job['location']['config']['catalog']['store']
+        except KeyError:
+            return os.path.join(os.path.expanduser('~'), '.voyager', 'catalog.db')
+
+    @property
+    def catalog(self):
+        """The catalog snapshot of the location (see load_catalog)."""
+        return self.__catalog
+
+    @property
+    def checkpoints(self):
+        """Save checkpoints while indexing so an interrupted job can be resumed."""
+        try:
+            return self.job['location']['config']['checkpoint']['enabled'] == 'true'
+        except KeyError:
+            return False
+
+    @property
+    def resume(self):
+        """Resume from the saved checkpoints instead of indexing every table from the start."""
+        try:
+            return self.job['location']['config']['checkpoint']['resume'] == 'true'
+        except KeyError:
+            return False
+
+    @property
+    def checkpoint_store(self):
+        """Path of the SQLite database that holds the checkpoints."""
+        try:
+            return self.job['location']['config']['checkpoint']['store']
+        except KeyError:
+            return os.path.join(os.path.expanduser('~'), '.voyager', 'checkpoints.db')
+
+    @property
+    def checkpoint_interval(self):
+        """Seconds between saving checkpoints (default is 30)."""
+        try:
+            return float(self.job['location']['config']['checkpoint']['interval'])
+        except KeyError:
+            return 30.
+
+    @property
+    def metrics_enabled(self):
+        """Collect per-table and per-stage timings and counters (on unless set to 'false')."""
+        try:
+            return self.job['location']['config']['metrics']['enabled'] != 'false'
+        except KeyError:
+            return True
+
+    @property
+    def metrics_interval(self):
+        """Seconds between snapshots of the metrics in the status output (default is 0, no snapshots)."""
+        try:
+            return float(self.job['location']['config']['metrics']['interval'])
+        except KeyError:
+            return 0
+
+    @property
+    def streaming(self):
+        """Stream the rows of each table with an unbuffered (forward only) cursor (MySQL).
+        The table entry then has no links to its rows, so memory does not grow with the table.
+        """
+        try:
+            if self.job['location']['config']['streaming'] == 'true':
+                return True
+            else:
+                return False
+        except KeyError:
+            return False
+
+    @property
+    def exact_row_counts(self):
+        """Count the rows of each table instead of using the row count statistics of the database."""
+        try:
+            if self.job['location']['config']['exact_row_counts'] == 'true':
+                return True
+            else:
+                return False
+        except KeyError:
+            return False
+
+    @property
+    def lob_size(self):
+        """Largest CLOB or BLOB value in bytes kept when LOBs are fetched inline with the rows (default is 65536).
+        Longer CLOB values are truncated and larger BLOB values are skipped, and both are counted in the
+        metrics (lobs_truncated, lobs_skipped). 0 reads each LOB separately.
+        """
+        try:
+            return int(self.job['location']['config']['lob_size'])
+        except KeyError:
+            return 65536
+
+    @property
+    def metrics_file(self):
+        """Path of a file the metrics summary is written to as JSON (optional)."""
+        try:
+            return self.job['location']['config']['metrics']['file']
+        except KeyError:
+            return ''
+
+    @property
+    def processes(self):
+        """The number of pool processes for multiprocessing (default is the number of CPUs)."""
+        try:
+            return int(self.job['location']['config']['processes'])
+        except KeyError:
+            return None
+
+    @property
+    def split_threshold(self):
+        """Tables with more rows than this are split into ranges of about this many rows (0 never splits)."""
+        try:
+            return int(self.job['location']['config']['split_threshold'])
+        except KeyError:
+            return 0
+
+    @property
+    def batch_size(self):
+        """Number of entries packed into one ZMQ frame (1 sends each entry on its own)."""
+        try:
+            return int(self.job['location']['config']['batch']['size'])
+        except KeyError:
+            return 1
+
+    @property
+    def batch_bytes(self):
+        """Maximum size of a batched ZMQ frame in bytes."""
+        try:
+            return int(self.job['location']['config']['batch']['bytes'])
+        except KeyError:
+            return 1048576
+
+    @property
+    def batch_interval(self):
+        """Maximum number of seconds an entry is held in a batch before it is sent."""
+        try:
+            return float(self.job['location']['config']['batch']['interval'])
+        except KeyError:
+            return 1.0
+
+    @property
+    def encoder_backend(self):
+        """The serializer for entries: json (default), simplejson or msgpack."""
+        try:
+            return self.job['location']['config']['encoder']
+        except KeyError:
+            return 'json'
+
+    @property
+    def threaded_send(self):
+        """Encode and send entries on a background thread."""
+        try:
+            if self.job['location']['config']['sender']['threaded'] == 'true':
+                return True
+            else:
+                return False
+        except KeyError:
+            return False
+
+    @property
+    def send_queue_size(self):
+        """Maximum number of entries waiting for the sender thread."""
+        try:
+            return int(self.job['location']['config']['sender']['queue_size'])
+        except KeyError:
+            return 1000
+
+    @property
+    def send_hwm(self):
+        """High-water mark (in frames) of the ZMQ socket used by the sender thread."""
+        try:
+            return int(self.job['location']['config']['sender']['hwm'])
+        except KeyError:
+            return 1000
+
     @property
     def path(self):
         """Catalog path for esri data types."""
@@ -272,6 +768,17 @@ class Job(object):
         except KeyError:
             return ''
 
+    @property
+    def geometry_pushdown(self):
+        """Simplify geometries and compute envelopes in the database, which returns them as WKB."""
+        try:
+            if self.job['location']['config']['geometry_pushdown'] == 'true':
+                return True
+            else:
+                return False
+        except KeyError:
+            return False
+
     @property
     def include_wkt(self):
         """Include well-known text (wkt) to geo information."""
@@ -299,6 +806,14 @@ class Job(object):
         except KeyError:
             return ''
 
+    @property
+    def dynamodb_segments(self):
+        """The number of segments to scan DynamoDB tables in, each on its own thread."""
+        try:
+            return int(self.job['location']['config']['dynamodb']['segments'])
+        except KeyError:
+            return 1
+
     @property
     def mongodb_client_info(self):
         """The mongoDB client connection string."""
@@ -314,6 +829,46 @@ class Job(object):
         except KeyError:
             return ''
 
+    @property
+    def mongodb_ranges(self):
+        """The number of _id ranges to scan MongoDB collections in, each on its own thread."""
+        try:
+            return int(self.job['location']['config']['mongodb']['ranges'])
+        except KeyError:
+            return 1
+
+    @property
+    def mongodb_batch_size(self):
+        """The number of documents in each batch returned by the MongoDB server (default is 1000)."""
+        try:
+            return int(self.job['location']['config']['mongodb']['batch_size'])
+        except KeyError:
+            return 1000
+
+    @property
+    def mongodb_change_streams(self):
+        """Save a change stream resume token for each collection, so the next run only indexes the changes."""
+        try:
+            return self.job['location']['config']['mongodb']['change_stream']['enabled'] == 'true'
+        except KeyError:
+            return False
+
+    @property
+    def mongodb_continuous(self):
+        """Keep following the change streams after the collections are indexed, until the job is stopped."""
+        try:
+            return self.job['location']['config']['mongodb']['change_stream']['continuous'] == 'true'
+        except KeyError:
+            return False
+
+    @property
+    def mongodb_token_store(self):
+        """Path of the SQLite database that holds the change stream resume tokens."""
+        try:
+            return self.job['location']['config']['mongodb']['change_stream']['store']
+        except KeyError:
+            return os.path.join(os.path.expanduser('~'), '.voyager', 'resume_tokens.db')
+
     @property
     def has_gridfs(self):
         try:
@@ -382,11 +937,7 @@ class Job(object):
             client = pymongo.MongoClient(self.mongodb_client_info)
             self.db_connection = client[self.mongodb_database]
         elif 'dynamodb' in self.job['location']['config']:
-            import boto3
-            if self.dynamodb_endpoint_url:
-                self.dynamodb = boto3.resource('dynamodb', region_name=self.dynamodb_region, endpoint_url=self.dynamodb_endpoint_url)
-            else:
-                self.dynamodb = boto3.resource('dynamodb', region_name=self.dynamodb_region)
+            self.dynamodb = self.dynamodb_resource()
         else:
             self.drvr = self.sql_connection_info['connection']['driver']
             srvr = self.sql_connection_info['connection']['server']
@@ -396,6 +947,7 @@ class Job(object):
 
             if self.drvr == 'Oracle':
                 import cx_Oracle
+                register_oracle_types()
                 try:
                     self.db_connection = cx_Oracle.connect("{0}/{1}@{2}/{3}".format(un, pw, srvr, db))
                 except Exception:
@@ -409,6 +961,8 @@ class Job(object):
                         port = self.sql_connection_info['connection']['port']
                         sid = self.sql_connection_info['connection']['sid']
                         self.db_connection = cx_Oracle.connect("{0}/{1}@{2}:{3}/{4}".format(un, pw, srvr, port, sid))
+                if self.lob_size:
+                    self.db_connection.outputtypehandler = oracle_lob_handler(self.lob_size)
                 self.db_cursor = self.db_connection.cursor()
             elif self.drvr == 'SQL Server':
                 import pyodbc
@@ -416,14 +970,39 @@ class Job(object):
                 self.db_connection = pyodbc.connect(self.__sql_server_connection_str)
                 self.db_cursor = self.db_connection.cursor()
                 self.__sql_server_connection_str = "DRIVER={0};SERVER={1};DATABASE={2};UID={3};PWD={4};OPTION=3".format(self.drvr, srvr, db, '', '')
+            elif self.drvr == 'PostgreSQL':
+                import psycopg2
+                import psycopg2.extensions
+                register_postgresql_types()
+                port = self.sql_connection_info['connection'].get('port', 5432)
+                self.db_connection = psycopg2.connect(host=srvr, port=port, dbname=db, user=un, password=pw)
+                psycopg2.extensions.register_type(psycopg2.extensions.UNICODE, self.db_connection)
+                psycopg2.extensions.register_type(psycopg2.extensions.UNICODEARRAY, self.db_connection)
+                self.db_cursor = self.db_connection.cursor()
             elif 'MySQL' in self.drvr:
                 import pyodbc
                 # Ex. "DRIVER={MySQL ODBC 5.3 ANSI Driver}; SERVER=localhost; DATABASE=test; UID=root;OPTION=3"
-                self.__sql_server_connection_str = "DRIVER={0};SERVER={1};DATABASE={2};UID={3};PWD={4};OPTION=3".format(self.drvr, srvr, db, un, pw)
+                option = 3
+                if self.streaming:
+                    # NO_CACHE and FORWARD_CURSOR: rows are read from the server as they are fetched
+                    # instead of the whole result set being buffered by the driver.
+                    option |= 1048576 | 2097152
+                self.__sql_server_connection_str = "DRIVER={0};SERVER={1};DATABASE={2};UID={3};PWD={4};OPTION={5}".format(self.drvr, srvr, db, un, pw, option)
                 self.db_connection = pyodbc.connect(self.__sql_server_connection_str)
                 self.db_cursor = self.db_connection.cursor()
                 self.__sql_server_connection_str = "DRIVER={0};SERVER={1};DATABASE={2};UID={3};PWD={4};OPTION=3".format(self.drvr, srvr, db, '', '')
 
+    def dynamodb_resource(self):
+        """Returns a DynamoDB resource on a new session. Resources are not thread safe,
+        so each scanning thread needs its own.
+        """
+        import boto3
+        session = boto3.session.Session()
+        if self.dynamodb_endpoint_url:
+            return session.resource('dynamodb', region_name=self.dynamodb_region, endpoint_url=self.dynamodb_endpoint_url)
+        else:
+            return session.resource('dynamodb', region_name=self.dynamodb_region)
+
     def layers_to_keep(self):
         """List of layers to keep."""
         layers_to_keep = set()
@@ -578,6 +1157,33 @@ class Job(object):
         else:
             return mapped_field_names
 
+    def mapping_plan(self, table_name, field_names, field_types={}, offset=0, drop=()):
+        """Returns the compiled mapping for the fields of a table. Fields start at offset
+        in each row and mapped names in drop are left out. Plans are cached per table and
+        field list so the mapping is only resolved once per table.
+        """
+        metrics.set_table(table_name)
+        key = (table_name, tuple(field_names), tuple(field_types.get(f) for f in field_names), offset, tuple(drop))
+        try:
+            return self.__mapping_plans[key]
+        except KeyError:
+            pass
+        mapped_field_names = self.map_fields(table_name, list(field_names), field_types)
+        names = []
+        positions = []
+        for i, name in enumerate(mapped_field_names):
+            if name not in drop:
+                names.append(name)
+                positions.append(offset + i)
+        new_fields = {}
+        for nf in self.new_fields:
+            if nf['name'] == '*' or nf['name'] == table_name:
+                new_fields.update(nf['new_fields'])
+        if len(self.__mapping_plans) > 10000:
+            self.__mapping_plans.clear()
+        plan = self.__mapping_plans[key] = MappingPlan(names, positions, new_fields)
+        return plan
+
     def get_join(self, table_name):
         """Get and return the join information."""
         join = None
@@ -599,6 +1205,30 @@ class Job(object):
                     break
         return constraint
 
+    def get_table_split(self, table_name):
+        """Get and return the number of key ranges to scan a table in and the key column to split on."""
+        split = (1, '')
+        if self.table_splits:
+            for ts in self.table_splits:
+                if ts['name'] == '*':
+                    split = (ts['split'], ts['column'])
+                elif ts['name'].lower() == table_name.lower():
+                    split = (ts['split'], ts['column'])
+                    break
+        return split
+
+    def get_table_extent(self, table_name):
+        """Get and return the extent (xmin, ymin, xmax, ymax) that features of a table must intersect, or None."""
+        extent = None
+        if self.table_extents:
+            for te in self.table_extents:
+                if te['name'] == '*':
+                    extent = te['extent']
+                elif te['name'].lower() == table_name.lower():
+                    extent = te['extent']
+                    break
+        return extent
+
     def get_table_query(self, table_name):
         """Get and return the query for a table."""
         query = ''
@@ -619,17 +1249,214 @@ class Job(object):
         """Connect to zmq instance."""
         try:
             self.zmq_socket = zmq.Context.instance().socket(zmq.PUSH)
+            if self.threaded_send:
+                # The HWM must be set before connecting. When the indexer falls behind, sends block,
+                # the queue fills up and the worker thread waits (see send_stats).
+                self.zmq_socket.setsockopt(zmq.SNDHWM, self.send_hwm)
             self.zmq_socket.connect(self.job['connection']['indexer'])
+            self.__batch_limits = (self.batch_size, self.batch_bytes, self.batch_interval)
+            self.__encoder = EntryEncoder(self.action_type, self.location_id, self.encoder_backend)
+            if self.delta and not self.__changes:
+                self.__changes = store.ChangeStore(self.delta_store, self.location_id)
+                # The discovery id differs for each run, so it is left out of the entry digests.
+                self.__discovery_token = self.__encoder.backend.dumps(self.discovery_id)
+            if self.threaded_send:
+                self.__send_queue = Queue.Queue(self.send_queue_size)
+                self.__send_stats['reported'] = time.time()
+                self.__sender = threading.Thread(target=self.__send_loop, name='zmq_sender')
+                self.__sender.daemon = True
+                self.__sender.start()
         except Exception as ex:
             sys.stdout.write(repr(ex))
             sys.exit(1)
 
     def send_entry(self, entry):
-        """Sends an entry to be indexed using pyzmq."""
+        """Sends an entry to be indexed using pyzmq.
+        If batching is configured, the entry is encoded and held until the batch is full.
+        With a sender thread, the entry is queued and encoded and sent on that thread.
+        """
+        if self.__send_queue:
+            self.__put(_snapshot(entry))
+        else:
+            self.__send(entry)
+
+    def flush_entries(self):
+        """Sends any batched entries as one frame (an array of entries).
+        Workers call this at the end of each table and before they exit.
+        With a sender thread, this waits until every queued entry has been sent.
+        If a frame could not be sent, the pending checkpoints are dropped and the error is raised.
+        """
+        if self.__send_queue:
+            self.__put(_FLUSH)
+            queue = self.__send_queue
+            with queue.all_tasks_done:
+                while queue.unfinished_tasks and self.__sender.is_alive():
+                    queue.all_tasks_done.wait(0.1)
+            self.__report_send_stats()
+        else:
+            self.__send_batch()
+        if self.__changes:
+            # Only the entries that were sent are marked as seen.
+            self.__changes.commit()
+        if self.__send_error:
+            error, self.__send_error = self.__send_error, None
+            self.__checkpoints = {}
+            raise error
+        if self.__checkpoints:
+            # Entries up to each checkpoint have been sent, so it is safe to save them.
+            self.__get_checkpoint_db().save(self.__checkpoints)
+            self.__checkpoints = {}
+            self.__checkpoint_saved = time.time()
+
+    def get_checkpoint(self, name):
+        """Returns the saved position of a table (or part of a table) when resuming, otherwise None."""
+        if not self.resume:
+            return None
+        return self.__get_checkpoint_db().get(name)[0]
+
+    def is_done(self, name):
+        """Returns True when resuming and the table (or part of a table) was completely indexed."""
+        if not self.resume:
+            return False
+        return self.__get_checkpoint_db().get(name)[1]
+
+    def checkpoint(self, name, position, done=False):
+        """Records the position (e.g. key or offset) of the last entry sent for a table or part of a table.
+        Checkpoints are saved by flush_entries once their entries are sent, and entries are flushed
+        every checkpoint_interval seconds. Pass done=True when the table is complete.
+        """
+        if not self.checkpoints:
+            return
+        self.__checkpoints[name] = (position, done)
+        if done or time.time() - self.__checkpoint_saved >= self.checkpoint_interval:
+            self.flush_entries()
+
+    def clear_checkpoints(self):
+        """Removes the saved checkpoints of the location."""
+        # Uses its own connection, so the job can still be passed to pool processes afterwards.
+        checkpoint_db = store.CheckpointStore(self.checkpoint_store, self.location_id)
+        checkpoint_db.clear()
+        checkpoint_db.close()
+
+    def load_catalog(self, fingerprint):
+        """Loads the catalog snapshot saved with the same schema fingerprint (if caching is enabled).
+        Otherwise the catalog starts empty and is filled in by the worker (see cached).
+        The snapshot holds the tables left after the include and exclude filters, so a digest of the
+        tables, layers, views and fields configuration is added to the fingerprint.
+        """
+        self.__catalog = {}
+        self.__catalog_changed = False
+        if fingerprint:
+            config = self.job['location'].get('config', {})
+            filters = dict((key, config.get(key)) for key in ('tables', 'layers', 'views', 'fields'))
+            fingerprint = '{0}:{1}'.format(fingerprint, hashlib.md5(json.dumps(filters, sort_keys=True)).hexdigest())
+        self.__catalog_fingerprint = fingerprint
+        if not self.catalog_cache or not fingerprint:
+            return self.__catalog
+        catalog_db = store.CatalogStore(self.catalog_store, self.location_id)
+        snapshot = catalog_db.get(fingerprint)
+        catalog_db.close()
+        if snapshot is not None:
+            self.__catalog = snapshot
+            status.Writer().send_status('Using the catalog snapshot of {0}.'.format(self.location_id))
+        return self.__catalog
+
+    def cached(self, key, build):
+        """Returns an item of the catalog snapshot, calling build() to read it if the snapshot does not have it.
+        Items must be JSON values (tuples are returned as lists from a saved snapshot).
+        """
         try:
-            self.zmq_socket.send_json(entry, cls=ObjectEncoder)
-        except Exception as ex:
-            print(ex)
+            return self.__catalog[key]
+        except KeyError:
+            started = metrics.start()
+            value = self.__catalog[key] = build()
+            metrics.stop('catalog', started)
+            self.__catalog_changed = True
+            return value
+
+    def save_catalog(self):
+        """Saves the catalog snapshot if items were added to it."""
+        if not self.catalog_cache or not self.__catalog_fingerprint or not self.__catalog_changed:
+            return
+        catalog_db = store.CatalogStore(self.catalog_store, self.location_id)
+        catalog_db.save(self.__catalog_fingerprint, self.__catalog)
+        catalog_db.close()
+        self.__catalog_changed = False
+
+    def begin_delta(self):
+        """Starts a new run of the location in the delta store. Call this before the worker runs."""
+        changes = store.ChangeStore(self.delta_store, self.location_id)
+        run = changes.begin_run()
+        changes.close()
+        status.Writer().send_status('Delta indexing {0}, run {1}.'.format(self.location_id, run))
+
+    def disable_delta(self, table_name):
+        """Turns delta indexing off for a table without a key (primary key, ROWID or OID). Its entries are
+        identified by row number, which can change between runs, so they are always sent, but they are
+        still marked as seen so send_deletes only deletes the row numbers that are gone.
+        """
+        if not self.delta:
+            return
+        prefix = '{0}_{1}_'.format(self.location_id, table_name)
+        if prefix not in self.__row_id_prefixes:
+            self.__row_id_prefixes += (prefix,)
+            status.Writer().send_status('{0} has no key, delta indexing is off for the table.'.format(table_name))
+
+    def table_failed(self, name):
+        """Records that a table (or an entry) failed to index during a delta run, so send_deletes does not
+        delete the entries that were not seen. Workers call this when they skip a table or a row after an error.
+        """
+        if not self.delta:
+            return
+        changes = store.ChangeStore(self.delta_store, self.location_id)
+        changes.fail(name)
+        changes.close()
+
+    def send_deletes(self):
+        """Sends a delete entry for each entry of the location that was not seen in this run.
+        Call this after the worker has finished.
+        """
+        if not self.zmq_socket:
+            self.connect_to_zmq()
+        self.flush_entries()
+        failures = self.__changes.failures()
+        if failures:
+            # The entries of a table that failed part way were not seen, but they were not deleted either.
+            # They are kept in the store and deleted by the next complete run if they are gone.
+            status.Writer().send_status('Deletes skipped, not completely indexed: {0}.'.format(', '.join(failures)))
+            return
+        deleted = self.__changes.deleted()
+        for entry_id in deleted:
+            self.send_entry({'id': entry_id, 'location': self.location_id, 'action': 'DELETE'})
+        self.flush_entries()
+        status.Writer().send_status('Deleted {0} entries.'.format(len(deleted)))
+
+    @property
+    def bytes_sent(self):
+        """The number of encoded bytes sent (or batched) so far."""
+        return self.__bytes_sent
+
+    def send_stats(self):
+        """Returns the sender thread's queue depth, the seconds the worker thread has
+        waited on a full queue (stall) and the seconds the sender thread has waited
+        on an empty queue (idle).
+        """
+        if not self.__send_queue:
+            return {}
+        return {'queue_depth': self.__send_queue.qsize(),
+                'queue_size': self.__send_queue.maxsize,
+                'stall': self.__send_stats['stall'],
+                'idle': self.__send_stats['idle']}
+
+    def report_metrics(self):
+        """Writes the metrics summary to the status output as JSON, and to metrics_file if it is set."""
+        if not self.metrics_enabled:
+            return
+        summary = metrics.summary()
+        if self.metrics_file:
+            with open(self.metrics_file, 'w') as fp:
+                json.dump(summary, fp, indent=2)
+        status.Writer().send_status('Metrics: {0}'.format(json.dumps(summary)))
 
     def search_fields(self, dataset):
         """Returns a valid list of existing fields for the search cursor."""
@@ -651,6 +1478,136 @@ class Job(object):
     # Private functions.
     #
 
+    def __send(self, entry):
+        """Encodes and sends (or batches) an entry."""
+        try:
+            started = metrics.start()
+            data = self.__encoder.encode(entry)
+            metrics.stop('encode', started)
+            seen = None
+            if self.__changes:
+                changed, seen = self.__changed(entry, data)
+                if not changed:
+                    metrics.count('unchanged')
+                    return
+            self.__bytes_sent += len(data)
+            metrics.count('entries')
+            metrics.count('bytes', len(data))
+            if self.__batch_limits[0] > 1:
+                self.__add_to_batch(data, seen)
+            else:
+                started = metrics.start()
+                self.zmq_socket.send(data)
+                metrics.stop('send', started)
+                if seen:
+                    self.__changes.seen([seen])
+        except Exception as ex:
+            print(ex)
+            self.table_failed(entry.get('id', ''))
+
+    def __report_snapshot(self, summary):
+        """Writes a snapshot of the metrics to the status output."""
+        status.Writer().send_status('Metrics snapshot: {0}'.format(json.dumps(summary)))
+
+    def __get_checkpoint_db(self):
+        """Opens the checkpoint store when it is first used (in each process)."""
+        if not self.__checkpoint_db:
+            self.__checkpoint_db = store.CheckpointStore(self.checkpoint_store, self.location_id)
+        return self.__checkpoint_db
+
+    def __changed(self, entry, data):
+        """Returns whether an encoded entry is new or changed since the last run (delta indexing), and the
+        (id, digest) to mark as seen once the entry is sent. An unchanged entry is marked as seen at once.
+        """
+        if 'id' not in entry or entry.get('action') == 'DELETE':
+            return True, None
+        seen = (entry['id'], hashlib.md5(data.replace(self.__discovery_token, '')).hexdigest())
+        if self.__changes.is_changed(*seen):
+            return True, seen
+        if self.__row_id_prefixes and entry['id'].startswith(self.__row_id_prefixes):
+            return True, seen
+        self.__changes.seen([seen])
+        return False, None
+
+    def __send_batch(self):
+        """Sends the batched entries as one frame."""
+        if self.__batch:
+            started = metrics.start()
+            try:
+                self.zmq_socket.send(self.__encoder.frame(self.__batch))
+                if self.__batch_seen:
+                    self.__changes.seen(self.__batch_seen)
+            except Exception as ex:
+                # The entries are not marked as seen, and flush_entries raises the error without saving checkpoints.
+                status.Writer().send_state(status.STAT_WARNING, 'Could not send {0} entries: {1}'.format(len(self.__batch), ex))
+                self.table_failed(metrics.collector.table or self.location_id)
+                self.__send_error = self.__send_error or ex
+            metrics.stop('send', started)
+            self.__batch = []
+            self.__batch_seen = []
+            self.__batch_bytes = 0
+
+    def __put(self, item):
+        """Queues an item for the sender thread, timing any wait on a full queue."""
+        try:
+            self.__send_queue.put_nowait(item)
+        except Queue.Full:
+            start = time.time()
+            self.__send_queue.put(item)
+            self.__send_stats['stall'] += time.time() - start
+        if time.time() - self.__send_stats['reported'] > 30:
+            self.__report_send_stats()
+
+    def __send_loop(self):
+        """Sender thread: encodes and sends queued entries. A pending batch is sent
+        if nothing arrives before its time limit.
+        """
+        queue = self.__send_queue
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                start = time.time()
+                try:
+                    item = queue.get(timeout=self.__batch_limits[2] if self.__batch else None)
+                except Queue.Empty:
+                    # Nothing arrived before the batch time limit.
+                    self.__send_stats['idle'] += time.time() - start
+                    self.__send_batch()
+                    continue
+                self.__send_stats['idle'] += time.time() - start
+            try:
+                if item is _FLUSH:
+                    self.__send_batch()
+                else:
+                    self.__send(item)
+            finally:
+                queue.task_done()
+
+    def __report_send_stats(self):
+        """Writes the sender thread's queue depth and wait times to the status output."""
+        stats = self.send_stats()
+        self.__send_stats['reported'] = time.time()
+        status.Writer().send_status('Send queue: {0}/{1} entries, worker stalled {2:.1f}s, sender idle {3:.1f}s'.format(
+            stats['queue_depth'], stats['queue_size'], stats['stall'], stats['idle']))
+
+    def __add_to_batch(self, data, seen=None):
+        """Adds an encoded entry (and its (id, digest) to mark as seen, for delta indexing) to the current
+        batch and sends the batch when it reaches the entry count, byte size or time limit.
+        """
+        max_entries, max_bytes, max_seconds = self.__batch_limits
+        if self.__batch and self.__batch_bytes + len(data) > max_bytes:
+            self.__send_batch()
+        if not self.__batch:
+            self.__batch_started = time.time()
+        self.__batch.append(data)
+        if seen:
+            self.__batch_seen.append(seen)
+        self.__batch_bytes += len(data) + 1
+        if len(self.__batch) >= max_entries or self.__batch_bytes >= max_bytes or \
+                time.time() - self.__batch_started >= max_seconds:
+            self.__send_batch()
+
     def __get_domains(self):
         """List of workspace domains (for Esri workspace types).
         Only supported with ArcGIS 10.1 and higher.
@@ -665,6 +1622,7 @@ class Job(object):
 
     def __get_info(self, table):
         """Gets info such as field mapping, queries, and constraints."""
+        self.__mapping_plans.clear()
         try:
             try:
                 if table['query'] and table['constraint']:
@@ -691,6 +1649,17 @@ class Job(object):
                 self.__table_constraints.append({'name': table['name'], 'constraint': table['constraint']})
             except KeyError:
                 pass
+            try:
+                self.__table_splits.append({'name': table['name'], 'split': int(table['split']),
+                                            'column': table.get('split_column', '')})
+            except KeyError:
+                pass
+            try:
+                extent = {'name': table['name'], 'extent': tuple(float(c) for c in table['extent'])}
+                if not extent in self.__table_extents:
+                    self.__table_extents.append(extent)
+            except KeyError:
+                pass
             try:
                 if not {'name': table['name'], 'map': table['map']} in self.__field_mapping:
                     self.__field_mapping.append({'name': table['name'], 'map': table['map']})
@@ -11,15 +11,22 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import base64
 import decimal
 import json
+import time
+import random
+import threading
+import Queue
 import boto3
+import botocore.exceptions
+from boto3.dynamodb.types import Binary, TypeSerializer, TypeDeserializer
 import base_job
 from utils import status
-from utils import worker_utils
+from utils import metrics
 
 
-status_writer = status.Writer()
+status_writer = status.ProgressWriter()
 
 
 class ComplexEncoder(json.JSONEncoder):
@@ -49,6 +56,123 @@ def get_tables(job):
     return table_names
 
 
+def get_key_names(table):
+    """Return the names of the HASH and RANGE key attributes of a table, in that order."""
+    return [k['AttributeName'] for k in sorted(table.key_schema, key=lambda k: k['KeyType'] != 'HASH')]
+
+
+def get_item_id(item, key_names):
+    """Return the id of an item from its key values. Binary values are base64 encoded."""
+    values = [item[k] for k in key_names]
+    return u'_'.join(base64.urlsafe_b64encode(v.value) if isinstance(v, Binary) else unicode(v) for v in values)
+
+
+def get_scan_args(job, key_names=()):
+    """Return the scan arguments that project the fields to keep. The key attributes are always read."""
+    fields = job.fields_to_keep
+    if '*' in ''.join(fields):
+        return {}
+    fields = fields + [k for k in key_names if k not in fields]
+    names = dict(('#f{0}'.format(i), f) for i, f in enumerate(fields))
+    return {'ProjectionExpression': ', '.join(sorted(names)), 'ExpressionAttributeNames': names}
+
+
+def scan_pages(table, scan_args, segment_keys, segment=0, total_segments=1):
+    """Generator over the pages of items and the last evaluated key of a table, or of one segment
+    of a parallel scan. The last evaluated key of each segment is kept in segment_keys so a scan
+    resumes where it left off. Throttled requests are retried with a growing delay and a smaller page.
+    """
+    kwargs = dict(scan_args)
+    if total_segments > 1:
+        kwargs['Segment'] = segment
+        kwargs['TotalSegments'] = total_segments
+    delay = 0.
+    limit = None
+    while True:
+        if segment_keys.get(segment):
+            kwargs['ExclusiveStartKey'] = segment_keys[segment]
+        if limit:
+            kwargs['Limit'] = limit
+        else:
+            kwargs.pop('Limit', None)
+        try:
+            scan = table.scan(**kwargs)
+        except botocore.exceptions.ClientError as ce:
+            if not ce.response['Error']['Code'] == 'ProvisionedThroughputExceededException':
+                raise
+            delay = min(max(delay * 2, 0.05), 5.)
+            limit = max((limit or 1000) // 2, 25)
+            time.sleep(delay * random.uniform(0.5, 1.))
+            continue
+        delay = 0.
+        if limit:
+            limit = limit * 2 if limit * 2 < 1000 else None
+        yield scan['Items'], scan.get('LastEvaluatedKey')
+        if 'LastEvaluatedKey' not in scan:
+            segment_keys[segment] = None
+            break
+        segment_keys[segment] = scan['LastEvaluatedKey']
+
+
+def scan_segment(job, table_name, scan_args, segment_keys, segment, total_segments, pages):
+    """Scan one segment of a table on its own DynamoDB resource and queue its pages."""
+    try:
+        table = job.dynamodb_resource().Table(table_name)
+        for items, last_key in scan_pages(table, scan_args, segment_keys, segment, total_segments):
+            pages.put((segment, items, last_key))
+    except Exception as ex:
+        pages.put(ex)
+    pages.put(None)
+
+
+def scan_table(job, table, scan_args, segment_keys, finished=()):
+    """Generator over the (segment, items, last evaluated key) pages of a table. With more than one
+    segment, the segments are scanned on threads and their pages are returned as they arrive.
+    Segments in finished are not scanned.
+    """
+    segments = job.dynamodb_segments
+    if segments <= 1:
+        if 0 not in finished:
+            for items, last_key in scan_pages(table, scan_args, segment_keys):
+                yield 0, items, last_key
+        return
+
+    pages = Queue.Queue(segments * 4)
+    scanning = [segment for segment in range(segments) if segment not in finished]
+    for segment in scanning:
+        scanner = threading.Thread(target=scan_segment, args=(job, table.name, scan_args, segment_keys,
+                                                               segment, segments, pages))
+        scanner.daemon = True
+        scanner.start()
+    done = 0
+    while done < len(scanning):
+        page = pages.get()
+        if page is None:
+            done += 1
+        elif isinstance(page, Exception):
+            raise page
+        else:
+            yield page
+
+
+def load_checkpoint(job, table_name):
+    """Returns the segment keys to resume a table scan from and the segments that were finished.
+    Keys are saved in the DynamoDB JSON format so number and binary keys keep their type.
+    """
+    position = job.get_checkpoint(table_name)
+    if not position or not position['segments'] == job.dynamodb_segments:
+        return {}, set()
+    deserializer = TypeDeserializer()
+    segment_keys = {}
+    finished = set()
+    for segment, key in position['keys'].iteritems():
+        if key is None:
+            finished.add(int(segment))
+        else:
+            segment_keys[int(segment)] = dict((k, deserializer.deserialize(v)) for k, v in key.iteritems())
+    return segment_keys, finished
+
+
 def run_job(dynamodb_job):
     """Worker function to index each document in each table in the database."""
     job = dynamodb_job
@@ -58,14 +182,27 @@ def run_job(dynamodb_job):
 
     for table_name in tables:
         table = job.dynamodb.Table(table_name)
-        has_start_key = True
         if not table.item_count == 0:
+            if job.is_done(table.name):
+                continue
+            metrics.set_table(table.name)
+            # Items are identified by their HASH and RANGE key values.
+            key_names = get_key_names(table)
+            scan_args = get_scan_args(job, key_names)
+            # Key attributes that are only read for the id are not indexed.
+            hidden_keys = [k for k in key_names if k not in job.fields_to_keep] if scan_args else []
             i = 0
-            increment = job.get_increment(table.item_count)
-            scan = table.scan()
-            items = scan['Items']
-            while has_start_key:
+            segment_keys, finished = load_checkpoint(job, table.name)
+            serializer = TypeSerializer()
+            # Segments that have not sent a page yet in this run keep the key they were resumed from.
+            checkpoint_keys = dict((segment, dict((k, serializer.serialize(v)) for k, v in key.iteritems()))
+                                   for segment, key in segment_keys.iteritems())
+            checkpoint_keys.update((segment, None) for segment in finished)
+            for segment, items, last_key in metrics.timed('fetch', scan_table(job, table, scan_args, segment_keys, finished)):
                 for item in items:
+                    item_id = get_item_id(item, key_names)
+                    for k in hidden_keys:
+                        del item[k]
                     field_names = item.keys()
                     field_types = dict((k, type(v)) for k, v in item.items())
                     field_values = item.values()
@@ -73,8 +210,9 @@ def run_job(dynamodb_job):
                     entry = {}
 
                     # Map fields to voyager fields and to those specified in the configuration.
-                    mapped_fields = job.map_fields (table.name, field_names, field_types)
-                    mapped_fields = dict(zip(mapped_fields, field_values))
+                    started = metrics.start()
+                    mapped_fields = job.mapping_plan(table.name, field_names, field_types).project(field_values)
+                    metrics.stop('map', started)
 
                     # TODO: Fetch geographic information from mapped fields.
                     geo = {}
@@ -85,19 +223,19 @@ def run_job(dynamodb_job):
                     mapped_fields['title'] = table.name
                     mapped_fields['format_type'] = 'Record'
                     mapped_fields['format'] = 'application/vnd.dynamodb.record'
+                    entry['id'] = u'{0}_{1}_{2}'.format(job.location_id, table.name, item_id)
                     entry['location'] = job.location_id
                     entry['action'] = job.action_type
                     entry['entry'] = {'geo': geo, 'fields': mapped_fields}
                     job.send_entry(entry)
                     i += 1
-                    if (i % increment) == 0:
-                        status_writer.send_percent(float(i) / table.item_count,
-                                                   '{0}: {1:.2f}%'.format(table.name, float(i) / table.item_count),
-                                                   'DynamoDB')
-
-                # Fetch all other items remaining in the table.
-                if 'LastEvaluatedKey' not in scan:
-                    has_start_key = False
+                    status_writer.progress(table.name, i, table.item_count, 'DynamoDB', job.bytes_sent)
+                # Checkpoint the key a segment resumes from once the page is sent (None when the segment is finished).
+                if last_key:
+                    checkpoint_keys[segment] = dict((k, serializer.serialize(v)) for k, v in last_key.iteritems())
                 else:
-                    scan = table.scan(ExclusiveStartKey=scan['LastEvaluatedKey'])
-                    items = scan['Items']
+                    checkpoint_keys[segment] = None
+                job.checkpoint(table.name, {'segments': job.dynamodb_segments, 'keys': dict(checkpoint_keys)})
+            job.flush_entries()
+            job.checkpoint(table.name, None, done=True)
+            status_writer.flush()
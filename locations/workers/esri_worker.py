@@ -15,16 +15,17 @@ from __future__ import division
 import os
 import sys
 import copy
+import math
 import datetime
 import itertools
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 import logging
 import multiprocessing
 import arcpy
 import _server_admin as arcrest
 from utils import status
 
-status_writer = status.Writer()
+status_writer = status.ProgressWriter()
 
 
 class NullGeometry(Exception):
@@ -382,10 +383,93 @@ def index_service(connection_info):
                             job.send_entry(entry)
                         if (x % increment) == 0:
                             status_writer.send_percent(i / row_count, "{0} {1:%}".format(layer_name, i / row_count), 'esri_worker')
+        job.flush_entries()
 
 
-def worker(data_path, esri_service=False):
-    """The worker function to index feature data and tabular data."""
+def get_oid_bound(dsc, order):
+    """Returns the lowest (ASC) or highest (DESC) ObjectID of a table, or None if it is empty.
+    Only the first row of the ordered cursor is read.
+    """
+    sql_clause = (None, 'ORDER BY {0} {1}'.format(dsc.OIDFieldName, order))
+    with arcpy.da.SearchCursor(dsc.catalogPath, ['OID@'], sql_clause=sql_clause) as rows:
+        for row in rows:
+            return row[0]
+    return None
+
+
+def get_oid_ranges(dsc, chunks, row_count):
+    """Split the ObjectIDs of a table into at most chunks half-open (start, stop) ranges of about equal width."""
+    if dsc.dataType in ('ShapeFile', 'Shapefile', 'DbaseTable'):
+        # Shapefiles and dBASE tables do not support ORDER BY, and their FIDs are the record numbers from 0.
+        low, high = (0, row_count - 1) if row_count else (None, None)
+    else:
+        low, high = get_oid_bound(dsc, 'ASC'), get_oid_bound(dsc, 'DESC')
+    if low is None:
+        return [None]
+    width = max((high - low) // chunks + 1, 1)
+    return [(start, min(start + width, high + 1)) for start in range(low, high + 1, width)]
+
+
+def get_tasks(tables):
+    """Returns a (table, ObjectID range, send schema) task for each table, or for each range of a table
+    larger than the split threshold. The schema entry of a split table is sent with its first range.
+    """
+    tasks = []
+    for tbl in tables:
+        split_threshold = job.split_threshold
+        if split_threshold and not job.schema_only:
+            dsc = arcpy.Describe(tbl)
+            if dsc.hasOID and not job.get_join(dsc.name):
+                row_count = get_row_count(tbl)
+                if row_count > split_threshold:
+                    chunks = int(math.ceil(row_count / split_threshold))
+                    oid_ranges = get_oid_ranges(dsc, chunks, row_count)
+                    tasks += [(tbl, oid_range, i == 0) for i, oid_range in enumerate(oid_ranges)]
+                    continue
+        tasks.append((tbl, None, True))
+    return tasks
+
+
+def get_oid_filter(dsc, oid_range, expression):
+    """Returns the where clause expression limited to an ObjectID range."""
+    if not oid_range:
+        return expression
+    oid_field = arcpy.AddFieldDelimiters(dsc.catalogPath, dsc.OIDFieldName)
+    oid_filter = '{0} >= {1} AND {0} < {2}'.format(oid_field, oid_range[0], oid_range[1])
+    if expression:
+        return '({0}) AND {1}'.format(expression, oid_filter)
+    return oid_filter
+
+
+def get_resume_clause(dsc, checkpoint_name, expression):
+    """Returns the SQL clause that reads the rows of a table in ObjectID order, the where clause that
+    continues after its checkpoint and the number of the row to continue from (None if not resuming).
+    """
+    if dsc.dataType in ('ShapeFile', 'Shapefile', 'DbaseTable'):
+        # Shapefiles and dBASE tables are read in FID order and do not support ORDER BY.
+        sql_clause = (None, None)
+    else:
+        sql_clause = (None, 'ORDER BY {0}'.format(dsc.OIDFieldName))
+    position = job.get_checkpoint(checkpoint_name)
+    if not position:
+        return sql_clause, expression, None
+    oid_filter = '{0} > {1}'.format(arcpy.AddFieldDelimiters(dsc.catalogPath, dsc.OIDFieldName), position[0])
+    if expression:
+        return sql_clause, '({0}) AND {1}'.format(expression, oid_filter), position[1] + 1
+    return sql_clause, oid_filter, position[1] + 1
+
+
+def index_task(task):
+    """Index a table or an ObjectID range of a table in a pool process."""
+    data_path, oid_range, send_schema = task
+    return data_path, worker(data_path, oid_range=oid_range, send_schema=send_schema)
+
+
+def worker(data_path, esri_service=False, oid_range=None, send_schema=True):
+    """The worker function to index feature data and tabular data.
+    If oid_range is given, only the rows with ObjectIDs in the half-open range are indexed
+    and progress is left for the caller to report.
+    """
     if esri_service:
         index_service(job.service_connection)
     else:
@@ -452,7 +536,8 @@ def worker(data_path, esri_service=False):
         schema['fields'] = schema_fields
 
         # Add and entry for the table and it's schema.
-        schema['rows'] = int(arcpy.GetCount_management(data_path).getOutput(0))
+        if send_schema:
+            schema['rows'] = get_row_count(data_path)
         table_entry['id'] = '{0}_{1}'.format(job.location_id, dsc.name)
         table_entry['location'] = job.location_id
         table_entry['action'] = job.action_type
@@ -462,10 +547,24 @@ def worker(data_path, esri_service=False):
 
         if job.schema_only:
             job.send_entry(table_entry)
+            job.flush_entries()
             return table_entry
-        else:
+        elif send_schema:
             job.send_entry(table_entry)
 
+        # With checkpoints, rows are read in ObjectID order and the ObjectID is selected last.
+        checkpoints = job.checkpoints and dsc.hasOID
+        if oid_range:
+            checkpoint_name = '{0}:{1}'.format(data_path, oid_range[0])
+        else:
+            checkpoint_name = data_path
+        if job.is_done(checkpoint_name):
+            return table_entry
+        sql_clause = (None, None)
+        next_row = None
+        # The ObjectID is selected last and identifies the entries. Without one, they are identified by row number.
+        oid_fields = ['OID@'] if dsc.hasOID else []
+
         if dsc.dataType == 'Table':
             # Get join information.
             table_join = job.get_join(dsc.name)
@@ -485,25 +584,27 @@ def worker(data_path, esri_service=False):
                     expression = query
                 else:
                     expression = constraint
+            expression = get_oid_filter(dsc, oid_range, expression)
+            if checkpoints:
+                sql_clause, expression, next_row = get_resume_clause(dsc, checkpoint_name, expression)
 
             field_types = job.search_fields(table_view)
             fields = field_types.keys()
             row_count = float(arcpy.GetCount_management(table_view).getOutput(0))
             if row_count == 0.0:
+                job.flush_entries()
                 return
 
-            with arcpy.da.SearchCursor(table_view, fields, expression) as rows:
-                mapped_fields = job.map_fields(dsc.name, fields, field_types)
-                new_fields = job.new_fields
-                ordered_fields = OrderedDict()
-                for f in mapped_fields:
-                    ordered_fields[f] = None
-                increment = job.get_increment(row_count)
-                for i, row in enumerate(rows, 1):
+            if not oid_fields:
+                job.disable_delta(os.path.basename(data_path))
+            cursor_fields = fields + oid_fields
+            with arcpy.da.SearchCursor(table_view, cursor_fields, expression, sql_clause=sql_clause) as rows:
+                mapping_plan = job.mapping_plan(dsc.name, fields, field_types)
+                for i, row in enumerate(rows, next_row or 1):
                     try:
                         if job.domains:
                             row = update_row(dsc.fields, rows, list(row))
-                        mapped_fields = dict(zip(ordered_fields.keys(), row))
+                        mapped_fields = mapping_plan.project(row)
                         mapped_fields['_discoveryID'] = job.discovery_id
                         mapped_fields['meta_table_name'] = dsc.name
                         if hasattr(dsc, 'aliasName') and dsc.aliasName:
@@ -513,26 +614,20 @@ def worker(data_path, esri_service=False):
                         mapped_fields['format_category'] = 'GIS'
                         mapped_fields['format_type'] = "Record"
                         mapped_fields['format'] = "application/vnd.esri.{0}.record".format(dsc.dataType.lower())
-                        for nf in new_fields:
-                            if nf['name'] == '*' or nf['name'] == dsc.name:
-                                for k, v in nf['new_fields'].iteritems():
-                                    mapped_fields[k] = v
-                        oid_field = filter(lambda x: x in ('FID', 'OID', 'OBJECTID'), rows.fields)
-                        if oid_field:
-                            fld_index = rows.fields.index(oid_field[0])
-                        else:
-                            fld_index = i
+                        mapped_fields.update(mapping_plan.new_fields)
                         if global_id_field:
                              mapped_fields['meta_{0}'.format(global_id_field)] = mapped_fields.pop('fi_{0}'.format(global_id_field))
-                        entry['id'] = '{0}_{1}_{2}'.format(job.location_id, os.path.basename(data_path), row[fld_index])
+                        entry['id'] = '{0}_{1}_{2}'.format(job.location_id, os.path.basename(data_path), row[-1] if oid_fields else i)
                         entry['location'] = job.location_id
                         entry['action'] = job.action_type
                         entry['relation'] = 'contains'
                         entry['entry'] = {'fields': mapped_fields}
                         entry['entry']['links'] = [{'relation': 'database', 'id': table_entry['id']}]
                         job.send_entry(entry)
-                        if (i % increment) == 0:
-                            status_writer.send_percent(i / row_count, "{0} {1:%}".format(dsc.name, i / row_count), 'esri_worker')
+                        if checkpoints:
+                            job.checkpoint(checkpoint_name, [row[-1], i])
+                        if not oid_range:
+                            status_writer.progress(dsc.name, i, row_count, 'esri_worker', job.bytes_sent)
                     except (AttributeError, RuntimeError):
                         continue
         else:
@@ -560,6 +655,9 @@ def worker(data_path, esri_service=False):
                     expression = query
                 else:
                     expression = constraint
+            expression = get_oid_filter(dsc, oid_range, expression)
+            if checkpoints:
+                sql_clause, expression, next_row = get_resume_clause(dsc, checkpoint_name, expression)
             if dsc.shapeFieldName in fields:
                 fields.remove(dsc.shapeFieldName)
                 field_types.pop(dsc.shapeFieldName)
@@ -568,23 +666,26 @@ def worker(data_path, esri_service=False):
                 field_types.pop(arcpy.Describe(lyr).shapeFieldName)
             row_count = float(arcpy.GetCount_management(lyr).getOutput(0))
             if row_count == 0.0:
+                job.flush_entries()
                 return
+            cursor_fields = ['SHAPE@'] + fields + oid_fields
+            if dsc.shapeType == 'Point':
+                id_name = os.path.basename(data_path)
+            else:
+                id_name = os.path.splitext(os.path.basename(data_path))[0]
+            if not oid_fields:
+                job.disable_delta(id_name)
             if dsc.shapeType == 'Point':
-                with arcpy.da.SearchCursor(lyr, ['SHAPE@'] + fields, expression, sr) as rows:
-                    mapped_fields = job.map_fields(dsc.name, list(rows.fields[1:]), field_types)
-                    new_fields = job.new_fields
-                    ordered_fields = OrderedDict()
-                    for f in mapped_fields:
-                        ordered_fields[f] = None
-                    increment = job.get_increment(row_count)
-                    for i, row in enumerate(rows):
+                with arcpy.da.SearchCursor(lyr, cursor_fields, expression, sr, sql_clause=sql_clause) as rows:
+                    mapping_plan = job.mapping_plan(dsc.name, list(rows.fields[1:len(fields) + 1]), field_types, offset=1)
+                    for i, row in enumerate(rows, next_row or 0):
                         try:
                             if job.domains:
                                 row = update_row(dsc.fields, rows, list(row))
                             if row[0]:
                                 geo['lon'] = row[0].firstPoint.X
                                 geo['lat'] = row[0].firstPoint.Y
-                            mapped_fields = dict(zip(ordered_fields.keys(), row[1:]))
+                            mapped_fields = mapping_plan.project(row)
                             mapped_fields['_discoveryID'] = job.discovery_id
                             mapped_fields['meta_table_name'] = dsc.name
                             if hasattr(dsc, 'aliasName') and dsc.aliasName:
@@ -595,32 +696,26 @@ def worker(data_path, esri_service=False):
                             mapped_fields['geometry_type'] = 'Point'
                             mapped_fields['format_type'] = 'Feature'
                             mapped_fields['format'] = "application/vnd.esri.{0}.feature".format(dsc.dataType.lower())
-                            for nf in new_fields:
-                                if nf['name'] == '*' or nf['name'] == dsc.name:
-                                    for k, v in nf['new_fields'].iteritems():
-                                        mapped_fields[k] = v
+                            mapped_fields.update(mapping_plan.new_fields)
                             if global_id_field:
                                  mapped_fields['meta_{0}'.format(global_id_field)] = mapped_fields.pop('fi_{0}'.format(global_id_field))
-                            entry['id'] = '{0}_{1}_{2}'.format(job.location_id, os.path.basename(data_path), i)
+                            entry['id'] = '{0}_{1}_{2}'.format(job.location_id, id_name, row[-1] if oid_fields else i)
                             entry['location'] = job.location_id
                             entry['action'] = job.action_type
                             entry['relation'] = 'contains'
                             entry['entry'] = {'geo': geo, 'fields': mapped_fields}
                             entry['entry']['links'] = [{'relation': 'database', 'id': table_entry['id']}]
                             job.send_entry(entry)
-                            if (i % increment) == 0:
-                                status_writer.send_percent(i / row_count, "{0} {1:%}".format(dsc.name, i / row_count), 'esri_worker')
+                            if checkpoints:
+                                job.checkpoint(checkpoint_name, [row[-1], i])
+                            if not oid_range:
+                                status_writer.progress(dsc.name, i, row_count, 'esri_worker', job.bytes_sent)
                         except (AttributeError, RuntimeError):
                             continue
             else:
-                with arcpy.da.SearchCursor(lyr, ['SHAPE@'] + fields, expression, sr) as rows:
-                    increment = job.get_increment(row_count)
-                    mapped_fields = job.map_fields(dsc.name, list(rows.fields[1:]), field_types)
-                    new_fields = job.new_fields
-                    ordered_fields = OrderedDict()
-                    for f in mapped_fields:
-                        ordered_fields[f] = None
-                    for i, row in enumerate(rows):
+                with arcpy.da.SearchCursor(lyr, cursor_fields, expression, sr, sql_clause=sql_clause) as rows:
+                    mapping_plan = job.mapping_plan(dsc.name, list(rows.fields[1:len(fields) + 1]), field_types, offset=1)
+                    for i, row in enumerate(rows, next_row or 0):
                         try:
                             if job.domains:
                                 row = update_row(dsc.fields, rows, list(row))
@@ -635,37 +730,116 @@ def worker(data_path, esri_service=False):
                                         geo['xmax'] = row[0].extent.XMax
                                         geo['ymin'] = row[0].extent.YMin
                                         geo['ymax'] = row[0].extent.YMax
-                            mapped_fields = dict(zip(ordered_fields.keys(), row[1:]))
+                            mapped_fields = mapping_plan.project(row)
                             mapped_fields['_discoveryID'] = job.discovery_id
                             mapped_fields['meta_table_name'] = dsc.name
                             if hasattr(dsc, 'aliasName') and dsc.aliasName:
                                 mapped_fields['meta_table_alias_name'] = dsc.aliasName
                             else:
                                 mapped_fields['meta_table_alias_name'] = dsc.name
-                            for nf in new_fields:
-                                if nf['name'] == '*' or nf['name'] == dsc.name:
-                                    for k, v in nf['new_fields'].iteritems():
-                                        mapped_fields[k] = v
+                            mapped_fields.update(mapping_plan.new_fields)
                             if global_id_field:
                                 mapped_fields['meta_{0}'.format(global_id_field)] = mapped_fields.pop('fi_{0}'.format(global_id_field))
                             mapped_fields['geometry_type'] = dsc.shapeType
                             mapped_fields['format_category'] = 'GIS'
                             mapped_fields['format_type'] = 'Feature'
                             mapped_fields['format'] = "application/vnd.esri.{0}.feature".format(dsc.dataType.lower())
-                            entry['id'] = '{0}_{1}_{2}'.format(job.location_id, os.path.splitext(os.path.basename(data_path))[0], i)
+                            entry['id'] = '{0}_{1}_{2}'.format(job.location_id, id_name, row[-1] if oid_fields else i)
                             entry['location'] = job.location_id
                             entry['action'] = job.action_type
                             entry['entry'] = {'geo': geo, 'fields': mapped_fields}
                             entry['entry']['links'] = [{'relation': 'database', 'id': table_entry['id']}]
                             job.send_entry(entry)
-                            if (i % increment) == 0:
-                                status_writer.send_percent(i / row_count, "{0} {1:%}".format(dsc.name, i / row_count), 'esri_worker')
+                            if checkpoints:
+                                job.checkpoint(checkpoint_name, [row[-1], i])
+                            if not oid_range:
+                                status_writer.progress(dsc.name, i, row_count, 'esri_worker', job.bytes_sent)
                         except (AttributeError, RuntimeError):
                             continue
 
+        job.flush_entries()
+        job.checkpoint(checkpoint_name, None, done=True)
+        status_writer.flush()
         return table_entry
 
 
+def get_fingerprint(path):
+    """Returns a fingerprint of the file geodatabase, personal geodatabase or folder of a path (the number
+    and latest modification time of its files), or None for other workspaces such as enterprise geodatabases.
+    """
+    while path and not os.path.exists(path):
+        # A feature dataset or feature class in a geodatabase.
+        path = os.path.dirname(path)
+    if not path or path.lower().endswith('.sde'):
+        return None
+    if os.path.isdir(path):
+        # Lock files come and go while the data is read.
+        times = [os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path) if not name.endswith('.lock')]
+    else:
+        times = [os.path.getmtime(path)]
+    return '{0}:{1}'.format(len(times), max(times or [0]))
+
+
+def get_row_count(data_path):
+    """Returns the number of rows of a table (kept in the catalog snapshot)."""
+    return job.cached('rows:{0}'.format(data_path), lambda: int(arcpy.GetCount_management(data_path).getOutput(0)))
+
+
+def list_folder(job, tables_to_keep, tables_to_skip):
+    """Returns the paths of the shapefiles in a folder to index."""
+    tables = []
+    if job.tables_to_keep:
+        for t in tables_to_keep:
+            [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
+    else:
+        [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses()]
+
+    if tables_to_skip:
+        for t in tables_to_keep:
+            [tables.remove(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
+    return tables
+
+
+def list_workspace(job, tables_to_keep, tables_to_skip):
+    """Returns the paths of the tables and feature classes in a geodatabase to index."""
+    feature_datasets = arcpy.ListDatasets('*', 'Feature')
+    tables = []
+    if job.tables_to_keep:
+        for t in tables_to_keep:
+            [tables.append(os.path.join(job.path, tbl)) for tbl in arcpy.ListTables(t)]
+            [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
+            for fds in feature_datasets:
+                [tables.append(os.path.join(job.path, fds, fc)) for fc in arcpy.ListFeatureClasses(wild_card=t, feature_dataset=fds)]
+    else:
+        [tables.append(os.path.join(job.path, tbl)) for tbl in arcpy.ListTables()]
+        [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses()]
+        for fds in feature_datasets:
+            [tables.append(os.path.join(job.path, fds, fc)) for fc in arcpy.ListFeatureClasses(feature_dataset=fds)]
+
+    if tables_to_skip:
+        for t in tables_to_keep:
+            [tables.remove(os.path.join(job.path, tbl)) for tbl in arcpy.ListTables(t)]
+            [tables.remove(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
+            for fds in feature_datasets:
+                [tables.remove(os.path.join(job.path, fds, fc)) for fc in arcpy.ListFeatureClasses(wild_card=t, feature_dataset=fds)]
+    return tables
+
+
+def list_feature_dataset(job, tables_to_keep, tables_to_skip):
+    """Returns the paths of the feature classes in a feature dataset to index."""
+    if tables_to_keep and not tables_to_keep == ["*"]:
+        tables = []
+        for tbl in tables_to_keep:
+            [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(tbl)]
+            tables = list(set(tables))
+    else:
+        tables = [os.path.join(job.path, fc) for fc in arcpy.ListFeatureClasses()]
+    if tables_to_skip:
+        for tbl in tables_to_skip:
+            [tables.remove(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(tbl) if fc in tables]
+    return tables
+
+
 def run_job(esri_job):
     """Determines the data type and each dataset is sent to the worker to be processed."""
     status_writer.send_percent(0.0, "Initializing... 0.0%", 'esri_worker')
@@ -678,6 +852,8 @@ def run_job(esri_job):
         return
 
     dsc = arcpy.Describe(job.path)
+    # The tables and row counts are reused while the workspace files are unchanged (catalog snapshot).
+    job.load_catalog(get_fingerprint(job.path) if job.catalog_cache else None)
     # A single feature class or table.
     if dsc.dataType in ('DbaseTable', 'FeatureClass', 'ShapeFile', 'Shapefile', 'Table'):
         global_job(job, int(arcpy.GetCount_management(job.path).getOutput(0)))
@@ -688,18 +864,9 @@ def run_job(esri_job):
     # A folder (for shapefiles).
     elif dsc.dataType == 'Folder':
         arcpy.env.workspace = job.path
-        tables = []
         tables_to_keep = job.tables_to_keep()
         tables_to_skip = job.tables_to_skip()
-        if job.tables_to_keep:
-            for t in tables_to_keep:
-                [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
-        else:
-            [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses()]
-
-        if tables_to_skip:
-            for t in tables_to_keep:
-                [tables.remove(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
+        tables = job.cached('tables', lambda: list_folder(job, tables_to_keep, tables_to_skip))
 
     # A geodatabase (.mdb, .gdb, or .sde).
     elif dsc.dataType == 'Workspace':
@@ -735,57 +902,36 @@ def run_job(esri_job):
 
 
         arcpy.env.workspace = job.path
-        feature_datasets = arcpy.ListDatasets('*', 'Feature')
-        tables = []
         tables_to_keep = job.tables_to_keep()
         tables_to_skip = job.tables_to_skip()
-        if job.tables_to_keep:
-            for t in tables_to_keep:
-                [tables.append(os.path.join(job.path, tbl)) for tbl in arcpy.ListTables(t)]
-                [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
-                for fds in feature_datasets:
-                    [tables.append(os.path.join(job.path, fds, fc)) for fc in arcpy.ListFeatureClasses(wild_card=t, feature_dataset=fds)]
-        else:
-            [tables.append(os.path.join(job.path, tbl)) for tbl in arcpy.ListTables()]
-            [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses()]
-            for fds in feature_datasets:
-                [tables.append(os.path.join(job.path, fds, fc)) for fc in arcpy.ListFeatureClasses(feature_dataset=fds)]
-
-        if tables_to_skip:
-            for t in tables_to_keep:
-                [tables.remove(os.path.join(job.path, tbl)) for tbl in arcpy.ListTables(t)]
-                [tables.remove(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(t)]
-                for fds in feature_datasets:
-                    [tables.remove(os.path.join(job.path, fds, fc)) for fc in arcpy.ListFeatureClasses(wild_card=t, feature_dataset=fds)]
+        tables = job.cached('tables', lambda: list_workspace(job, tables_to_keep, tables_to_skip))
 
     # A geodatabase feature dataset, SDC data, or CAD dataset.
     elif dsc.dataType == 'FeatureDataset' or dsc.dataType == 'CadDrawingDataset':
         tables_to_keep = job.tables_to_keep()
         tables_to_skip = job.tables_to_skip()
         arcpy.env.workspace = job.path
-        if tables_to_keep and not tables_to_keep == ["*"]:
-            tables = []
-            for tbl in tables_to_keep:
-                [tables.append(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(tbl)]
-                tables = list(set(tables))
-        else:
-            tables = [os.path.join(job.path, fc) for fc in arcpy.ListFeatureClasses()]
-        if tables_to_skip:
-            for tbl in tables_to_skip:
-                [tables.remove(os.path.join(job.path, fc)) for fc in arcpy.ListFeatureClasses(tbl) if fc in tables]
+        tables = job.cached('tables', lambda: list_feature_dataset(job, tables_to_keep, tables_to_skip))
 
     # Not a recognized data type.
     else:
         sys.exit(1)
 
+    job.save_catalog()
     if job.multiprocess:
         # Multiprocess larger databases and feature datasets.
         multiprocessing.log_to_stderr()
         logger = multiprocessing.get_logger()
         logger.setLevel(logging.INFO)
-        pool = multiprocessing.Pool(initializer=global_job, initargs=(job,))
-        for i, _ in enumerate(pool.imap_unordered(worker, tables), 1):
-            status_writer.send_percent(i / len(tables), "{0:%}".format(i / len(tables)), 'esri_worker')
+        global_job(job)
+        tasks = get_tasks(tables)
+        table_tasks = Counter(task[0] for task in tasks)
+        table_done = Counter()
+        pool = multiprocessing.Pool(job.processes, initializer=global_job, initargs=(job,))
+        for i, (tbl, _) in enumerate(pool.imap_unordered(index_task, tasks), 1):
+            # Aggregate the progress of the ObjectID ranges of each table.
+            table_done[tbl] += 1
+            status_writer.send_percent(i / len(tasks), "{0} {1:%}".format(os.path.basename(tbl), table_done[tbl] / table_tasks[tbl]), 'esri_worker')
         # Synchronize the main process with the job processes to ensure proper cleanup.
         pool.close()
         pool.join()
@@ -799,7 +945,10 @@ def run_job(esri_job):
                 status_writer.send_percent(i / len(tables), "{0} {1:%}".format(tbl, i / len(tables)), 'esri_worker')
             except Exception as ex:
                 print(ex)
+                job.table_failed(tbl)
                 continue
     gdb_entry['entry']['links'] = gdb_links
     job.send_entry(gdb_entry)
+    job.flush_entries()
+    job.save_catalog()
     return
@@ -11,66 +11,156 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import multiprocessing
 import base_job
 from osgeo import ogr
 from osgeo import gdalconst
+from utils import status
+from utils import metrics
+
+status_writer = status.ProgressWriter()
 
 
 def global_job(args):
     """Create a global job object for multiprocessing."""
-    global job
+    global job, datasource
     job = args
+    datasource = None
+
+
+def get_geo(g):
+    """Returns the point, or the envelope of other geometry types, of a geometry (empty for None)."""
+    geo = {}
+    if g is None:
+        return geo
+    if g.GetGeometryType() == 1:  # point
+        geo['lon'] = g.GetX()
+        geo['lat'] = g.GetY()
+    else:
+        e = g.GetEnvelope()
+        geo['xmin'] = e[0]
+        geo['xmax'] = e[1]
+        geo['ymin'] = e[2]
+        geo['ymax'] = e[3]
+    return geo
+
+
+def read_features(layer, fnames):
+    """Generator over the FID, geometry (see get_geo) and field values of each feature, a feature at a time."""
+    ldef = layer.GetLayerDefn()
+    indexes = [ldef.GetFieldIndex(fn) for fn in fnames]
+    for f in layer:
+        yield f.GetFID(), get_geo(f.GetGeometryRef()), [f.GetField(i) for i in indexes]
+
+
+def get_layers(ds):
+    """Returns the names of the layers to index."""
+    tables_to_keep = job.tables_to_keep()
+    keep = [t.lower() for t in tables_to_keep]
+    return [l.GetName() for l in ds if '*' in tables_to_keep or l.GetName().lower() in keep]
+
+
+def index_layer(l):
+    """Index each feature of a layer that matches the query, constraint and extent of the layer.
+    Returns the number of features.
+    """
+    fnames = []
+    ldef = l.GetLayerDefn()
+    ln = ldef.GetName()
+    metrics.set_table(ln)
+
+    # Fields
+    ftypes = {}
+    skipped = []
+    for i in range(ldef.GetFieldCount()):
+        fdef = ldef.GetFieldDefn(i)
+        fn = fdef.GetName()
+        if '*' in job.fields_to_keep or fn.lower() in [f.lower() for f in job.fields_to_keep]:
+            fnames.append(fn)
+            ftypes[fn] = fdef.GetTypeName()
+        else:
+            skipped.append(fn)
+    # The geometry (for the point or envelope of each feature) is not read if it is skipped,
+    # by the name of the geometry column or as OGR_GEOMETRY.
+    fields_to_skip = [f.lower() for f in job.fields_to_skip or []]
+    if l.GetGeometryColumn().lower() in fields_to_skip or 'ogr_geometry' in fields_to_skip:
+        skipped.append('OGR_GEOMETRY')
+    mapping_plan = job.mapping_plan(ln, fnames, ftypes)
+    if skipped:
+        # Fields that are not indexed are not read.
+        l.SetIgnoredFields(skipped)
+
+    # Filters
+    query = job.get_table_query(ln)
+    constraint = job.get_table_constraint(ln)
+    expression = ' AND '.join('({0})'.format(e) for e in (query, constraint) if e)
+    if expression:
+        l.SetAttributeFilter(expression)
+    extent = job.get_table_extent(ln)
+    if extent:
+        l.SetSpatialFilterRect(*extent)
+
+    # Features are read one at a time. The Arrow stream of a layer (GetArrowStreamAsNumPy, GDAL 3.6)
+    # is only in the Python 3 bindings.
+    features = read_features(l, fnames)
+    location_id = job.location_id
+    action_type = job.action_type
+    count = 0
+    for fid, geo, fvalues in metrics.timed('fetch', features):
+        started = metrics.start()
+        mapped_fields = mapping_plan.project(fvalues)
+        metrics.stop('map', started)
+        entry = {}
+        entry['id'] = '{0}_{1}_{2}'.format(location_id, ln, fid)
+        entry['location'] = location_id
+        entry['action'] = action_type
+        entry['entry'] = {'geo': geo, 'fields': mapped_fields}
+        job.send_entry(entry)
+        count += 1
+    job.flush_entries()
+    return count
+
+
+def index_layer_task(layer_name):
+    """Index a layer in a pool process, which has its own data source handle and ZMQ socket."""
+    global datasource
+    if datasource is None:
+        # This reads the field mapping, queries, constraints and extents of the layers into the job.
+        job.tables_to_keep()
+        job.connect_to_zmq()
+        datasource = ogr.Open(job.url, gdalconst.GA_ReadOnly)
+    # The metrics of each layer are returned to the main process.
+    metrics.reset()
+    count = index_layer(datasource.GetLayerByName(layer_name))
+    return layer_name, count, metrics.summary()
 
 
 def worker():
-    """Worker function to index each geometry in each feature in the datasource."""
-    job.connect_to_zmq()
+    """Worker function to index each geometry in each feature in the datasource.
+    With multiprocessing, the layers are indexed concurrently by a pool of processes.
+    """
     ds = ogr.Open(job.url, gdalconst.GA_ReadOnly)
-    # Layers
-    for l in ds:
-        # Fields
-        fnames = []
-        ldef = l.GetLayerDefn()
-
-        # Layer name
-        ln = ldef.GetName()
-
-        # process or skip this layer
-        cont = '*' in job.tables_to_keep or ln.lower() in [t.lower() for t in job.tables_to_keep]
-
-        if cont:
-            for i in range(ldef.GetFieldCount()):
-                fn = ldef.GetFieldDefn(i).GetName()
-                if '*' in job.fields_to_keep or fn.lower() in [f.lower() for f in job.fields_to_keep]:
-                    fnames.append(fn)
-
-            # Features
-            for f in l:
-                # Geometry
-                g = f.GetGeometryRef()
-                # Geomtry type
-                t = g.GetGeometryType()
-                geo = {}
-                if t == 1: # point
-                    geo['lon'] = g.GetX()
-                    geo['lat'] = g.GetY()
-                else:
-                    e = g.GetEnvelope()
-                    geo['xmin'] = e[0]
-                    geo['xmax'] = e[1]
-                    geo['ymin'] = e[2]
-                    geo['ymax'] = e[3]
-
-                fvalues = []
-                for i in fnames:
-                    fvalues.append(f.GetField(i))
-
-                entry = {}
-                entry['id'] = '{0}_{1}_{2}'.format(job.location_id, l.GetName(), f.GetFID())
-                entry['location'] = job.location_id
-                entry['action'] = job.action_type
-                entry['entry'] = {'geo': geo, 'fields': dict(zip(job.map_fields(ln, fnames), fvalues))}
-                job.send_entry(entry)
+    layers = get_layers(ds)
+    if job.multiprocess and len(layers) > 1:
+        # Each process opens the data source itself.
+        ds = None
+        processes = min(job.processes or multiprocessing.cpu_count(), len(layers))
+        pool = multiprocessing.Pool(processes, initializer=global_job, initargs=(job,))
+        try:
+            for i, (ln, count, layer_metrics) in enumerate(pool.imap_unordered(index_layer_task, layers), 1):
+                metrics.merge(layer_metrics)
+                status_writer.send_percent(float(i) / len(layers), '{0}: {1} features'.format(ln, count), 'gdal_worker')
+            # Synchronize the main process with the job processes to ensure proper cleanup.
+            pool.close()
+            pool.join()
+        except Exception:
+            pool.terminate()
+            raise
+    else:
+        job.connect_to_zmq()
+        for i, ln in enumerate(layers, 1):
+            count = index_layer(ds.GetLayerByName(ln))
+            status_writer.send_percent(float(i) / len(layers), '{0}: {1} features'.format(ln, count), 'gdal_worker')
 
 
 def run_job(job_info):
@@ -11,15 +11,25 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
 import decimal
 import json
-import random
+import tempfile
+import Queue
+import threading
 import base_job
 import gridfs
+import pymongo
+from bson import json_util
 from utils import status
+from utils import store
+from utils import metrics
 from utils import worker_utils
 
-status_writer = status.Writer()
+status_writer = status.ProgressWriter()
+
+# Milliseconds the server waits for changes before a change stream returns no change.
+CHANGE_STREAM_WAIT = 500
 
 
 class ComplexEncoder(json.JSONEncoder):
@@ -49,109 +59,395 @@ def get_collections(job):
     return collection_names
 
 
+def get_projection(job):
+    """Returns the projection of the fields to keep (None for all fields). The location and
+    GridFS metadata are always returned, they are read by the worker.
+    """
+    fields = job.fields_to_keep
+    if any(w in ''.join(fields) for w in '*%'):
+        skip = [f for f in job.fields_to_skip or [] if not any(w in f for w in '*%') and not f == '_id']
+        return dict((f, 0) for f in skip) or None
+    projection = dict((f, 1) for f in fields)
+    projection['loc'] = 1
+    if job.has_gridfs:
+        projection['metadata'] = 1
+    return projection
+
+
+def id_bracket(value):
+    """Returns the BSON type bracket of an _id value (numbers compare with each other)."""
+    return 'number' if isinstance(value, (int, long, float)) else type(value)
+
+
+def get_bounds(job, col, document_count):
+    """Returns the _id values that split a collection into ranges of about the same number of documents,
+    from splitVector or, if it is not allowed, a sample of the collection. A collection is not split
+    if its _id values are of more than one type (range queries only match one type).
+    """
+    ranges = job.mongodb_ranges
+    if ranges <= 1 or document_count < ranges * job.mongodb_batch_size:
+        return []
+    first = col.find_one({}, {'_id': 1}, sort=[('_id', 1)])
+    last = col.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    if not first or not last or not id_bracket(first['_id']) == id_bracket(last['_id']):
+        status_writer.send_status('{0}: _id values are of more than one type, the collection is not split.'.format(col.name))
+        return []
+    try:
+        size = col.database.command('collstats', col.name)['size']
+        result = col.database.command('splitVector', col.full_name, keyPattern={'_id': 1},
+                                      maxChunkSizeBytes=max(size // ranges, 1),
+                                      maxChunkObjects=max(document_count // ranges, 1))
+        keys = [k['_id'] for k in result['splitKeys']]
+    except pymongo.errors.OperationFailure:
+        # splitVector requires the clusterManager role.
+        sample = col.aggregate([{'$sample': {'size': ranges * 32}}, {'$project': {'_id': 1}}])
+        keys = sorted(d['_id'] for d in sample)
+    # Keep ranges - 1 evenly spaced keys.
+    keys = [keys[len(keys) * r // ranges] for r in range(1, ranges)] if len(keys) >= ranges else keys
+    return sorted(set(keys))
+
+
+def scan_range(job, col, query_filter, projection, lower, upper, start_after):
+    """Generator over the batches of documents of a collection with _id values from lower up to upper
+    (None for no bound), after start_after if it is not None. Documents are read in _id order
+    when the range is bounded or checkpoints are saved.
+    """
+    conditions = [query_filter] if query_filter else []
+    id_filter = {}
+    if lower is not None:
+        id_filter['$gte'] = lower
+    if upper is not None:
+        id_filter['$lt'] = upper
+    if start_after is not None:
+        id_filter['$gt'] = start_after
+    if id_filter:
+        conditions.append({'_id': id_filter})
+    if len(conditions) > 1:
+        query_filter = {'$and': conditions}
+    elif conditions:
+        query_filter = conditions[0]
+    batch_size = job.mongodb_batch_size
+    documents = col.find(query_filter, projection, batch_size=batch_size)
+    if id_filter or job.checkpoints:
+        documents = documents.sort('_id', 1)
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def scan_thread(job, col, query_filter, projection, r, lower, upper, start_after, batches):
+    """Scan one _id range of a collection and queue its batches, then None."""
+    try:
+        for docs in scan_range(job, col, query_filter, projection, lower, upper, start_after):
+            batches.put((r, docs))
+    except Exception as ex:
+        batches.put(ex)
+    batches.put((r, None))
+
+
+def scan_collection(job, col, query_filter, projection, state):
+    """Generator over the (range, documents) batches of a collection, then (range, None) when a range
+    is finished. With more than one range, the ranges are scanned on threads (sharing the pooled
+    connections of the client) and their batches are returned as they arrive.
+    """
+    bounds = [None] + state['bounds'] + [None]
+    scanning = [r for r in range(len(bounds) - 1) if r not in state['finished']]
+    if len(bounds) == 2:
+        if scanning:
+            for docs in scan_range(job, col, query_filter, projection, None, None, state['positions'][0]):
+                yield 0, docs
+            yield 0, None
+        return
+
+    batches = Queue.Queue(len(scanning) * 4)
+    for r in scanning:
+        scanner = threading.Thread(target=scan_thread, args=(job, col, query_filter, projection, r, bounds[r],
+                                                              bounds[r + 1], state['positions'][r], batches))
+        scanner.daemon = True
+        scanner.start()
+    done = 0
+    while done < len(scanning):
+        batch = batches.get()
+        if isinstance(batch, Exception):
+            raise batch
+        if batch[1] is None:
+            done += 1
+        yield batch
+
+
+def load_state(job, collection_name, bounds):
+    """Returns the _id bounds of the ranges of a collection, the last _id sent from each range and the
+    finished ranges, from the checkpoint when resuming (the bounds are only computed if there is none).
+    """
+    position = job.get_checkpoint(collection_name)
+    if position:
+        state = json_util.loads(position)
+        if not isinstance(state, dict):
+            # The _id of the last document sent, without ranges.
+            state = {'bounds': [], 'positions': [state], 'finished': []}
+        return state
+    bounds = bounds()
+    return {'bounds': bounds, 'positions': [None] * (len(bounds) + 1), 'finished': []}
+
+
+class DocumentMapper(object):
+    """Maps the documents of a collection to index entries. The fields, field types and geometry
+    of the last document mapped are kept for the collection schema.
+
+    The documents of a GridFS files collection carry their metadata, so it is read with the
+    documents. File contents are only read (streamed to the extract folder) if the collection
+    has a format, that is, content extraction is requested.
+    """
+    def __init__(self, job, col, table_id, projection=None):
+        self.job = job
+        self.col = col
+        self.table_id = table_id
+        self.projection = projection
+        self.fields = []
+        self.field_types = {}
+        self.geo = {}
+        self.geometry_ops = worker_utils.GeometryOps()
+        self.geo_json_converter = worker_utils.GeoJSONConverter()
+        self.generalize_value = job.generalize_value
+        self.files = job.has_gridfs and col.name.endswith('.files')
+        self.extract = self.files and bool(job.format)
+        if self.extract:
+            self.root = col.database[col.name.rsplit('.', 1)[0]]
+            self.extract_folder = os.path.join(tempfile.gettempdir(), 'voyager', job.location_id, col.name)
+            if not os.path.exists(self.extract_folder):
+                os.makedirs(self.extract_folder)
+
+    def extract_file(self, doc):
+        """Streams the chunks of a GridFS file to the extract folder and returns its path."""
+        if self.projection:
+            # The file length and chunk size may not be projected.
+            grid_out = gridfs.GridOut(self.root, file_id=doc['_id'])
+        else:
+            grid_out = gridfs.GridOut(self.root, file_document=doc)
+        path = os.path.join(self.extract_folder, '{0}_{1}'.format(doc['_id'], os.path.basename(grid_out.filename or '')))
+        started = metrics.start()
+        with open(path, 'wb') as fp:
+            for chunk in grid_out:
+                fp.write(chunk)
+        metrics.stop('extract', started)
+        return path
+
+    def map_document(self, doc):
+        """Returns the entry of a document."""
+        job = self.job
+        col = self.col
+        geometry_ops = self.geometry_ops
+        geo_json_converter = self.geo_json_converter
+        generalize_value = self.generalize_value
+        fields = doc.keys()
+        field_types = dict((k, type(v)) for k, v in doc.iteritems())
+        path = self.extract_file(doc) if self.extract else None
+        metadata = doc.get('metadata') if self.files else None
+        if isinstance(metadata, dict):
+            fields += metadata.keys()
+            field_types = dict(field_types.items() + dict((k, type(v)) for k, v in metadata.iteritems()).items())
+            values = [doc[k] for k in doc.keys() if not k == 'metadata']
+            values += metadata.values()
+            fields.remove('metadata')
+        else:
+            values = doc.values()
+        entry = {}
+        geo = {}
+        if 'loc' in doc:
+            if 'type' in doc['loc']:
+                if 'bbox' in doc['loc']:
+                    if job.include_wkt:
+                        wkt = geo_json_converter.convert_to_wkt(doc['loc'], 3)
+                        if generalize_value == 0:
+                            geo['wkt'] = wkt
+                        else:
+                            geo['wkt'] = geometry_ops.generalize_geometry(wkt, generalize_value)
+                    geo['xmin'] = doc['loc']['bbox'][0]
+                    geo['ymin'] = doc['loc']['bbox'][1]
+                    geo['xmax'] = doc['loc']['bbox'][2]
+                    geo['ymax'] = doc['loc']['bbox'][3]
+                elif 'Point' in doc['loc']['type']:
+                    if job.include_wkt:
+                        geo['wkt'] = geo_json_converter.convert_to_wkt(doc['loc'], 3)
+                    geo['lon'] = doc['loc']['coordinates'][0]
+                    geo['lat'] = doc['loc']['coordinates'][1]
+                else:
+                    status_writer.send_state(status.STAT_WARNING, 'No bbox information for {0}.'.format(doc['_id']))
+            elif isinstance(doc['loc'][0], float):
+                geo['lon'] = doc['loc'][0]
+                geo['lat'] = doc['loc'][1]
+            else:
+                geo['xmin'] = doc['loc'][0][0]
+                geo['xmax'] = doc['loc'][0][1]
+                geo['ymin'] = doc['loc'][1][0]
+                geo['ymax'] = doc['loc'][1][1]
+            fields.remove('loc')
+            doc.pop('loc')
+            values = doc.values()
+        started = metrics.start()
+        mapped_fields = job.mapping_plan(col.name, fields, field_types).project(values)
+        metrics.stop('map', started)
+        mapped_fields['_discoveryID'] = job.discovery_id
+        mapped_fields['title'] = col.name
+        mapped_fields['format_type'] = 'Record'
+        mapped_fields['format'] = 'application/vnd.mongodb.record'
+        if path:
+            mapped_fields['path'] = path
+            mapped_fields['__to_extract'] = True
+        entry['id'] = str(doc['_id'])
+        entry['location'] = job.location_id
+        entry['action'] = job.action_type
+        entry['entry'] = {'geo': geo, 'fields': mapped_fields}
+        entry['entry']['links'] = [{'relation': 'database', 'id': self.table_id}]
+        self.fields = fields
+        self.field_types = field_types
+        self.geo = geo
+        return entry
+
+
+def watch(job, col, token=None):
+    """Opens a change stream of a collection that resumes after a token (or starts now).
+    The full document of an update is looked up when the change is read.
+    """
+    return col.watch(full_document='updateLookup', resume_after=token, batch_size=job.mongodb_batch_size,
+                     max_await_time_ms=CHANGE_STREAM_WAIT)
+
+
+def change_entry(job, mapper, change, query_filter, projection):
+    """Returns the entry to send for a change event: the document for an insert, update or replace and
+    a delete for a delete (or for a document that no longer matches the table query). Returns None
+    for other events. With a query or projection, the document is read again with them.
+    """
+    operation = change['operationType']
+    if operation in ('insert', 'update', 'replace'):
+        doc = change.get('fullDocument')
+        if doc is not None and (query_filter or projection):
+            doc = mapper.col.find_one({'$and': [query_filter, {'_id': doc['_id']}]}, projection)
+        if doc is not None:
+            return mapper.map_document(doc)
+    elif not operation == 'delete':
+        return None
+    return {'id': str(change['documentKey']['_id']), 'location': job.location_id, 'action': 'DELETE'}
+
+
+def index_changes(job, stream, mapper, tokens, collection_name, query_filter, projection):
+    """Indexes the changes that are waiting on a change stream and saves the resume token once they are sent.
+    Returns the number of changes, or None if the stream was invalidated (the collection was dropped or renamed).
+    """
+    count = 0
+    while stream.alive:
+        started = metrics.start()
+        change = stream.try_next()
+        metrics.stop('fetch', started)
+        if change is None:
+            break
+        if change['operationType'] == 'invalidate':
+            # The next run scans the collection again.
+            job.flush_entries()
+            tokens.delete(collection_name)
+            return None
+        entry = change_entry(job, mapper, change, query_filter, projection)
+        if entry:
+            job.send_entry(entry)
+            count += 1
+    job.flush_entries()
+    if stream.resume_token:
+        tokens.save(collection_name, json_util.dumps(stream.resume_token))
+    metrics.count('changes', count, collection_name)
+    return count
+
+
 def run_job(mongodb_job):
-    """Worker function to index each document in each collection in the database."""
+    """Worker function to index each document in each collection in the database.
+    With change streams, a collection that was indexed before is only updated with its changes.
+    """
     job = mongodb_job
     job.connect_to_zmq()
     job.connect_to_database()
     collection_names = get_collections(job)
-    geo = {}
+    tokens = None
+    if job.mongodb_change_streams:
+        if job.delta:
+            status_writer.send_status('Change streams are not used with delta indexing.')
+        else:
+            tokens = store.ResumeTokenStore(job.mongodb_token_store, job.location_id)
+    streams = {}
 
-    grid_fs = None
     for collection_name in collection_names:
-        if job.has_gridfs:
-            if collection_name.find('.files') > 0:
-                grid_fs = gridfs.GridFS(job.db_connection, collection_name.split('.')[0])
-
+        if job.is_done(collection_name):
+            continue
+        metrics.set_table(collection_name)
         col = job.db_connection[collection_name]
-        query = job.get_table_query(col)
-        if query:
-            documents = col.find(eval(query))
-        else:
-            documents = col.find()
+        query = job.get_table_query(collection_name)
+        query_filter = eval(query) if query else {}
+        projection = get_projection(job)
+        table_id = '{0}_{1}'.format(job.location_id, collection_name)
+        mapper = DocumentMapper(job, col, table_id, projection)
+
+        # -----------------------------------------------------------------------------------------
+        # Index the changes since the last run, unless the resume token has expired from the oplog.
+        # -----------------------------------------------------------------------------------------
+        stream = None
+        if tokens and tokens.get(collection_name) and not job.schema_only:
+            try:
+                stream = watch(job, col, json_util.loads(tokens.get(collection_name)))
+                if index_changes(job, stream, mapper, tokens, collection_name, query_filter, projection) is not None:
+                    streams[collection_name] = (stream, mapper, query_filter, projection)
+                    continue
+            except pymongo.errors.OperationFailure as ex:
+                status_writer.send_status('{0}: changes cannot be resumed ({1}), the collection is scanned.'.format(collection_name, ex))
+        if tokens and not job.schema_only:
+            # The stream is opened before the scan, so changes made while scanning are indexed next.
+            try:
+                stream = watch(job, col)
+                token = stream.resume_token
+            except pymongo.errors.OperationFailure as ex:
+                status_writer.send_status('{0}: change streams are not available ({1}).'.format(collection_name, ex))
+                stream = None
 
-        if documents.count() > 0:
-            fields = documents[0].keys()
-            field_types = dict((k, type(v)) for k, v in documents[0].iteritems())
+        # The documents are counted once, the first one gives the schema.
+        started = metrics.start()
+        document_count = col.count(query_filter)
+        first_doc = col.find_one(query_filter, projection) if document_count > 0 else None
+        metrics.stop('query', started)
+        if first_doc:
+            mapper.fields = first_doc.keys()
+            mapper.field_types = dict((k, type(v)) for k, v in first_doc.iteritems())
         else:
-            break
+            continue
 
-        table_id = '{0}_{1}'.format(job.location_id, collection_name)
         if not job.schema_only:
-            # Index each document -- get a suitable base 10 increment for reporting percentage.
-            try:
-                increment = job.get_increment(documents.count())
-            except ValueError:
-                status_writer.send_status('No documents found in collection, {0}'.format(collection_name))
-                continue
-            geometry_ops = worker_utils.GeometryOps()
-            generalize_value = job.generalize_value
-            for i, doc in enumerate(documents):
-                fields = doc.keys()
-                field_types = dict((k, type(v)) for k, v in doc.iteritems())
-                if grid_fs:
-                    grid_out = grid_fs.get(doc['_id'])
-                    if hasattr(grid_out, 'metadata'):
-                        #TODO: Determine how to ingest files stored in the database.
-                        #with open(r"c:\temp\{0}".format(grid_out.filename), "wb") as fp:
-                            #fp.write(grid_out.read())
-                        fields += grid_out.metadata.keys()
-                        field_types = dict(field_types.items() + dict((k, type(v)) for k, v in grid_out.metadata.iteritems()).items())
-                        values = [doc[k] for k in doc.keys() if not k == 'metadata']
-                        values += grid_out.metadata.values()
-                        fields.remove('metadata')
-                else:
-                    values = doc.values()
-                entry = {}
-                geo = {}
-                geo_json_converter = worker_utils.GeoJSONConverter()
-                if 'loc' in doc:
-                    if 'type' in doc['loc']:
-                        if 'bbox' in doc['loc']:
-                            if job.include_wkt:
-                                wkt = geo_json_converter.convert_to_wkt(doc['loc'], 3)
-                                if generalize_value == 0:
-                                    geo['wkt'] = wkt
-                                else:
-                                    geo['wkt'] = geometry_ops.generalize_geometry(wkt, generalize_value)
-                            geo['xmin'] = doc['loc']['bbox'][0]
-                            geo['ymin'] = doc['loc']['bbox'][1]
-                            geo['xmax'] = doc['loc']['bbox'][2]
-                            geo['ymax'] = doc['loc']['bbox'][3]
-                        elif 'Point' in doc['loc']['type']:
-                            if job.include_wkt:
-                                geo['wkt'] = geo_json_converter.convert_to_wkt(doc['loc'], 3)
-                            geo['lon'] = doc['loc']['coordinates'][0]
-                            geo['lat'] = doc['loc']['coordinates'][1]
-                        else:
-                            status_writer.send_state(status.STAT_WARNING, 'No bbox information for {0}.'.format(doc['_id']))
-                    elif isinstance(doc['loc'][0], float):
-                        geo['lon'] = doc['loc'][0]
-                        geo['lat'] = doc['loc'][1]
-                    else:
-                        geo['xmin'] = doc['loc'][0][0]
-                        geo['xmax'] = doc['loc'][0][1]
-                        geo['ymin'] = doc['loc'][1][0]
-                        geo['ymax'] = doc['loc'][1][1]
-                    fields.remove('loc')
-                    doc.pop('loc')
-                    values = doc.values()
-                mapped_fields = job.map_fields(col.name, fields, field_types)
-                mapped_fields = dict(zip(mapped_fields, values))
-                mapped_fields['_discoveryID'] = job.discovery_id
-                mapped_fields['title'] = col.name
-                mapped_fields['format_type'] = 'Record'
-                mapped_fields['format'] = 'application/vnd.mongodb.record'
-                entry['id'] = str(doc['_id'])
-                entry['location'] = job.location_id
-                entry['action'] = job.action_type
-                entry['entry'] = {'geo': geo, 'fields': mapped_fields}
-                entry['entry']['links'] = [{'relation': 'database', 'id': table_id}]
-                job.send_entry(entry)
-                if (i % increment) == 0:
-                    status_writer.send_percent(float(i) / documents.count(),
-                                               '{0}: {1:%}'.format(collection_name, float(i)/documents.count()),
-                                               'MongoDB')
+            # Index each document.
+            state = load_state(job, collection_name, lambda: get_bounds(job, col, document_count))
+            i = 0
+            for r, docs in metrics.timed('fetch', scan_collection(job, col, query_filter, projection, state)):
+                if docs is None:
+                    state['finished'].append(r)
+                    if job.checkpoints:
+                        job.checkpoint(collection_name, json_util.dumps(state))
+                    continue
+                for doc in docs:
+                    job.send_entry(mapper.map_document(doc))
+                    i += 1
+                    status_writer.progress(collection_name, i, document_count, 'MongoDB', job.bytes_sent)
+                # Checkpoint the _id each range resumes after once the batch is sent.
+                state['positions'][r] = docs[-1]['_id']
+                if job.checkpoints:
+                    job.checkpoint(collection_name, json_util.dumps(state))
+            if stream:
+                job.flush_entries()
+                if token:
+                    tokens.save(collection_name, json_util.dumps(token))
+                streams[collection_name] = (stream, mapper, query_filter, projection)
+
+        fields = mapper.fields
+        field_types = mapper.field_types
+        geo = mapper.geo
 
         schema = {}
         schema['name'] = collection_name
@@ -192,14 +488,17 @@ def run_job(mongodb_job):
         table_entry['action'] = job.action_type
         table_entry['format_type'] = 'Schema'
         table_entry['relation'] = 'contains'
-        table_entry['entry'] = {'fields': {'format': 'schema', '_discoveryID': job.discovery_id, 'name': collection_name, 'path': job.mongodb_client_info, 'fi_rows': int(documents.count())}}
+        table_entry['entry'] = {'fields': {'format': 'schema', '_discoveryID': job.discovery_id, 'name': collection_name, 'path': job.mongodb_client_info, 'fi_rows': int(document_count)}}
         table_entry['entry']['fields']['schema'] = schema
         job.send_entry(table_entry)
+        job.flush_entries()
+        job.checkpoint(collection_name, None, done=True)
+        status_writer.flush()
         mongodb_links.append(table_entry)
 
     mongodb_entry = {}
     mongodb_properties = {}
-    mongodb_entry['id'] = job.location_id + str(random.randint(0, 1000))
+    mongodb_entry['id'] = '{0}_{1}'.format(job.location_id, job.mongodb_database)
     mongodb_properties['name'] = job.mongodb_database
     mongodb_properties['_discoveryID'] = job.discovery_id
     mongodb_properties['format'] = "MongoDB"
@@ -209,3 +508,18 @@ def run_job(mongodb_job):
     mongodb_entry['entry'] = {'fields': mongodb_properties}
     mongodb_entry['entry']['links'] = mongodb_links
     job.send_entry(mongodb_entry)
+    job.flush_entries()
+
+    # ----------------------------------------------------------------------------
+    # In continuous mode, follow the changes of each collection until interrupted.
+    # ----------------------------------------------------------------------------
+    while job.mongodb_continuous and streams:
+        for collection_name, (stream, mapper, query_filter, projection) in streams.items():
+            metrics.set_table(collection_name)
+            if index_changes(job, stream, mapper, tokens, collection_name, query_filter, projection) is None:
+                status_writer.send_status('{0}: the collection was dropped or renamed.'.format(collection_name))
+                streams.pop(collection_name)
+    for stream, mapper, query_filter, projection in streams.values():
+        stream.close()
+    if tokens:
+        tokens.close()
@@ -14,12 +14,28 @@
 import re
 import decimal
 import json
-import random
+import multiprocessing
+import base_job
 from utils import status
+from utils import metrics
 from utils import worker_utils
 
 
-status_writer = status.Writer()
+status_writer = status.ProgressWriter()
+
+# Rows fetched per call when streaming.
+FETCH_SIZE = 1000
+
+
+def global_job(job_file):
+    """Create a global job object for a process that scans key ranges of a table.
+    Each process has its own database connection and ZMQ socket.
+    """
+    global job
+    job = base_job.Job(job_file)
+    job.tables_to_keep()
+    job.connect_to_zmq()
+    job.connect_to_database()
 
 
 class ComplexEncoder(json.JSONEncoder):
@@ -52,6 +68,193 @@ def get_tables(job):
     return tables
 
 
+def stream_rows(rows, size=FETCH_SIZE):
+    """Yields the rows of an unbuffered cursor, fetched size rows at a time."""
+    while True:
+        batch = rows.fetchmany(size)
+        if not batch:
+            return
+        for row in batch:
+            yield row
+
+
+def get_row_estimate(job, table):
+    """Returns the number of rows in a table from the table statistics (an estimate for InnoDB tables),
+    or None if there are none (such as for a view).
+    """
+    row = job.db_cursor.execute("select table_rows from information_schema.tables "
+                                "where table_schema = database() and table_name = '{0}'".format(table)).fetchone()
+    return float(row[0]) if row and row[0] is not None else None
+
+
+def get_row_count(job, table, expression=''):
+    """Returns the estimated number of rows in a table. The rows are counted if exact_row_counts is set,
+    if they are filtered by an expression or if the table has no statistics.
+    """
+    started = metrics.start()
+    row_count = None
+    if not job.exact_row_counts and not expression:
+        row_count = get_row_estimate(job, table)
+    if row_count is None:
+        where = " where {0}".format(expression) if expression else ""
+        row_count = float(job.db_cursor.execute("select count(*) from {0}{1}".format(table, where)).fetchone()[0])
+    metrics.stop('query', started)
+    return row_count
+
+
+def get_wkb_column(geometry_field, generalize_value):
+    """Returns the column that selects the geometry as WKB, simplified by MySQL with a tolerance
+    derived from the generalize setting.
+    """
+    if generalize_value == 0:
+        return "ST_AsBinary({0})".format(geometry_field)
+    elif generalize_value > 0.9:
+        return "ST_AsBinary(ST_Envelope({0}))".format(geometry_field)
+    # The size of the envelope is the square root of its area (zero for vertical or horizontal lines).
+    tolerance = "{0} * SQRT(ST_Area(ST_Envelope({1})))".format(worker_utils.simplify_factor(generalize_value), geometry_field)
+    return "ST_AsBinary(ST_Simplify({0}, {1}))".format(geometry_field, tolerance)
+
+
+class RowMapper(object):
+    """Maps the rows of a table to the geometry and fields of an entry."""
+    def __init__(self, job, table, columns, column_types, geo, has_shape, is_point, geom_type, wkb=False):
+        if has_shape and is_point:
+            self.mapping_plan = job.mapping_plan(table, columns, column_types, offset=3)
+        elif has_shape and wkb:
+            self.mapping_plan = job.mapping_plan(table, columns[2:], column_types, offset=2)
+        elif has_shape:
+            self.mapping_plan = job.mapping_plan(table, columns[1:], column_types, offset=1)
+        else:
+            self.mapping_plan = job.mapping_plan(table, columns, column_types)
+        self.geo = geo
+        self.has_shape = has_shape
+        self.is_point = is_point
+        self.geom_type = geom_type
+        self.wkb = wkb
+        self.include_wkt = job.include_wkt
+        self.geometry_ops = worker_utils.GeometryOps()
+        self.generalize_value = job.generalize_value
+
+    def map_row(self, row):
+        """Returns the geometry and the mapped fields of a row."""
+        geo = self.geo
+        mapped_cols = self.mapping_plan.project(row)
+        mapped_cols.update(self.mapping_plan.new_fields)
+        if self.has_shape:
+            if self.is_point:
+                if self.include_wkt:
+                    geo['wkt'] = row[0]
+                geo['lon'] = row[2]
+                geo['lat'] = row[1]
+                mapped_cols['geometry_type'] = 'Point'
+            else:
+                if self.include_wkt:
+                    if self.wkb:
+                        # Simplified by MySQL.
+                        geo['wkt'] = worker_utils.wkb_to_wkt(row[1])
+                    elif self.generalize_value == 0:
+                        geo['wkt'] = row[0]
+                    else:
+                        geo['wkt'] = self.geometry_ops.generalize_geometry(str(row[0]), self.generalize_value)
+                nums = re.findall("-?(?:\.\d+|\d+(?:\.\d*)?)", row[0].rpartition(',')[0])
+                geo['xmin'] = float(nums[0])
+                geo['ymin'] = float(nums[1])
+                geo['xmax'] = float(nums[4])
+                geo['ymax'] = float(nums[5])
+                if 'POLYGON' in self.geom_type:
+                    mapped_cols['geometry_type'] = 'Polygon'
+                else:
+                    mapped_cols['geometry_type'] = 'Polyline'
+        mapped_cols['format_type'] = 'Record'
+        mapped_cols['format'] = 'application/vnd.mysql.record'
+        return geo, mapped_cols
+
+
+def index_range(args):
+    """Index the rows of a table with split column values from start up to stop.
+    The split column is selected last and its value is used for the entry id.
+    Returns the number of rows, the links for the table entry and the metrics of the range.
+    """
+    table, columns, expression, split_column, start, stop, mapper_args = args
+    metrics.reset()
+    metrics.set_table(table)
+    row_mapper = RowMapper(job, table, *mapper_args)
+    location_id = job.location_id
+    action_type = job.action_type
+    discovery_id = job.discovery_id
+    entry = {}
+    table_links = []
+    count = 0
+    key_filter = "{0} >= ? and {0} < ?".format(split_column)
+    if expression:
+        key_filter = "({0}) and {1}".format(expression, key_filter)
+
+    # When resuming, only link the rows that were indexed before the checkpoint.
+    # When streaming, rows are counted but not linked, so memory does not grow with the table.
+    checkpoint_name = '{0}:{1}'.format(table, start)
+    resume_at = start
+    if job.is_done(checkpoint_name):
+        resume_at = stop
+    elif job.get_checkpoint(checkpoint_name) is not None:
+        resume_at = job.get_checkpoint(checkpoint_name) + 1
+    if resume_at > start:
+        if job.streaming:
+            count = job.db_cursor.execute("select count(*) from {0} where {1}".format(table, key_filter), start, resume_at).fetchone()[0]
+        else:
+            keys = job.db_cursor.execute("select {0} from {1} where {2}".format(split_column, table, key_filter), start, resume_at)
+            table_links = [{'relation': 'contains', 'id': '{0}_{1}_{2}'.format(location_id, table, key[0])} for key in keys]
+            count = len(table_links)
+        if resume_at == stop:
+            return count, table_links, None
+
+    started = metrics.start()
+    rows = job.db_cursor.execute("select {0}, {1} from {2} where {3} order by {1}".format(','.join(columns), split_column, table, key_filter), resume_at, stop)
+    metrics.stop('query', started)
+    if job.streaming:
+        rows = stream_rows(rows)
+    for row in metrics.timed('fetch', rows):
+        started = metrics.start()
+        geo, mapped_cols = row_mapper.map_row(row)
+        metrics.stop('map', started)
+        entry['id'] = '{0}_{1}_{2}'.format(location_id, table, row[-1])
+        entry['location'] = location_id
+        entry['action'] = action_type
+        entry['entry'] = {'geo': geo, 'fields': mapped_cols}
+        entry['entry']['fields']['_discoveryID'] = discovery_id
+        job.send_entry(entry)
+        job.checkpoint(checkpoint_name, row[-1])
+        count += 1
+        if not job.streaming:
+            table_links.append({'relation': 'contains', 'id': entry['id']})
+    job.flush_entries()
+    job.checkpoint(checkpoint_name, None, done=True)
+    return count, table_links, metrics.summary()
+
+
+def index_ranges(job, table, columns, expression, split_column, split, key_range, mapper_args, row_count):
+    """Index a table in key ranges, each scanned by its own process and connection.
+    Returns the number of rows and the links for the table entry.
+    """
+    ranges = worker_utils.split_key_range(key_range[0], key_range[1], split)
+    args = [(table, columns, expression, split_column, start, stop, mapper_args) for start, stop in ranges]
+    pool = multiprocessing.Pool(len(ranges), initializer=global_job, initargs=(job.job_file,))
+    table_links = []
+    processed = 0
+    try:
+        for count, links, range_metrics in pool.imap_unordered(index_range, args):
+            processed += count
+            table_links += links
+            metrics.merge(range_metrics)
+            status_writer.progress(table, processed, row_count, 'MySql', job.bytes_sent)
+        # Synchronize the main process with the job processes to ensure proper cleanup.
+        pool.close()
+        pool.join()
+    except Exception:
+        pool.terminate()
+        raise
+    return processed, table_links
+
+
 def run_job(mysql_job):
     """Worker function to index each row in each table in the MySQL database."""
     job = mysql_job
@@ -63,9 +266,12 @@ def run_job(mysql_job):
     mysql_links = []
 
     for table in tables:
+        metrics.set_table(table)
         geo = {}
         is_point = False
         has_shape = False
+        wkb = False
+        geom_type = ''
 
         # --------------------------------------------------------------------------------------------------
         # Get the table schema.
@@ -145,9 +351,9 @@ def run_job(mysql_job):
         for col in job.db_cursor.columns(table=table).fetchall():
             if col.type_name == 'geometry':
                 has_shape = True
-                srid = job.db_cursor.execute("select SRID({0}) from {1}".format(col.column_name, table)).fetchone()[0]
+                srid = job.db_cursor.execute("select SRID({0}) from {1} limit 1".format(col.column_name, table)).fetchone()[0]
                 geo['code'] = srid
-                geom_type = job.db_cursor.execute("select GeometryType({0}) from {1}".format(col.column_name, table)).fetchone()[0]
+                geom_type = job.db_cursor.execute("select GeometryType({0}) from {1} limit 1".format(col.column_name, table)).fetchone()[0]
                 if geom_type == 'POINT':
                     is_point = True
                     columns.insert(0, "X({0})".format(col.column_name))
@@ -155,17 +361,69 @@ def run_job(mysql_job):
                     columns.insert(0, "AsText({0})".format(col.column_name))
                 else:
                     columns.insert(0, "AsText(Envelope({0}))".format(col.column_name))
+                    if job.geometry_pushdown and job.include_wkt:
+                        # Simplify the geometry in MySQL, unless the server does not support it (before 5.7).
+                        wkb_column = get_wkb_column(col.column_name, job.generalize_value)
+                        try:
+                            job.db_cursor.execute("select {0} from {1} limit 1".format(wkb_column, table)).fetchall()
+                            columns.insert(1, wkb_column)
+                            wkb = True
+                        except Exception as ex:
+                            status_writer.send_status('{0}: geometries are generalized by the worker ({1}).'.format(table, ex))
                 columns.remove(col.column_name)
                 column_types.pop(col.column_name)
                 break
 
-        # ------------------------------
-        # Query the table for the rows.
-        # ------------------------------
-        if not expression:
-            rows = job.db_cursor.execute("select {0} from {1}".format(','.join(columns), table))
+        # ------------------------------------------------------------------------------
+        # Query the table for the rows, or scan it in key ranges if it is split.
+        # ------------------------------------------------------------------------------
+        split, split_column = job.get_table_split(table)
+        split_column = split_column or primary_key
+        key_range = None
+        if split > 1 and split_column and not job.schema_only:
+            where = " where {0}".format(expression) if expression else ""
+            key_range = job.db_cursor.execute("select min({0}), max({0}) from {1}{2}".format(split_column, table, where)).fetchone()
+            if not all(isinstance(k, (int, long)) for k in key_range):
+                status_writer.send_status('{0}: {1} is not an integer key, the table is not split.'.format(table, split_column))
+                key_range = None
+            else:
+                row_count = get_row_count(job, table, expression)
+                select_columns = list(columns)
+        first_row = 0
+        previous_keys = []
+        # The primary key is selected last and identifies the entries.
+        key_columns = [primary_key] if primary_key else []
+        resume_key = primary_key if job.checkpoints else ''
+        if not primary_key:
+            job.disable_delta(table)
+        if job.streaming and not key_range:
+            # An unbuffered cursor has no rowcount, so progress is reported against the table statistics.
+            row_count = get_row_count(job, table, expression)
+        started = metrics.start()
+        if key_range or (job.streaming and (job.schema_only or job.is_done(table))):
+            # Rows that are not indexed are not streamed.
+            rows = []
+        elif resume_key:
+            # Rows are read in primary key order, which is selected last, so a resumed job can continue after the checkpoint.
+            position = job.get_checkpoint(table)
+            filters = [expression] if expression else []
+            params = []
+            if position:
+                first_row = position[1] + 1
+                if not job.streaming:
+                    previous_keys = [r[0] for r in job.db_cursor.execute("select {0} from {1} where {2} order by {0}".format(
+                        resume_key, table, ' and '.join('({0})'.format(f) for f in filters + ["{0} <= ?".format(resume_key)])), position[0]).fetchall()]
+                filters.append("{0} > ?".format(resume_key))
+                params.append(position[0])
+            where = " where {0}".format(' and '.join('({0})'.format(f) for f in filters)) if filters else ""
+            rows = job.db_cursor.execute("select {0}, {1} from {2}{3} order by {1}".format(','.join(columns), resume_key, table, where), *params)
+        elif not expression:
+            rows = job.db_cursor.execute("select {0} from {1}".format(','.join(columns + key_columns), table))
         else:
-            rows = job.db_cursor.execute("select {0} from {1} where {2}".format(','.join(columns), table, expression))
+            rows = job.db_cursor.execute("select {0} from {1} where {2}".format(','.join(columns + key_columns), table, expression))
+        metrics.stop('query', started)
+        if job.streaming and not isinstance(rows, list):
+            rows = stream_rows(rows)
 
         # --------------------------------------
         # Remove shape columns from field list.
@@ -183,12 +441,10 @@ def run_job(mysql_job):
         location_id = job.location_id
         discovery_id = job.discovery_id
         action_type = job.action_type
-        mapped_fields = job.map_fields(table, columns, column_types)
-        new_fields = job.new_fields
-        row_count = float(rows.rowcount)
-        increment = job.get_increment(row_count)
-        geometry_ops = worker_utils.GeometryOps()
-        generalize_value = job.generalize_value
+        mapper_args = (columns, column_types, geo, has_shape, is_point, geom_type, wkb)
+        row_mapper = RowMapper(job, table, *mapper_args)
+        if not key_range and not job.streaming:
+            row_count = float(rows.rowcount + first_row)
 
         # Add an entry for the table itself with schema.
         table_entry = {}
@@ -203,67 +459,43 @@ def run_job(mysql_job):
         if job.schema_only:
             job.send_entry(table_entry)
             continue
+        if job.is_done(table):
+            continue
 
         if not job.schema_only:
-            table_links = []
-            for i, row in enumerate(rows):
-                if has_shape:
-                    if is_point:
-                        if job.include_wkt:
-                            geo['wkt'] = row[0]
-                        geo['lon'] = row[2]
-                        geo['lat'] = row[1]
-                        mapped_cols = dict(zip(mapped_fields[0:], row[3:]))
-                        mapped_cols['geometry_type'] = 'Point'
-                        for nf in new_fields:
-                            if nf['name'] == '*' or nf['name'] == table:
-                                for k, v in nf['new_fields'].iteritems():
-                                    mapped_fields[k] = v
-                    else:
-                        if job.include_wkt:
-                            if generalize_value == 0:
-                                geo['wkt'] = row[0]
-                            else:
-                                geo['wkt'] = geometry_ops.generalize_geometry(str(row[0]), generalize_value)
-                        nums = re.findall("-?(?:\.\d+|\d+(?:\.\d*)?)", row[0].rpartition(',')[0])
-                        geo['xmin'] = float(nums[0])
-                        geo['ymin'] = float(nums[1])
-                        geo['xmax'] = float(nums[4])
-                        geo['ymax'] = float(nums[5])
-                        mapped_cols = dict(zip(mapped_fields[1:], row[1:]))
-                        for nf in new_fields:
-                            if nf['name'] == '*' or nf['name'] == table:
-                                for k, v in nf['new_fields'].iteritems():
-                                    mapped_fields[k] = v
-                        if 'POLYGON' in geom_type:
-                            mapped_cols['geometry_type'] = 'Polygon'
-                        else:
-                            mapped_cols['geometry_type'] = 'Polyline'
-                else:
-                    mapped_cols = dict(zip(mapped_fields, row))
-                    for nf in new_fields:
-                            if nf['name'] == '*' or nf['name'] == table:
-                                for k, v in nf['new_fields'].iteritems():
-                                    mapped_fields[k] = v
+            # The rows indexed before the checkpoint are linked by their primary key.
+            # When streaming, rows are counted but not linked, so memory does not grow with the table.
+            table_links = [{'relation': 'contains', 'id': '{0}_{1}_{2}'.format(location_id, table, k)} for k in previous_keys]
+            table_rows = first_row
+            if key_range:
+                table_rows, table_links = index_ranges(job, table, select_columns, expression, split_column, split, key_range, mapper_args, row_count)
+            for i, row in enumerate(metrics.timed('fetch', rows), first_row):
+                started = metrics.start()
+                geo, mapped_cols = row_mapper.map_row(row)
+                metrics.stop('map', started)
 
                 # Create an entry to send to ZMQ for indexing.
-                mapped_cols['format_type'] = 'Record'
-                mapped_cols['format'] = 'application/vnd.mysql.record'
-                entry['id'] = '{0}_{1}_{2}'.format(location_id, table, i)
+                entry['id'] = '{0}_{1}_{2}'.format(location_id, table, row[-1] if primary_key else i)
                 entry['location'] = location_id
                 entry['action'] = action_type
                 entry['entry'] = {'geo': geo, 'fields': mapped_cols}
                 entry['entry']['fields']['_discoveryID'] = discovery_id
                 job.send_entry(entry)
-                table_links.append({'relation': 'contains', 'id': entry['id']})
-                if (i % increment) == 0:
-                    status_writer.send_percent(i / row_count, '{0}: {1:%}'.format(table, i / row_count), 'MySql')
-            processed += i
+                if resume_key:
+                    job.checkpoint(table, [row[-1], i])
+                table_rows += 1
+                if not job.streaming:
+                    table_links.append({'relation': 'contains', 'id': entry['id']})
+                status_writer.progress(table, i, row_count, 'MySql', job.bytes_sent)
+            status_writer.send_percent(1, '{0}: {1:.1%}'.format(table, 1), 'MySql')
+            processed += table_rows
             table_entry['entry']['links'] = table_links
             job.send_entry(table_entry)
+            job.flush_entries()
+            job.checkpoint(table, None, done=True)
 
     mysql_properties = {}
-    mysql_entry['id'] = job.location_id + str(random.randint(0, 1000))
+    mysql_entry['id'] = '{0}_{1}'.format(job.location_id, job.sql_connection_info['connection']['database'])
     mysql_entry['location'] = job.location_id
     mysql_entry['action'] = job.action_type
     mysql_properties['_discoveryID'] = job.discovery_id
@@ -275,5 +507,6 @@ def run_job(mysql_job):
     mysql_entry['entry'] = {'fields': mysql_properties}
     mysql_entry['entry']['links'] = mysql_links
     job.send_entry(mysql_entry)
+    job.flush_entries()
 
     status_writer.send_status("Processed: {0}".format(processed))
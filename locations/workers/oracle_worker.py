@@ -13,15 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import decimal
-from itertools import izip
 import json
-import random
+import multiprocessing
+import base_job
 from utils import status
+from utils import metrics
 from utils import worker_utils
 import cx_Oracle
 
 
-status_writer = status.Writer()
+status_writer = status.ProgressWriter()
 
 field_types =  {cx_Oracle.STRING: 'STRING',
                 cx_Oracle.FIXED_CHAR: 'CHAR',
@@ -42,6 +43,222 @@ class ComplexEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+# Column types fetched inline by the output type handler when lob_size is set.
+LOB_TYPES = (cx_Oracle.CLOB, cx_Oracle.NCLOB, cx_Oracle.BLOB, 'CLOB', 'NCLOB', 'BLOB')
+
+# Bytes of LOB values fetched per round trip, for values up to lob_size.
+LOB_FETCH_SIZE = 16 * 1048576
+
+
+def global_job(job_file):
+    """Create a global job object for a process that extracts chunks of a table.
+    Each process has its own database connection and ZMQ socket.
+    """
+    global job
+    job = base_job.Job(job_file)
+    job.tables_to_keep()
+    job.connect_to_zmq()
+    job.connect_to_database()
+
+
+def get_arraysize(job, tbl, lob_columns=0):
+    """Returns an arraysize that fetches about a megabyte of rows per round trip,
+    based on the average row length in the table statistics. LOB values fetched inline
+    are not in the statistics, so with LOB columns the arraysize is capped to keep a
+    batch of LOB values of lob_size bytes within LOB_FETCH_SIZE. Larger values are still
+    fetched in full (see oracle_lob_handler), so this is an estimate, not a bound.
+    """
+    arraysize = get_row_arraysize(job, tbl)
+    if lob_columns and job.lob_size:
+        arraysize = max(1, min(arraysize, LOB_FETCH_SIZE // (lob_columns * job.lob_size)))
+    return arraysize
+
+
+def get_row_arraysize(job, tbl):
+    """Returns an arraysize that fetches about a megabyte of rows per round trip."""
+    if '.' in tbl:
+        owner, table = tbl.split('.')
+        qry = "select avg_row_len from all_tables where owner = '{0}' and table_name = '{1}'".format(owner, table)
+    else:
+        qry = "select avg_row_len from user_tables where table_name = '{0}'".format(tbl)
+    try:
+        avg_row_len = job.execute_query(qry).fetchone()
+    except cx_Oracle.DatabaseError:
+        avg_row_len = None
+    if not avg_row_len or not avg_row_len[0]:
+        return 250
+    return max(250, min(10000, 1048576 // int(avg_row_len[0])))
+
+
+def set_arraysize(cursor, arraysize):
+    """Set the number of rows fetched and prefetched per round trip."""
+    cursor.arraysize = arraysize
+    if hasattr(cursor, 'prefetchrows'):
+        cursor.prefetchrows = arraysize + 1
+
+
+def get_select(columns, source, where='', order_by=''):
+    """Returns the select statement for the rows to be indexed."""
+    select = "select {0} from {1}".format(','.join(columns), source)
+    if where:
+        select += " where {0}".format(where)
+    if order_by:
+        select += " order by {0}".format(order_by)
+    return select
+
+
+def get_resume_filter(job, checkpoint_name, resume_key, where=''):
+    """Returns the where clause and bind values that continue a table (or chunk) read in resume_key
+    order after the key of its checkpoint, and the number of the row to continue from.
+    """
+    position = job.get_checkpoint(checkpoint_name) if resume_key else None
+    if not position:
+        return where, [], 0
+    key_filter = "{0} > :1".format(resume_key)
+    if where:
+        key_filter = "({0}) and {1}".format(where, key_filter)
+    return key_filter, [position[0]], position[1] + 1
+
+
+def get_chunk_filter(chunks, chunk, where=''):
+    """Returns the where clause for one of the ROWID hash chunks of a table."""
+    chunk_filter = "ORA_HASH(ROWID, {0}) = {1}".format(chunks - 1, chunk)
+    if where:
+        chunk_filter = "({0}) and {1}".format(where, chunk_filter)
+    return chunk_filter
+
+
+def get_sdo_columns(geometry_field, generalize_value):
+    """Returns the columns that select an SDO_GEOMETRY as WKB, simplified by Oracle with a tolerance
+    derived from the generalize setting, followed by its envelope (xmin, ymin, xmax, ymax).
+    """
+    envelope = ['SDO_GEOM.SDO_{0}_MBR_ORDINATE({1}, {2})'.format(m, geometry_field, d) for m, d in (('MIN', 1), ('MIN', 2), ('MAX', 1), ('MAX', 2))]
+    if generalize_value == 0:
+        geometry = geometry_field
+    elif generalize_value > 0.9:
+        # Only the envelope is indexed.
+        geometry = 'SDO_GEOM.SDO_MBR({0})'.format(geometry_field)
+    else:
+        tolerance = 'GREATEST({0} * GREATEST({3} - {1}, {4} - {2}), 0.005)'.format(worker_utils.simplify_factor(generalize_value), *envelope)
+        geometry = 'SDO_UTIL.SIMPLIFY({0}, {1}, 0.005)'.format(geometry_field, tolerance)
+    return ['SDO_UTIL.TO_WKBGEOMETRY({0})'.format(geometry)] + envelope
+
+
+class RowMapper(object):
+    """Maps the rows of a table to the geometry and fields of an entry."""
+    def __init__(self, job, tbl, columns, column_types, geo, has_shape, is_point, geometry_field, wkb=False):
+        self.mapping_plan = job.mapping_plan(tbl, columns, column_types)
+        if has_shape:
+            geom_fields = [name for name in self.mapping_plan.fields if '{0}'.format(geometry_field) in name]
+            self.mapping_plan = job.mapping_plan(tbl, columns, column_types, drop=geom_fields)
+        self.tbl = tbl
+        self.geo = geo
+        self.has_shape = has_shape
+        self.is_point = is_point
+        self.wkb = wkb
+        self.discovery_id = job.discovery_id
+        self.geometry_ops = worker_utils.GeometryOps()
+        self.generalize_value = job.generalize_value
+
+    def map_row(self, row):
+        """Returns the geometry and the mapped fields of a row."""
+        geo = self.geo
+        generalize_value = self.generalize_value
+        if self.has_shape:
+            if self.is_point:
+                geo['lon'] = row[1]
+                geo['lat'] = row[2]
+            else:
+                if generalize_value > 0.9:
+                    geo['xmin'] = row[1]
+                    geo['ymin'] = row[2]
+                    geo['xmax'] = row[3]
+                    geo['ymax'] = row[4]
+                elif self.wkb:
+                    # Simplified by Oracle.
+                    geo['wkt'] = worker_utils.wkb_to_wkt(row[0])
+                elif generalize_value == 0 or generalize_value == 0.0:
+                    geo['wkt'] = row[0]
+                else:
+                    geo['wkt'] = self.geometry_ops.generalize_geometry(str(row[0]), generalize_value)
+
+        # Map column names to Voyager fields.
+        mapped_cols = self.mapping_plan.project(row)
+        mapped_cols['_discoveryID'] = self.discovery_id
+        mapped_cols['meta_table_name'] = self.tbl
+        mapped_cols['format_type'] = 'Record'
+        mapped_cols['format'] = 'application/vnd.oracle.record'
+        return geo, mapped_cols
+
+
+def index_chunk(args):
+    """Index the rows of a table where ORA_HASH(ROWID) falls in one of the chunks.
+    The ROWID is selected last and used for the entry id. With a resume key, the rows are read
+    in key order and the key is selected before the ROWID.
+    Returns the number of rows indexed and the metrics of the chunk.
+    """
+    tbl, columns, source, where, chunks, chunk, arraysize, mapper_args, resume_key = args
+    checkpoint_name = '{0}:{1}'.format(tbl, chunk)
+    if job.is_done(checkpoint_name):
+        return 0, None
+    metrics.reset()
+    metrics.set_table(tbl)
+    where, params, first_row = get_resume_filter(job, checkpoint_name, resume_key, get_chunk_filter(chunks, chunk, where))
+    row_mapper = RowMapper(job, tbl, *mapper_args)
+    location_id = job.location_id
+    action_type = job.action_type
+    has_shape = row_mapper.has_shape
+    key_col = len(columns)
+    set_arraysize(job.db_cursor, arraysize)
+    started = metrics.start()
+    resume_columns = [resume_key] if resume_key else []
+    rows = job.db_cursor.execute(get_select(columns + resume_columns + ['ROWIDTOCHAR(ROWID)'], source, where, resume_key), params)
+    metrics.stop('query', started)
+    entry = {}
+    count = 0
+    for i, row in enumerate(metrics.timed('fetch', rows), first_row):
+        count += 1
+        try:
+            started = metrics.start()
+            geo, mapped_cols = row_mapper.map_row(row)
+            metrics.stop('map', started)
+            entry['id'] = '{0}_{1}_{2}'.format(location_id, tbl, row[-1])
+            entry['location'] = location_id
+            entry['action'] = action_type
+            if has_shape:
+                entry['entry'] = {'geo': geo, 'fields': mapped_cols}
+            else:
+                entry['entry'] = {'fields': mapped_cols}
+            job.send_entry(entry)
+            if resume_key:
+                job.checkpoint(checkpoint_name, [row[key_col], i])
+        except Exception as ex:
+            status_writer.send_status(ex)
+            job.table_failed(tbl)
+            continue
+    job.flush_entries()
+    job.checkpoint(checkpoint_name, None, done=True)
+    return count, metrics.summary()
+
+
+def index_chunks(job, tbl, columns, source, where, chunks, arraysize, mapper_args, row_count, resume_key=''):
+    """Index a table in ROWID hash chunks, each extracted by its own process and connection."""
+    args = [(tbl, columns, source, where, chunks, chunk, arraysize, mapper_args, resume_key) for chunk in range(chunks)]
+    pool = multiprocessing.Pool(chunks, initializer=global_job, initargs=(job.job_file,))
+    processed = 0
+    try:
+        for count, chunk_metrics in pool.imap_unordered(index_chunk, args):
+            processed += count
+            metrics.merge(chunk_metrics)
+            status_writer.progress(tbl, processed, row_count, 'oracle_worker', job.bytes_sent)
+        # Synchronize the main process with the job processes to ensure proper cleanup.
+        pool.close()
+        pool.join()
+    except Exception:
+        pool.terminate()
+        raise
+
+
 def get_layers(job):
     """Return the list of layers to index (based on Owner)."""
     layers = []
@@ -170,17 +387,127 @@ def get_views(job):
     return views
 
 
+def get_fingerprint(job):
+    """Returns a fingerprint of the schema: the number of tables and views and their last DDL time."""
+    row = job.db_cursor.execute("select count(*), max(last_ddl_time) from all_objects "
+                                "where object_type in ('TABLE', 'VIEW')").fetchone()
+    return '{0}:{1}'.format(row[0], row[1])
+
+
+def get_owner_filter(column, owners):
+    """Returns a where clause for the connected user and the owners of the tables, layers and views to index."""
+    return "{0} in ({1})".format(column, ', '.join(['user'] + ["'{0}'".format(owner) for owner in owners]))
+
+
+def read_keys(job, owners):
+    """Returns the first primary key ('P') and foreign key ('R') column of each table of the owners, by
+    table name ("owner.table", and "table" for the tables of the connected user).
+    """
+    keys = {}
+    qry = "select c.owner, c.table_name, c.column_name, cons.constraint_type, case when c.owner = user then 1 else 0 end " \
+          "from all_constraints cons join all_cons_columns c on c.owner = cons.owner and c.constraint_name = cons.constraint_name " \
+          "where cons.constraint_type in ('P', 'R') and {0} order by c.position".format(get_owner_filter('c.owner', owners))
+    for owner, table, column, constraint_type, is_user in job.execute_query(qry).fetchall():
+        for name in ['{0}.{1}'.format(owner, table)] + ([table] if is_user else []):
+            keys.setdefault(name, {}).setdefault(constraint_type, column)
+    return keys
+
+
+def read_indexes(job, owners):
+    """Returns the indexed columns of each table of the owners, by table name (as read_keys)."""
+    indexes = {}
+    qry = "select table_owner, table_name, column_name, case when table_owner = user then 1 else 0 end " \
+          "from all_ind_columns where {0}".format(get_owner_filter('table_owner', owners))
+    for owner, table, column, is_user in job.execute_query(qry).fetchall():
+        for name in ['{0}.{1}'.format(owner, table)] + ([table] if is_user else []):
+            indexes.setdefault(name, []).append(column)
+    return indexes
+
+
+def read_row_estimates(job, owners):
+    """Returns the number of rows of each table of the owners from the optimizer statistics, by table name
+    (as read_keys). Tables without statistics are left out. The estimates are not kept in the catalog snapshot.
+    """
+    estimates = {}
+    if job.exact_row_counts:
+        return estimates
+    started = metrics.start()
+    qry = "select owner, table_name, num_rows, case when owner = user then 1 else 0 end " \
+          "from all_tables where num_rows is not null and {0}".format(get_owner_filter('owner', owners))
+    for owner, table, num_rows, is_user in job.execute_query(qry).fetchall():
+        for name in ['{0}.{1}'.format(owner, table)] + ([table] if is_user else []):
+            estimates[name] = num_rows
+    metrics.stop('catalog', started)
+    return estimates
+
+
+def read_table(job, tbl, keys, indexes):
+    """Returns the schema of a table and its columns as [name, type name, geometry type or None],
+    from the description of a query that returns no rows.
+    """
+    table_keys = keys.get(tbl, {})
+    primary_key_col = table_keys.get('P', '')
+    foreign_key_col = table_keys.get('R', '')
+    index_columns = indexes.get(tbl, [])
+    schema_columns = []
+    columns = []
+    cursor = job.execute_query("select * from {0} where 1 = 0".format(tbl))
+    for i, c in enumerate(cursor.description):
+        schema_col = {}
+        schema_props = []
+        schema_col['name'] = c[0]
+        try:
+            schema_col['type'] = field_types[c[1]]
+        except (AttributeError, KeyError):
+            schema_col['type'] = 'OBJECTVAR'
+        geometry = None
+        try:
+            if c[1] in ('SDO_GEOMETRY', 'ST_GEOMETRY'):
+                geometry = c[1]
+            elif cursor.fetchvars[i].type.name in ('ST_GEOMETRY', 'SDO_GEOMETRY'):
+                geometry = cursor.fetchvars[i].type.name
+        except AttributeError:
+            pass
+        if geometry:
+            schema_col['isGeo'] = True
+        if c[6] == 1:
+            schema_props.append('NULLABLE')
+        else:
+            schema_props.append('NOTNULLABLE')
+        if c[0] == primary_key_col:
+            schema_props.append('PRIMARY KEY')
+        if c[0] == foreign_key_col:
+            schema_props.append('FOREIGN KEY')
+        if c[0] in index_columns:
+            schema_props.append('INDEXED')
+        if schema_props:
+            schema_col['properties'] = schema_props
+        schema_columns.append(schema_col)
+        columns.append([c[0], getattr(c[1], '__name__', str(c[1])), geometry])
+    return {'schema': {'name': tbl, 'fields': schema_columns}, 'columns': columns}
+
+
 def run_job(oracle_job):
     """Worker function to do the indexing."""
     job = oracle_job
     job.connect_to_zmq()
     job.connect_to_database()
-    job.db_cursor.arraysize = 250
 
-    all_tables = []
-    all_tables += get_tables(job)
-    all_tables += get_layers(job)
-    all_tables += get_views(job)
+    # The queries, constraints, field mapping and splits of each table are read from the configuration,
+    # also when the table list is in the catalog snapshot.
+    job.tables_to_keep()
+    job.layers_to_keep()
+    job.views_to_keep()
+
+    # The tables, keys and indexes are read once while the schema is unchanged (catalog snapshot).
+    job.load_catalog(get_fingerprint(job) if job.catalog_cache else None)
+    all_tables = job.cached('tables', lambda: get_tables(job) + get_layers(job) + get_views(job))
+    all_tables = [tuple(t) if isinstance(t, list) else t for t in all_tables]
+    owners = sorted(set(t[1].upper() for t in all_tables if isinstance(t, tuple)))
+    keys = job.cached('keys', lambda: read_keys(job, owners))
+    indexes = job.cached('indexes', lambda: read_indexes(job, owners))
+    job.save_catalog()
+    row_estimates = read_row_estimates(job, owners)
 
     if not all_tables:
         status_writer.send_state(status.STAT_FAILED, "No tables, views or layers found. Check the configuration.")
@@ -190,128 +517,51 @@ def run_job(oracle_job):
 
     # Begin indexing.
     for tbl in set(all_tables):
+        metrics.set_table(tbl)
         geo = {}
         columns = []
         column_types = {}
         is_point = False
         has_shape = False
+        wkb = False
         geometry_field = None
+        geometry_type = None
         shape_type = None
 
         # ----------------------------------------------------------------------------
         # Check if the table is a layer/view and set name as "owner.table".
         # ----------------------------------------------------------------------------
         if isinstance(tbl, tuple):
-            column_query = "select column_name, data_type from all_tab_cols where " \
-                           "table_name = '{0}' and column_name like".format(tbl[0])
             query = job.get_table_query(tbl[0])
             tbl = "{0}.{1}".format(tbl[1], tbl[0])
         else:
             query = job.get_table_query(tbl)
-            column_query = "select column_name, data_type from all_tab_cols where " \
-                           "table_name = '{0}' and column_name like".format(tbl)
 
         # -----------------------------------------------------------------------------------------------------
-        # Get the table schema.
+        # Get the table schema and columns (from the catalog snapshot).
         # -----------------------------------------------------------------------------------------------------
-        table_schema = {}
-        schema_columns = []
-        table_schema['name'] = tbl
-
-        # Get primary key and foreign keys
-        primary_key_col = ''
-        foreign_key_col = ''
-        primary_key_qry = "select c.table_name, c.column_name from all_constraints cons, all_cons_columns c " \
-            "where c.table_name = '{0}' and cons.constraint_type like 'P%' " \
-            "and cons.constraint_name = c.constraint_name".format(tbl)
-        primary_cols = job.execute_query(primary_key_qry).fetchone()
-        if primary_cols:
-            primary_key_col = primary_cols[1]
-        foreign_key_qry = "select c.table_name, c.column_name from all_constraints cons, all_cons_columns c " \
-            "where c.table_name = '{0}' and cons.constraint_type like 'F%' " \
-            "and cons.constraint_name = c.constraint_name".format(tbl)
-        foreign_cols = job.execute_query(foreign_key_qry).fetchone()
-        if foreign_cols:
-            foreign_key_col = foreign_cols[1]
-
-        # Get columns that are indexed.
-        if "." in tbl:
-            owner, table = tbl.split('.')
-            index_query = "select column_name from all_ind_columns where table_name = '{0}' and index_owner = '{1}'".format(table, owner)
-        else:
-            index_query = "select column_name from all_ind_columns where table_name = '{0}'".format(tbl)
-        index_columns = [c[0] for c in job.execute_query(index_query).fetchall()]
-
-        for i, c in enumerate(job.execute_query("select * from {0}".format(tbl)).description):
-            schema_col = {}
-            schema_props = []
-            schema_col['name'] = c[0]
-            try:
-                schema_col['type'] = field_types[c[1]]
-            except (AttributeError, KeyError):
-                schema_col['type'] = 'OBJECTVAR'
-            try:
-                if c[1] in ('SDO_GEOMETRY', 'ST_GEOMETRY'):
-                    schema_col['isGeo'] = True
-                elif job.db_cursor.fetchvars[i].type.name == 'ST_GEOMETRY':
-                    schema_col['isGeo'] = True
-                elif job.db_cursor.fetchvars[i].type.name == 'SDO_GEOMETRY':
-                    schema_col['isGeo'] = True
-            except AttributeError:
-                pass
-            if c[6] == 1:
-                schema_props.append('NULLABLE')
-            else:
-                schema_props.append('NOTNULLABLE')
-            if c[0] == primary_key_col:
-                schema_props.append('PRIMARY KEY')
-            if c[0] == foreign_key_col:
-                schema_props.append('FOREIGN KEY')
-            if c[0] in index_columns:
-                schema_props.append('INDEXED')
-            if schema_props:
-                schema_col['properties'] = schema_props
-            schema_columns.append(schema_col)
-        table_schema['fields'] = schema_columns
+        table_info = job.cached('table:{0}'.format(tbl), lambda: read_table(job, tbl, keys, indexes))
+        table_schema = table_info['schema']
 
         # ---------------------------------------------------------------------------------------
         # Create the list of columns and column types to include in the index.
         # ---------------------------------------------------------------------------------------
-        if not job.fields_to_keep == ['*']:
-            for col in job.fields_to_keep:
-                for c in job.db_cursor.execute("{0} '{1}'".format(column_query, col)).fetchall():
-                    columns.append(c[0])
-                    column_types[c[0]] = c[1]
-                    if c[1] in ('SDO_GEOMETRY', 'ST_GEOMETRY'):
-                        has_shape = True
-                        geometry_field = c[0]
-                        geometry_type = c[1]
-        else:
-            for i, c in enumerate(job.db_cursor.execute("select * from {0}".format(tbl)).description):
-                columns.append(c[0])
-                column_types[c[0]] = c[1]
-                try:
-                    if c[1] in ('SDO_GEOMETRY', 'ST_GEOMETRY'):
-                        has_shape = True
-                        geometry_field = c[0]
-                        geometry_type = c[1]
-                    elif job.db_cursor.fetchvars[i].type.name == 'ST_GEOMETRY':
-                        has_shape = True
-                        geometry_field = c[0]
-                        geometry_type = 'ST_GEOMETRY'
-                    elif job.db_cursor.fetchvars[i].type.name == 'SDO_GEOMETRY':
-                        has_shape = True
-                        geometry_field = c[0]
-                        geometry_type = 'SDO_GEOMETRY'
-                except AttributeError:
-                    continue
+        for name, type_name, geometry in table_info['columns']:
+            if not any(worker_utils.like(name, col) for col in job.fields_to_keep):
+                continue
+            columns.append(name)
+            column_types[name] = type_name
+            if geometry:
+                has_shape = True
+                geometry_field = name
+                geometry_type = geometry
 
         # -----------------------------------
         # Remove fields meant to be excluded.
         # -----------------------------------
         if job.fields_to_skip:
             for col in job.fields_to_skip:
-                [columns.remove(c[0]) for c in job.execute_query("{0} '{1}'".format(column_query, col)).fetchall()]
+                columns = [c for c in columns if not worker_utils.like(c, col)]
 
         # -----------------------------------------------------------
         # If there is a shape column, get the geographic information.
@@ -338,6 +588,15 @@ def run_job(oracle_job):
                         job.db_cursor.execute("SDO_CS.TRANSFORM({0}.{1}, 4326)".format(schema, geometry_field))
                 else:
                     columns.insert(0, "sdo_geom.sdo_mbr({0}).sdo_ordinates".format(geometry_field))
+                    if job.geometry_pushdown:
+                        # Simplify the geometry in Oracle, unless the database does not support it.
+                        sdo_columns = get_sdo_columns(geometry_field, job.generalize_value)
+                        try:
+                            job.db_cursor.execute("select {0} from {1} where rownum = 1".format(','.join(sdo_columns), tbl)).fetchall()
+                            columns[0:1] = sdo_columns
+                            wkb = True
+                        except cx_Oracle.DatabaseError as ex:
+                            status_writer.send_status('{0}: geometries are generalized by the worker ({1}).'.format(tbl, ex))
             else:  # ST_GEOMETRY
                 shape_type = job.db_cursor.execute("select {0}.ST_GEOMETRYTYPE({1}) from {2}".format(schema, geometry_field, tbl)).fetchone()[0]
                 geo['code'] = int(job.db_cursor.execute("select {0}.ST_SRID({1}) from {2}".format(schema, geometry_field, tbl)).fetchone()[0])
@@ -369,51 +628,85 @@ def run_job(oracle_job):
         # if not include_wkt and not geometry_type == 'SDO_GEOMETRY':
         #     columns.pop(0)
 
-        # ------------------------------------------------------------
-        # Get the count of all the rows to use for reporting progress.
-        # ------------------------------------------------------------
-        if query:
-            row_count = job.db_cursor.execute("select count(*) from {0} where {1}".format(tbl, query)).fetchall()[0][0]
-        else:
-            row_count = job.db_cursor.execute("select count(*) from {0}".format(tbl)).fetchall()[0][0]
-        if row_count == 0 or row_count is None:
-            continue
-        else:
-            row_count = float(row_count)
+        # ---------------------------------------------------------------------------------------------
+        # Get the number of rows to use for reporting progress. The statistics are used unless the rows
+        # are filtered or the table has none, and an empty estimate does not skip the table.
+        # ---------------------------------------------------------------------------------------------
+        row_count = None if query else row_estimates.get(tbl, row_estimates.get(tbl.upper()))
+        if row_count is None:
+            if query:
+                row_count = job.db_cursor.execute("select count(*) from {0} where {1}".format(tbl, query)).fetchall()[0][0]
+            else:
+                row_count = job.db_cursor.execute("select count(*) from {0}".format(tbl)).fetchall()[0][0]
+            if row_count == 0 or row_count is None:
+                continue
+        row_count = float(row_count)
 
         # ---------------------------
         # Get the rows to be indexed.
         # ---------------------------
+        if geometry_type == 'SDO_GEOMETRY':
+            source = "{0} {1}".format(tbl, schema)
+            where = ''
+        else:
+            source = tbl
+            where = query
+        lob_columns = len([c for c in columns if column_types.get(c) in LOB_TYPES])
+        arraysize = get_arraysize(job, tbl, lob_columns)
+        set_arraysize(job.db_cursor, arraysize)
+
+        # The ROWID is selected last and identifies the entries, unless the table (or view) has none.
         try:
-            if geometry_type == 'SDO_GEOMETRY':
-                rows = job.db_cursor.execute("select {0} from {1} {2}".format(','.join(columns), tbl, schema))
-            else:
+            job.db_cursor.execute("select ROWID from {0} where rownum = 1".format(tbl)).fetchall()
+            key_columns = ['ROWIDTOCHAR(ROWID)']
+        except cx_Oracle.DatabaseError:
+            key_columns = []
+            job.disable_delta(tbl)
+        has_rowid = bool(key_columns)
+
+        # ----------------------------------------------------------------------
+        # Extract large tables in ROWID hash chunks if the table is split.
+        # ----------------------------------------------------------------------
+        chunks = job.get_table_split(tbl)[0]
+        if chunks > 1 and not job.schema_only and not has_rowid:
+            status_writer.send_status("{0} has no ROWID, the table is not split.".format(tbl))
+            chunks = 1
+
+        # With checkpoints, the rows are read in primary key order, with the key selected before the ROWID,
+        # so a resumed table continues after the key of its checkpoint. Without a primary key, it starts over.
+        resume_key = keys.get(tbl, {}).get('P', '') if job.checkpoints and not job.schema_only else ''
+        serial_key = resume_key if chunks <= 1 else ''
+        if serial_key:
+            key_columns.insert(0, serial_key)
+        started = metrics.start()
+        try:
+            if not geometry_type == 'SDO_GEOMETRY':
                 # Quick check to ensure ST_GEOMETRY operations are supported.
                 row = job.db_cursor.execute("select {0} from {1}".format(','.join(columns), tbl)).fetchone()
                 del row
-                if query:
-                    rows = job.db_cursor.execute("select {0} from {1} where {2}".format(','.join(columns), tbl, query))
-                else:
-                    rows = job.db_cursor.execute("select {0} from {1}".format(','.join(columns), tbl))
+            resume_where, params, first_row = get_resume_filter(job, tbl, serial_key, where)
+            rows = job.db_cursor.execute(get_select(columns + key_columns, source, resume_where, serial_key), params)
         except Exception:
             # This can occur for ST_GEOMETRY when spatial operators are un-available (See: http://tinyurl.com/lvvhwyl)
             columns.pop(0)
             geo['wkt'] = None
-            if query:
-                rows = job.db_cursor.execute("select {0} from {1} where {2}".format(','.join(columns), tbl, query))
-            else:
-                rows = job.db_cursor.execute("select {0} from {1}".format(','.join(columns), tbl))
+            source = tbl
+            where = query
+            resume_where, params, first_row = get_resume_filter(job, tbl, serial_key, where)
+            rows = job.db_cursor.execute(get_select(columns + key_columns, source, resume_where, serial_key), params)
+        metrics.stop('query', started)
 
         # Continue if the table has zero records.
         if not rows:
             status_writer.send_status("Skipping {0} - no records.".format(tbl))
             continue
+        dsn = rows.connection.dsn
 
         # ---------------------------------------------------------
         # Index each row.
         # ---------------------------------------------------------
-        mapped_fields = job.map_fields(tbl, columns, column_types)
-        increment = job.get_increment(row_count)
+        mapper_args = (columns, column_types, geo, has_shape, is_point, geometry_field, wkb)
+        row_mapper = RowMapper(job, tbl, *mapper_args)
         location_id = job.location_id
         action_type = job.action_type
         discovery_id = job.discovery_id
@@ -426,7 +719,7 @@ def run_job(oracle_job):
         table_entry['action'] = action_type
         table_entry['relation'] = 'contains'
         table_entry['entry'] = {'fields': {'format': 'schema', 'format_type': 'Schema', 'fi_rows': int(row_count),
-                                           '_discoveryID': discovery_id, 'name': tbl, 'path': rows.connection.dsn}}
+                                           '_discoveryID': discovery_id, 'name': tbl, 'path': dsn}}
         table_entry['entry']['fields']['schema'] = table_schema
         db_links.append(table_entry)
         if job.schema_only:
@@ -434,92 +727,43 @@ def run_job(oracle_job):
             continue
         else:
             job.send_entry(table_entry)
+        if job.is_done(tbl):
+            continue
 
-        if not has_shape:
-            for i, row in enumerate(rows):
-                try:
-                    # Map column names to Voyager fields.
-                    mapped_cols = dict(izip(mapped_fields, row))
-                    if has_shape:
-                        [mapped_cols.pop(name) for name in geom_fields]
-                    mapped_cols['_discoveryID'] = discovery_id
-                    mapped_cols['meta_table_name'] = tbl
-                    mapped_cols['format_type'] = 'Record'
-                    mapped_cols['format'] = 'application/vnd.oracle.record'
-                    entry['id'] = '{0}_{1}_{2}'.format(location_id, tbl, i)
-                    entry['location'] = location_id
-                    entry['action'] = action_type
-                    entry['entry'] = {'fields': mapped_cols}
-                    job.send_entry(entry)
-                    if (i % increment) == 0:
-                        status_writer.send_percent(i / row_count, "{0}: {1:%}".format(tbl, i / row_count), 'oracle_worker')
-                except Exception as ex:
-                    status_writer.send_status(ex)
-                    continue
-        else:
-            geom_fields = [name for name in mapped_fields if '{0}'.format(geometry_field) in name]
-            geometry_ops = worker_utils.GeometryOps()
-            generalize_value = job.generalize_value
-            for i, row in enumerate(rows):
-                try:
-                    # if include_wkt:
-                    if is_point:
-                        geo['lon'] = row[1]
-                        geo['lat'] = row[2]
-                    else:
-                        if generalize_value == 0 or generalize_value == 0.0:
-                            geo['wkt'] = row[0]
-                        elif generalize_value > 0.9:
-                            geo['xmin'] = row[1]
-                            geo['ymin'] = row[2]
-                            geo['xmax'] = row[3]
-                            geo['ymax'] = row[4]
-                        else:
-                            geo['wkt'] = geometry_ops.generalize_geometry(str(row[0]), generalize_value)
-
-                # else:
-                #     if is_point:
-                #         geo['lon'] = row[0]
-                #         geo['lat'] = row[1]
-                #     else:
-                #         if geometry_type == 'SDO_GEOMETRY':
-                #             if dimension == 3:
-                #                 geo['xmin'] = row[0][0]
-                #                 geo['ymin'] = row[0][1]
-                #                 geo['xmax'] = row[0][3]
-                #                 geo['ymax'] = row[0][4]
-                #             elif dimension == 2:
-                #                 geo['xmin'] = row[0][0]
-                #                 geo['ymin'] = row[0][1]
-                #                 geo['xmax'] = row[0][2]
-                #                 geo['ymax'] = row[0][3]
-                #         else:
-                #             geo['xmin'] = row[0]
-                #             geo['ymin'] = row[1]
-                #             geo['xmax'] = row[2]
-                #             geo['ymax'] = row[3]
-
-                    # Map column names to Voyager fields.
-                    mapped_cols = dict(izip(mapped_fields, row))
-                    [mapped_cols.pop(name) for name in geom_fields]
-                    mapped_cols['_discoveryID'] = discovery_id
-                    mapped_cols['meta_table_name'] = tbl
-                    mapped_cols['format_type'] = 'Record'
-                    mapped_cols['format'] = 'application/vnd.oracle.record'
-                    entry['id'] = '{0}_{1}_{2}'.format(location_id, tbl, i)
-                    entry['location'] = location_id
-                    entry['action'] = action_type
+        if chunks > 1:
+            index_chunks(job, tbl, columns, source, where, chunks, arraysize, mapper_args, row_count, resume_key)
+            rows = []
+
+        key_col = len(columns)
+        for i, row in enumerate(metrics.timed('fetch', rows), first_row):
+            try:
+                started = metrics.start()
+                geo, mapped_cols = row_mapper.map_row(row)
+                metrics.stop('map', started)
+                entry['id'] = '{0}_{1}_{2}'.format(location_id, tbl, row[-1] if has_rowid else i)
+                entry['location'] = location_id
+                entry['action'] = action_type
+                if has_shape:
                     entry['entry'] = {'geo': geo, 'fields': mapped_cols}
-                    job.send_entry(entry)
-                    if (i % increment) == 0:
-                        status_writer.send_percent(i / row_count, "{0}: {1:%}".format(tbl, i / row_count), 'oracle_worker')
-                except Exception as ex:
-                    status_writer.send_status(ex)
-                    continue
+                else:
+                    entry['entry'] = {'fields': mapped_cols}
+                job.send_entry(entry)
+                if serial_key:
+                    job.checkpoint(tbl, [row[key_col], i])
+                status_writer.progress(tbl, i, row_count, 'oracle_worker', job.bytes_sent)
+            except Exception as ex:
+                status_writer.send_status(ex)
+                job.table_failed(tbl)
+                continue
+        job.flush_entries()
+        job.checkpoint(tbl, None, done=True)
+        status_writer.send_percent(1, '{0}: {1:.1%}'.format(tbl, 1), 'oracle_worker')
 
+    # Keep the table schemas read while indexing in the snapshot.
+    job.save_catalog()
     oracle_entry = {}
     oracle_properties = {}
-    oracle_entry['id'] = job.location_id + str(random.randint(0, 1000))
+    oracle_entry['id'] = '{0}_{1}'.format(job.location_id, job.sql_connection_info['connection']['database'])
     oracle_entry['location'] = job.location_id
     oracle_entry['action'] = job.action_type
     oracle_properties['_discoveryID'] = job.discovery_id
@@ -528,3 +772,4 @@ def run_job(oracle_job):
     oracle_entry['entry'] = {'fields': oracle_properties}
     oracle_entry['entry']['links'] = db_links
     job.send_entry(oracle_entry)
+    job.flush_entries()
@@ -0,0 +1,309 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+import collections
+from psycopg2.extensions import quote_ident
+from utils import status
+from utils import metrics
+from utils import worker_utils
+
+
+status_writer = status.ProgressWriter()
+
+# Rows fetched per round trip by the server-side cursors.
+ITERSIZE = 2000
+
+# The tables and their columns, primary key and indexed columns, geometry types and
+# estimated row counts, in one query of the system catalog.
+CATALOG_QUERY = """
+SELECT n.nspname, c.relname, a.attname, format_type(a.atttypid, NULL), format_type(a.atttypid, a.atttypmod),
+       a.attnotnull, coalesce(a.attnum = ANY(p.indkey), false),
+       EXISTS (SELECT 1 FROM pg_index x WHERE x.indrelid = c.oid AND a.attnum = ANY(x.indkey)),
+       c.reltuples::bigint,
+       (%(all_fields)s OR a.attname LIKE ANY(%(keep_fields)s::text[])) AND NOT a.attname LIKE ANY(%(skip_fields)s::text[])
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+LEFT JOIN pg_index p ON p.indrelid = c.oid AND p.indisprimary
+WHERE c.relkind IN ('r', 'p')
+  AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname NOT LIKE 'pg_toast%%'
+  AND c.relname <> 'spatial_ref_sys'
+  AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+  AND (%(all_tables)s OR c.relname LIKE ANY(%(keep)s::text[]) OR n.nspname || '.' || c.relname LIKE ANY(%(keep)s::text[]))
+  AND NOT (c.relname LIKE ANY(%(skip)s::text[]) OR n.nspname || '.' || c.relname LIKE ANY(%(skip)s::text[]))
+ORDER BY n.nspname, c.relname, a.attnum
+"""
+
+Column = collections.namedtuple('Column', 'name type full_type not_null primary_key indexed selected')
+
+
+def get_patterns(names):
+    """Returns LIKE patterns for table or field names that may include * wild cards or an owner (schema)."""
+    patterns = []
+    for name in names or []:
+        if isinstance(name, (list, tuple)):
+            name = '{1}.{0}'.format(*name)
+        patterns.append(name.replace('*', '%'))
+    return patterns
+
+
+def get_tables(job):
+    """Returns an ordered dictionary of (schema, table) and the columns and estimated row count of each table to index."""
+    tables_to_keep = get_patterns(job.tables_to_keep())
+    fields_to_keep = get_patterns(job.fields_to_keep)
+    params = {'all_tables': not tables_to_keep or '%' in tables_to_keep, 'keep': tables_to_keep,
+              'skip': get_patterns(job.tables_to_skip()),
+              'all_fields': '%' in fields_to_keep, 'keep_fields': fields_to_keep,
+              'skip_fields': get_patterns(job.fields_to_skip)}
+    tables = collections.OrderedDict()
+    job.db_cursor.execute(CATALOG_QUERY, params)
+    for row in job.db_cursor.fetchall():
+        table = tables.setdefault((row[0], row[1]), {'columns': [], 'row_count': max(row[8], 0)})
+        table['columns'].append(Column(*row[2:8] + (row[9],)))
+    return tables
+
+
+def get_geometry_type(column):
+    """Returns the geometry type declared for a geometry or geography column (e.g. POINT), or an empty string."""
+    match = re.match(r'\w+\((\w+)', column.full_type)
+    return match.group(1).upper() if match else ''
+
+
+def get_srid(job, source, column):
+    """Returns the SRID declared for a geometry column, or the SRID of its first geometry."""
+    match = re.match(r'\w+\(\w+,\s*(\d+)\)', column.full_type)
+    if match:
+        return int(match.group(1))
+    if column.type == 'geography':
+        return 4326
+    job.db_cursor.execute('SELECT ST_SRID({0}) FROM {1} WHERE {0} IS NOT NULL LIMIT 1'.format(
+        quote_ident(column.name, job.db_cursor), source))
+    row = job.db_cursor.fetchone()
+    return row[0] if row else None
+
+
+def get_geometry_select(job, column):
+    """Returns the expressions that select the envelope, the geometry type and (if wkt is included) the
+    simplified geometry as WKB, so PostGIS computes them instead of the worker.
+    """
+    geometry = quote_ident(column.name, job.db_cursor)
+    if column.type == 'geography':
+        geometry = '{0}::geometry'.format(geometry)
+    expressions = ['ST_XMin({0})'.format(geometry), 'ST_YMin({0})'.format(geometry),
+                   'ST_XMax({0})'.format(geometry), 'ST_YMax({0})'.format(geometry),
+                   'GeometryType({0})'.format(geometry)]
+    generalize_value = job.generalize_value
+    # The most generalized geometry is the envelope.
+    if job.include_wkt and generalize_value <= 0.9:
+        if generalize_value == 0:
+            expressions.append('ST_AsBinary({0})'.format(geometry))
+        else:
+            # The tolerance is a fraction of the size of each geometry.
+            tolerance = '{0} * greatest(ST_XMax({1}) - ST_XMin({1}), ST_YMax({1}) - ST_YMin({1}))'.format(
+                worker_utils.simplify_factor(generalize_value), geometry)
+            expressions.append('ST_AsBinary(ST_SimplifyPreserveTopology({0}, {1}))'.format(geometry, tolerance))
+    return expressions
+
+
+class RowMapper(object):
+    """Maps the rows of a table to the geometry and fields of an entry.
+    Rows start with the geometry expressions (if the table has a geometry column) followed by the fields.
+    """
+    def __init__(self, job, table, columns, column_types, srid, geometry_columns):
+        self.mapping_plan = job.mapping_plan(table, columns, column_types, offset=geometry_columns)
+        self.srid = srid
+        self.has_shape = geometry_columns > 0
+        self.include_wkt = geometry_columns > 5
+
+    def map_row(self, row):
+        """Returns the geometry and the mapped fields of a row."""
+        geo = {}
+        mapped_cols = self.mapping_plan.project(row)
+        mapped_cols.update(self.mapping_plan.new_fields)
+        if self.has_shape and row[0] is not None:
+            geo['code'] = self.srid
+            xmin, ymin, xmax, ymax, geometry_type = row[:5]
+            if geometry_type == 'POINT':
+                geo['lon'] = xmin
+                geo['lat'] = ymin
+                mapped_cols['geometry_type'] = 'Point'
+            else:
+                geo['xmin'] = xmin
+                geo['ymin'] = ymin
+                geo['xmax'] = xmax
+                geo['ymax'] = ymax
+                if 'POLYGON' in geometry_type:
+                    mapped_cols['geometry_type'] = 'Polygon'
+                elif 'LINE' in geometry_type:
+                    mapped_cols['geometry_type'] = 'Polyline'
+                else:
+                    mapped_cols['geometry_type'] = geometry_type.title()
+            if self.include_wkt and row[5] is not None:
+                geo['wkt'] = worker_utils.wkb_to_wkt(row[5])
+        mapped_cols['format_type'] = 'Record'
+        mapped_cols['format'] = 'application/vnd.postgresql.record'
+        return geo, mapped_cols
+
+
+def get_schema(name, columns):
+    """Returns the schema of a table for its table entry."""
+    schema_columns = []
+    for column in columns:
+        props = []
+        if column.primary_key:
+            props.append('PRIMARY KEY')
+        if column.indexed:
+            props.append('INDEXED')
+        props.append('NOTNULLABLE' if column.not_null else 'NULLABLE')
+        schema_columns.append({'name': column.name, 'type': column.full_type, 'properties': props})
+    return {'name': name, 'fields': schema_columns}
+
+
+def index_table(job, schema_name, table_name, info):
+    """Index the rows of a table, streamed from a server-side cursor. Returns the table entry."""
+    name = table_name if schema_name == 'public' else '{0}.{1}'.format(schema_name, table_name)
+    metrics.set_table(name)
+    cursor = job.db_cursor
+    source = '{0}.{1}'.format(quote_ident(schema_name, cursor), quote_ident(table_name, cursor))
+    columns = info['columns']
+    row_count = info['row_count']
+    location_id = job.location_id
+    action_type = job.action_type
+    discovery_id = job.discovery_id
+
+    table_entry = {}
+    table_entry['id'] = '{0}_{1}'.format(location_id, name)
+    table_entry['location'] = location_id
+    table_entry['action'] = action_type
+    table_entry['relation'] = 'contains'
+    table_entry['entry'] = {'fields': {'format': 'schema', 'format_type': 'Schema', '_discoveryID': discovery_id,
+                                       'name': name, 'fi_rows': int(row_count)}}
+    table_entry['entry']['fields']['schema'] = get_schema(name, columns)
+    job.send_entry(table_entry)
+    if job.schema_only or job.is_done(name):
+        return table_entry
+
+    # The first geometry column is indexed as the geometry of each entry.
+    geometry_column = None
+    for column in columns:
+        if column.type in ('geometry', 'geography'):
+            geometry_column = column
+            break
+    select = []
+    srid = None
+    if geometry_column:
+        select = get_geometry_select(job, geometry_column)
+        srid = get_srid(job, source, geometry_column)
+    fields = [c for c in columns if c.selected and c.type not in ('geometry', 'geography')]
+    select += [quote_ident(c.name, cursor) for c in fields]
+    row_mapper = RowMapper(job, name, [c.name for c in fields], dict((c.name, c.type) for c in fields),
+                           srid, len(select) - len(fields))
+
+    # The primary key columns are selected last and used for the entry ids, and rows are read in key order
+    # when checkpoints are saved so a resumed job can continue after the checkpoint. Without a primary key,
+    # the entries are identified by row number and delta indexing is off for the table (a ctid changes
+    # when a row is updated or the table is rewritten, so it does not identify a row between runs either).
+    key_columns = [quote_ident(c.name, cursor) for c in columns if c.primary_key]
+    key = ', '.join(key_columns)
+    select += key_columns
+    if not key:
+        job.disable_delta(name)
+    filters = [f for f in (job.get_table_query(table_name), job.get_table_constraint(table_name)) if f]
+    params = []
+    first_row = 0
+    if key and job.checkpoints:
+        position = job.get_checkpoint(name)
+        if position:
+            first_row = position[1] + 1
+            filters.append('({0}) > ({1})'.format(key, ', '.join(['%s'] * len(key_columns))))
+            params.extend(position[0])
+    query = 'SELECT {0} FROM {1}'.format(', '.join(select), source)
+    if filters:
+        query += ' WHERE {0}'.format(' AND '.join('({0})'.format(f) for f in filters))
+    if key and job.checkpoints:
+        query += ' ORDER BY {0}'.format(key)
+
+    # Rows are streamed from a server-side cursor, ITERSIZE rows per round trip.
+    rows = job.db_connection.cursor('voyager_rows')
+    rows.itersize = ITERSIZE
+    started = metrics.start()
+    rows.execute(query, params)
+    metrics.stop('query', started)
+    entry = {}
+    key_start = len(select) - len(key_columns)
+    for i, row in enumerate(metrics.timed('fetch', rows), first_row):
+        started = metrics.start()
+        geo, mapped_cols = row_mapper.map_row(row)
+        metrics.stop('map', started)
+        mapped_cols['_discoveryID'] = discovery_id
+        key_values = row[key_start:]
+        if len(key_values) == 1:
+            row_id = key_values[0]
+        else:
+            row_id = '_'.join(str(v) for v in key_values) if key_values else i
+        entry['id'] = '{0}_{1}_{2}'.format(location_id, name, row_id)
+        entry['location'] = location_id
+        entry['action'] = action_type
+        if geo:
+            entry['entry'] = {'geo': geo, 'fields': mapped_cols}
+        else:
+            entry['entry'] = {'fields': mapped_cols}
+        job.send_entry(entry)
+        if key and job.checkpoints:
+            job.checkpoint(name, [list(key_values), i])
+        status_writer.progress(name, i + 1, row_count, 'PostgreSQL', job.bytes_sent)
+    rows.close()
+    # End the read transaction of the table.
+    job.db_connection.rollback()
+    job.flush_entries()
+    job.checkpoint(name, None, done=True)
+    status_writer.flush()
+    return table_entry
+
+
+def run_job(postgresql_job):
+    """Worker function to index each row in each table in the PostgreSQL database."""
+    job = postgresql_job
+    job.connect_to_zmq()
+    job.connect_to_database()
+    tables = get_tables(job)
+    connection_info = job.sql_connection_info['connection']
+    database_links = []
+
+    for (schema_name, table_name), info in tables.items():
+        try:
+            table_entry = index_table(job, schema_name, table_name, info)
+            database_links.append({'relation': 'contains', 'id': table_entry['id']})
+        except Exception as ex:
+            status_writer.send_state(status.STAT_WARNING, '{0}.{1}: {2}'.format(schema_name, table_name, ex))
+            job.table_failed('{0}.{1}'.format(schema_name, table_name))
+            job.db_connection.rollback()
+            continue
+
+    database_entry = {}
+    database_properties = {}
+    database_entry['id'] = '{0}_{1}'.format(job.location_id, connection_info['database'])
+    database_entry['location'] = job.location_id
+    database_entry['action'] = job.action_type
+    database_properties['_discoveryID'] = job.discovery_id
+    database_properties['name'] = connection_info['database']
+    database_properties['fs_driver'] = connection_info['driver']
+    database_properties['fs_server'] = connection_info['server']
+    database_properties['fs_database'] = connection_info['database']
+    database_properties['format'] = 'PostgreSQL Database'
+    database_entry['entry'] = {'fields': database_properties}
+    database_entry['entry']['links'] = database_links
+    job.send_entry(database_entry)
+    job.flush_entries()
+    status_writer.send_status("Processed: {0} tables".format(len(database_links)))
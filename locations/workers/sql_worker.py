@@ -11,16 +11,29 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import random
 import re
 import decimal
+import collections
 import json
-import random
+import multiprocessing
+import base_job
 from utils import status
+from utils import metrics
 from utils import worker_utils
 
 
-status_writer = status.Writer()
+status_writer = status.ProgressWriter()
+
+
+def global_job(job_file):
+    """Create a global job object for a process that scans key ranges of a table.
+    Each process has its own database connection and ZMQ socket.
+    """
+    global job
+    job = base_job.Job(job_file)
+    job.tables_to_keep()
+    job.connect_to_zmq()
+    job.connect_to_database()
 
 
 class ComplexEncoder(json.JSONEncoder):
@@ -32,38 +45,284 @@ class ComplexEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def get_fingerprint(job):
+    """Returns a fingerprint of the schema: the number of tables and views and when one last changed
+    (ALTER TABLE and index changes update modify_date).
+    """
+    row = job.db_cursor.execute("select count(*), max(modify_date) from sys.objects where type in ('U', 'V')").fetchone()
+    return '{0}:{1}'.format(row[0], row[1])
+
+
+def read_catalog(job):
+    """Returns the tables and views of the database with their columns, primary and foreign key and
+    indexed columns, read with one query of each catalog view.
+    """
+    tables = collections.OrderedDict()
+    for name, object_type in job.db_cursor.execute("select name, type from sys.objects where type in ('U', 'V') order by object_id").fetchall():
+        tables[name] = {'type': object_type.strip(), 'columns': [], 'primary_key': '', 'foreign_key': '', 'indexed': []}
+
+    # Name, type (as the ODBC driver reports it) and nullable.
+    qry = "select object_name(c.object_id), c.name, type_name(c.user_type_id) + " \
+          "case when c.is_identity = 1 then ' identity' else '' end, c.is_nullable " \
+          "from sys.columns c join sys.objects o on o.object_id = c.object_id " \
+          "where o.type in ('U', 'V') order by c.object_id, c.column_id"
+    for table, column, type_name, nullable in job.db_cursor.execute(qry).fetchall():
+        if table in tables:
+            tables[table]['columns'].append([column, type_name, bool(nullable)])
+
+    qry = "SELECT K.TABLE_NAME, K.COLUMN_NAME, C.CONSTRAINT_TYPE FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS AS C JOIN " \
+          "INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS K ON " \
+          "C.TABLE_NAME = K.TABLE_NAME AND C.CONSTRAINT_NAME = K.CONSTRAINT_NAME WHERE " \
+          "C.CONSTRAINT_TYPE IN ('PRIMARY KEY', 'FOREIGN KEY') ORDER BY K.TABLE_NAME, K.ORDINAL_POSITION"
+    for table, column, constraint_type in job.db_cursor.execute(qry).fetchall():
+        key = 'primary_key' if constraint_type == 'PRIMARY KEY' else 'foreign_key'
+        if table in tables and not tables[table][key]:
+            tables[table][key] = column
+
+    qry = "SELECT OBJECT_NAME(ic.object_id), COL_NAME(ic.object_id,ic.column_id) " \
+          "FROM sys.indexes AS i INNER JOIN sys.index_columns AS ic ON i.object_id = ic.object_id " \
+          "AND i.index_id = ic.index_id"
+    for table, column in job.db_cursor.execute(qry).fetchall():
+        if table in tables:
+            tables[table]['indexed'].append(column)
+    return tables
+
+
+def get_catalog(job):
+    """Returns the tables of the catalog snapshot, reading the catalog if it is not in the snapshot."""
+    if not job.catalog:
+        job.load_catalog(get_fingerprint(job) if job.catalog_cache else None)
+    return job.cached('tables', lambda: read_catalog(job))
+
+
+def get_srid(job, tbl, column_name):
+    """Returns the SRID of the first geometry of a column (kept in the catalog snapshot)."""
+    def read():
+        row = job.db_cursor.execute("select top 1 {0}.STSrid from {1}".format(column_name, tbl)).fetchone()
+        return row[0] if row else None
+    return job.cached('srid:{0}.{1}'.format(tbl, column_name), read)
+
+
+def get_row_estimates(job):
+    """Returns the number of rows of each table from the partition statistics (not kept in the catalog snapshot).
+    The statistics are maintained by SQL Server and may be slightly out of date.
+    """
+    if job.exact_row_counts:
+        return {}
+    started = metrics.start()
+    qry = "select object_name(object_id), sum({0}) from {1} where index_id in (0, 1) group by object_id"
+    try:
+        estimates = dict(job.db_cursor.execute(qry.format('row_count', 'sys.dm_db_partition_stats')).fetchall())
+    except Exception:
+        # sys.dm_db_partition_stats requires VIEW DATABASE STATE.
+        estimates = dict(job.db_cursor.execute(qry.format('rows', 'sys.partitions')).fetchall())
+    metrics.stop('catalog', started)
+    return estimates
+
+
+def get_row_count(job, tbl, estimates):
+    """Returns the estimated number of rows of a table, or counts them if there is no estimate (such as for a view)."""
+    try:
+        return float(estimates[tbl])
+    except (KeyError, TypeError):
+        return float(job.db_cursor.execute("select Count(*) from {0}".format(tbl)).fetchone()[0])
+
+
 def get_tables(job):
     """Return the list of tables to index (based on the user connected to the database)."""
     tables = []
     tables_to_skip = job.tables_to_skip()
     tables_to_keep = job.tables_to_keep()
+    catalog = get_catalog(job)
 
     if not tables_to_keep == ['*']:
         for tk in tables_to_keep:
-            statement = "select * from sys.objects where name like"
-            [tables.append(t[0]) for t in job.db_cursor.execute("{0} '{1}'".format(statement, tk)).fetchall()]
+            tables += [t for t in catalog if worker_utils.like(t, tk)]
     else:
-        [tables.append(t[0]) for t in job.db_cursor.execute("select name from sys.objects where type='U'").fetchall()]
+        tables = [t for t, info in catalog.items() if info['type'] == 'U']
 
     if tables_to_skip:
         for ts in tables_to_skip:
-            statement = "select * from sys.objects where name like"
-            [tables.remove(t[0]) for t in job.db_cursor.execute("{0} '{1}'".format(statement, ts)).fetchall()]
+            [tables.remove(t) for t in catalog if worker_utils.like(t, ts) and t in tables]
 
     return tables
 
 
+def get_wkb_column(tbl, shape_field_name, generalize_value):
+    """Returns the column that selects the geometry as WKB, simplified by SQL Server with a tolerance
+    derived from the generalize setting.
+    """
+    geometry = '{0}.{1}'.format(tbl, shape_field_name)
+    if generalize_value == 0:
+        return '{0}.STAsBinary() as WKB'.format(geometry)
+    elif generalize_value > 0.9:
+        # Only the envelope is indexed.
+        return '{0}.STEnvelope().STAsBinary() as WKB'.format(geometry)
+    envelope = '{0}.STEnvelope()'.format(geometry)
+    width = '({0}.STPointN(3).STX - {0}.STPointN(1).STX)'.format(envelope)
+    height = '({0}.STPointN(3).STY - {0}.STPointN(1).STY)'.format(envelope)
+    tolerance = '{0} * case when {1} > {2} then {1} else {2} end'.format(worker_utils.simplify_factor(generalize_value), width, height)
+    return '{0}.Reduce({1}).STAsBinary() as WKB'.format(geometry, tolerance)
+
+
+class RowMapper(object):
+    """Maps the rows of a table to the geometry and fields of an entry."""
+    def __init__(self, job, tbl, columns, column_types, geo, has_shape, is_point, geom_type, wkb=False):
+        self.tbl = tbl
+        self.mapping_plan = job.mapping_plan(tbl, columns, column_types)
+        self.point_plan = job.mapping_plan(tbl, columns[2:], column_types, offset=2)
+        self.shape_plan = job.mapping_plan(tbl, columns[5:], column_types, offset=5)
+        self.geo = geo
+        self.has_shape = has_shape
+        self.is_point = is_point
+        self.geom_type = geom_type
+        self.wkb = wkb
+        self.wkt_col = -1
+        if 'WKT' in columns:
+            self.has_shape = True
+            try:
+                self.wkt_col = self.mapping_plan.fields.index('fs_WKT')
+            except ValueError:
+                self.wkt_col = self.mapping_plan.fields.index('WKT')
+        self.geometry_ops = worker_utils.GeometryOps()
+        self.generalize_value = job.generalize_value
+
+    def map_row(self, row, row_id):
+        """Returns the geometry and the mapped fields of a row. The row id (key or row number) is the fallback id field."""
+        geo = self.geo
+        wkt_col = self.wkt_col
+        generalize_value = self.generalize_value
+        mapped_cols = None
+        if self.has_shape:
+            if self.is_point:
+                geo['lon'] = row[1]
+                geo['lat'] = row[0]
+                mapped_cols = self.point_plan.project(row)
+                mapped_cols['geometry_type'] = 'Point'
+            else:
+                if generalize_value == 0 or generalize_value == 0.0:
+                    if wkt_col >= 0:
+                        geo['wkt'] = row[wkt_col]
+                        mapped_cols = self.mapping_plan.project(row)
+                    elif self.wkb:
+                        geo['wkt'] = worker_utils.wkb_to_wkt(row[0])
+                    else:
+                        geo['wkt'] = row[0]
+                elif generalize_value > 0.9:
+                    if wkt_col >= 0:
+                        geo['wkt'] = row[wkt_col]
+                        mapped_cols = self.mapping_plan.project(row)
+                    else:
+                        geo['xmin'] = row[1]
+                        geo['ymin'] = row[2]
+                        geo['xmax'] = row[3]
+                        geo['ymax'] = row[4]
+                else:
+                    if wkt_col >= 0:
+                        geo['wkt'] = self.geometry_ops.generalize_geometry(str(row[wkt_col]), generalize_value)
+                        mapped_cols = self.mapping_plan.project(row)
+                    elif self.wkb:
+                        # Simplified by SQL Server.
+                        geo['wkt'] = worker_utils.wkb_to_wkt(row[0])
+                    else:
+                        geo['wkt'] = self.geometry_ops.generalize_geometry(str(row[0]), generalize_value)
+                if not mapped_cols:
+                    mapped_cols = self.shape_plan.project(row)
+                if 'Polygon' in self.geom_type:
+                    mapped_cols['geometry_type'] = 'Polygon'
+                elif 'Polyline' in self.geom_type:
+                    mapped_cols['geometry_type'] = 'Polyline'
+                else:
+                    mapped_cols['geometry_type'] = 'Point'
+        else:
+            mapped_cols = self.mapping_plan.project(row)
+
+        mapped_cols['format_type'] = 'Record'
+        mapped_cols['format'] = 'application/vnd.sqlserver.record'
+        if 'id' in mapped_cols:
+            mapped_cols['id'] = '{0}_{1}'.format(self.tbl, mapped_cols['id'])
+        else:
+            mapped_cols['id'] = '{0}_{1}'.format(self.tbl, row_id)
+        return geo, mapped_cols
+
+
+def index_range(args):
+    """Index the rows of a table with split column values from start up to stop.
+    The split column is selected last and its value is used for the entry id.
+    """
+    tbl, columns, split_column, start, stop, mapper_args = args
+    checkpoint_name = '{0}:{1}'.format(tbl, start)
+    if job.is_done(checkpoint_name):
+        return 0, None
+    # The metrics of each range are returned to the main process.
+    metrics.reset()
+    metrics.set_table(tbl)
+    position = job.get_checkpoint(checkpoint_name)
+    if position is not None:
+        start = position + 1
+    row_mapper = RowMapper(job, tbl, *mapper_args)
+    location_id = job.location_id
+    action_type = job.action_type
+    discovery_id = job.discovery_id
+    entry = {}
+    i = 0
+    started = metrics.start()
+    rows = job.db_cursor.execute("select {0}, {1} from {2} where {1} >= ? and {1} < ? order by {1}".format(','.join(columns), split_column, tbl), start, stop)
+    metrics.stop('query', started)
+    for i, row in enumerate(metrics.timed('fetch', rows), 1):
+        started = metrics.start()
+        geo, mapped_cols = row_mapper.map_row(row, row[-1])
+        metrics.stop('map', started)
+        mapped_cols['_discoveryID'] = discovery_id
+        entry['id'] = '{0}_{1}_{2}'.format(location_id, tbl, row[-1])
+        entry['location'] = location_id
+        entry['action'] = action_type
+        if geo:
+            entry['entry'] = {'geo': geo, 'fields': mapped_cols}
+        else:
+            entry['entry'] = {'fields': mapped_cols}
+        job.send_entry(entry)
+        job.checkpoint(checkpoint_name, row[-1])
+    job.flush_entries()
+    job.checkpoint(checkpoint_name, None, done=True)
+    return i, metrics.summary()
+
+
+def index_ranges(job, tbl, columns, split_column, split, key_range, mapper_args, row_count):
+    """Index a table in key ranges, each scanned by its own process and connection."""
+    ranges = worker_utils.split_key_range(key_range[0], key_range[1], split)
+    args = [(tbl, columns, split_column, start, stop, mapper_args) for start, stop in ranges]
+    pool = multiprocessing.Pool(len(ranges), initializer=global_job, initargs=(job.job_file,))
+    processed = 0
+    try:
+        for count, range_metrics in pool.imap_unordered(index_range, args):
+            processed += count
+            metrics.merge(range_metrics)
+            status_writer.progress(tbl, processed, row_count, 'sql_server', job.bytes_sent)
+        # Synchronize the main process with the job processes to ensure proper cleanup.
+        pool.close()
+        pool.join()
+    except Exception:
+        pool.terminate()
+        raise
+
+
 def run_job(job):
     """Worker function to index each row in each table in the database."""
     job.connect_to_zmq()
     job.connect_to_database()
     tables = get_tables(job)
+    catalog = get_catalog(job)
+    job.save_catalog()
+    row_estimates = get_row_estimates(job)
     sql_links = []
 
     for tbl in set(tables):
+        metrics.set_table(tbl)
         geo = {}
         has_shape = False
         is_point = False
+        wkb = False
         shape_field_name = ''
 
         # --------------------------------------------------------------------------------------------------
@@ -71,52 +330,28 @@ def run_job(job):
         # --------------------------------------------------------------------------------------------------
         schema = {}
 
-        # Get the primary key.
-        qry = "SELECT K.COLUMN_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS AS C JOIN " \
-              "INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS K ON " \
-              "C.TABLE_NAME = K.TABLE_NAME AND C.CONSTRAINT_NAME = K.CONSTRAINT_NAME WHERE " \
-              "C.CONSTRAINT_TYPE = 'PRIMARY KEY' AND K.TABLE_NAME = '{0}'".format(tbl)
-        cols = job.execute_query(qry).fetchall()
-        primary_key = ''
-        if cols:
-            primary_key = cols[0][0]
-
-        # Get the foreign key.
-        qry = "SELECT K.COLUMN_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS AS C JOIN " \
-              "INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS K ON " \
-              "C.TABLE_NAME = K.TABLE_NAME AND C.CONSTRAINT_NAME = K.CONSTRAINT_NAME WHERE " \
-              "C.CONSTRAINT_TYPE = 'FOREIGN KEY' AND K.TABLE_NAME = '{0}'".format(tbl)
-        cols = job.execute_query(qry).fetchall()
-        foreign_key = ''
-        if cols:
-            foreign_key = cols[0][0]
-
-        # Get the columns that have indexes.
-        qry = "SELECT COL_NAME(ic.object_id,ic.column_id) AS column_name " \
-              "FROM sys.indexes AS i INNER JOIN sys.index_columns AS ic ON i.object_id = ic.object_id " \
-              "AND i.index_id = ic.index_id WHERE i.object_id = OBJECT_ID('{0}')".format(tbl)
-        cols = job.execute_query(qry).fetchall()
-        indexed_cols = []
-        if cols:
-            for col in cols:
-                indexed_cols.append(col[0])
+        # The primary key, foreign key and indexed columns are from the catalog.
+        table_info = catalog[tbl]
+        primary_key = table_info['primary_key']
+        foreign_key = table_info['foreign_key']
+        indexed_cols = table_info['indexed']
 
         schema_columns = []
-        for col in job.db_cursor.columns(table=tbl).fetchall():
+        for column_name, type_name, nullable in table_info['columns']:
             column = {}
             props = []
-            column['name'] = col.column_name
-            column['type'] = col.type_name
-            if col.type_name == 'geometry':
+            column['name'] = column_name
+            column['type'] = type_name
+            if type_name == 'geometry':
                 column['isGeo'] = True
-                column['crs'] = job.db_cursor.execute("select {0}.STSrid from {1}".format(col.column_name, tbl)).fetchone()[0]
-            if col.column_name == primary_key:
+                column['crs'] = get_srid(job, tbl, column_name)
+            if column_name == primary_key:
                 props.append('PRIMARY KEY')
-            if col.column_name == foreign_key:
+            if column_name == foreign_key:
                 props.append('FOREIGN KEY')
-            if col.column_name in indexed_cols:
+            if column_name in indexed_cols:
                 props.append('INDEXED')
-            if col.is_nullable == 'YES':
+            if nullable:
                 props.append('NULLABLE')
             else:
                 props.append('NOTNULLABLE')
@@ -127,31 +362,21 @@ def run_job(job):
         # --------------------------------
         # Get the list of columns to keep.
         # --------------------------------
-        if not job.fields_to_keep == ['*']:
-            columns = []
-            column_types = {}
-            for col in job.fields_to_keep:
-                qry = "select column_name, data_type from INFORMATION_SCHEMA.columns where table_name = '{0}' and column_name like '{1}'".format(tbl, col)
-                for c in job.execute_query(qry).fetchall():
-                    if not c.type_name == 'geometry':
-                        columns.append("{0}.{1}".format(tbl, c[0]))
-                        column_types[c[0]] = c[1]
-                    else:
-                        shape_field_name = c.column_name
-        else:
-            columns = []
-            column_types = {}
-            for c in job.db_cursor.columns(table=tbl).fetchall():
-                if not c.type_name == 'geometry':
-                    columns.append("{0}.{1}".format(tbl, c.column_name))
-                    column_types[c.column_name] = c.type_name
-                else:
-                    shape_field_name = c.column_name
+        columns = []
+        column_types = {}
+        for column_name, type_name, nullable in table_info['columns']:
+            if not any(worker_utils.like(column_name, col) for col in job.fields_to_keep):
+                continue
+            if not type_name == 'geometry':
+                columns.append("{0}.{1}".format(tbl, column_name))
+                column_types[column_name] = type_name
+            else:
+                shape_field_name = column_name
 
         if job.fields_to_skip:
             for col in job.fields_to_skip:
-                qry = "select column_name from INFORMATION_SCHEMA.columns where table_name = '{0}' and column_name like '{1}'".format(tbl, col)
-                [columns.remove("{0}.{1}".format(tbl, c[0])) for c in job.execute_query(qry).fetchall()]
+                [columns.remove("{0}.{1}".format(tbl, c[0])) for c in table_info['columns']
+                 if worker_utils.like(c[0], col) and "{0}.{1}".format(tbl, c[0]) in columns]
 
         # --------------------------------------------------------------------------------------------------------
         # Get the column names and types from the related tables.
@@ -159,9 +384,9 @@ def run_job(job):
         related_columns = []
         if job.related_tables:
             for related_table in job.related_tables:
-                for c in job.db_cursor.columns(table=related_table):
-                    if not c.type_name == 'geometry':
-                        related_columns.append("{0}.{1}".format(related_table, c.column_name))
+                for column_name, type_name, nullable in catalog[related_table]['columns']:
+                    if not type_name == 'geometry':
+                        related_columns.append("{0}.{1}".format(related_table, column_name))
 
         # --------------------------------------------------------------------------------------------------------
         # Check for a geometry column and pull out X,Y for points and extent coordinates for other geometry types.
@@ -169,8 +394,7 @@ def run_job(job):
         geom_type = ''
         if shape_field_name:
             has_shape = True
-            srid = job.db_cursor.execute("select {0}.STSrid from {1}".format(shape_field_name, tbl)).fetchone()[0]
-            geo['code'] = srid
+            geo['code'] = get_srid(job, tbl, shape_field_name)
             geom_type = job.db_cursor.execute("select {0}.STGeometryType() from {1}".format(shape_field_name, tbl)).fetchone()[0]
             if geom_type == 'Point':
                 is_point = True
@@ -182,21 +406,64 @@ def run_job(job):
                 columns.insert(0, "{0}.{1}.STEnvelope().STPointN((1)).STY as YMIN".format(tbl, shape_field_name))
                 columns.insert(0, "{0}.{1}.STEnvelope().STPointN((1)).STX as XMIN".format(tbl, shape_field_name))
                 columns.insert(0, "{0}.{1}.STAsText() as WKT".format(tbl, shape_field_name))
+                if job.geometry_pushdown:
+                    # Simplify the geometry in SQL Server, unless the server does not support it.
+                    wkb_column = get_wkb_column(tbl, shape_field_name, job.generalize_value)
+                    try:
+                        job.db_cursor.execute("select top 1 {0} from {1}".format(wkb_column, tbl)).fetchall()
+                        columns[0] = wkb_column
+                        wkb = True
+                    except Exception as ex:
+                        status_writer.send_status('{0}: geometries are generalized by the worker ({1}).'.format(tbl, ex))
 
         # -----------------------------
         # Query the table for the rows.
         # -----------------------------
         sql_query = job.get_table_query(tbl)
-        if not sql_query:
-            row_count = float(job.db_cursor.execute("select Count(*) from {0}".format(tbl)).fetchone()[0])
-            rows = job.db_cursor.execute("select {0} from {1}".format(','.join(columns), tbl))
+        split, split_column = job.get_table_split(tbl)
+        split_column = split_column or primary_key
+        key_range = None
+        first_row = 0
+        # The primary key is selected last and identifies the entries, unless the rows are joined to related tables.
+        id_key = primary_key if not job.related_tables else ''
+        resume_key = id_key if job.checkpoints else ''
+        if not id_key:
+            job.disable_delta(tbl)
+        if split > 1 and split_column and not sql_query and not job.related_tables and not job.schema_only:
+            # Scan the table in key ranges if the split column is an integer key.
+            key_range = job.db_cursor.execute("select min({0}), max({0}) from {1}".format(split_column, tbl)).fetchone()
+            if not all(isinstance(k, (int, long)) for k in key_range):
+                status_writer.send_status('{0}: {1} is not an integer key, the table is not split.'.format(tbl, split_column))
+                key_range = None
+        started = metrics.start()
+        if key_range:
+            row_count = get_row_count(job, tbl, row_estimates)
+            select_columns = list(columns)
+            rows = []
+        elif not sql_query:
+            row_count = get_row_count(job, tbl, row_estimates)
+            if resume_key:
+                # Rows are read in primary key order, which is selected last, so a resumed job can continue after the checkpoint.
+                position = job.get_checkpoint(tbl)
+                if position:
+                    first_row = position[1] + 1
+                    rows = job.db_cursor.execute("select {0}, {1} from {2} where {1} > ? order by {1}".format(','.join(columns), resume_key, tbl), position[0])
+                else:
+                    rows = job.db_cursor.execute("select {0}, {1} from {2} order by {1}".format(','.join(columns), resume_key, tbl))
+            elif id_key:
+                rows = job.db_cursor.execute("select {0}, {1} from {2}".format(','.join(columns), id_key, tbl))
+            else:
+                rows = job.db_cursor.execute("select {0} from {1}".format(','.join(columns), tbl))
         else:
             q = re.search('FROM(.*)', sql_query, re.IGNORECASE).group(0)
             try:
                 row_count = float(job.db_cursor.execute("select Count(*) {0}".format(q)).fetchone()[0])
             except Exception:
                 row_count = float(job.db_cursor.execute("select Count(*) {0}".format(q.split('ORDER BY')[0])).fetchone()[0])
+            if id_key:
+                related_columns = ['{0}.{1}'.format(tbl, id_key)]
             rows = job.execute_query("select {0} {1}".format(','.join(columns + related_columns), q))
+        metrics.stop('query', started)
 
         # -----------------------------------------------------------------------------
         # Index each row in the table. If there are relates, index the related records.
@@ -204,21 +471,13 @@ def run_job(job):
         cur_id = -1
         entry = {}
         link = {}
-        wkt_col = -1
         action_type = job.action_type
         discovery_id = job.discovery_id
         location_id = job.location_id
         columns = [c.split('.')[1] for c in columns]
-        mapped_fields = job.map_fields(tbl, columns, column_types)
-        increment = job.get_increment(row_count)
-        if 'WKT' in columns:
-            has_shape = True
-            try:
-                wkt_col = mapped_fields.index('fs_WKT')
-            except ValueError:
-                wkt_col = mapped_fields.index('WKT')
-        geometry_ops = worker_utils.GeometryOps()
-        generalize_value = job.generalize_value
+        mapper_args = (columns, column_types, geo, has_shape, is_point, geom_type, wkb)
+        row_mapper = RowMapper(job, tbl, *mapper_args)
+        mapped_related_fields = None
 
         # -----------------------------------------------
         # Add an entry for the table itself with schema.
@@ -239,80 +498,51 @@ def run_job(job):
             continue
         else:
             job.send_entry(table_entry)
+        if job.is_done(tbl):
+            continue
 
-        for i, row in enumerate(rows):
+        if key_range:
+            index_ranges(job, tbl, select_columns, split_column, split, key_range, mapper_args, row_count)
+
+        for i, row in enumerate(metrics.timed('fetch', rows), first_row):
             if not cur_id == row[0] or not job.related_tables:
                 if entry:
                     try:
                         job.send_entry(entry)
                     except Exception as ex:
+                        job.table_failed(tbl)
                         entry = {}
                         continue
                     entry = {}
-                if has_shape:
-                    if is_point:
-                        geo['lon'] = row[1]
-                        geo['lat'] = row[0]
-                        mapped_cols = dict(zip(mapped_fields[2:], row[2:]))
-                        mapped_cols['geometry_type'] = 'Point'
-                    else:
-                        if generalize_value == 0 or generalize_value == 0.0:
-                            if wkt_col >= 0:
-                                geo['wkt'] = row[wkt_col]
-                                mapped_cols = dict(zip(mapped_fields, row))
-                            else:
-                                geo['wkt'] = row[0]
-                        elif generalize_value > 0.9:
-                            if wkt_col >= 0:
-                                geo['wkt'] = row[wkt_col]
-                                mapped_cols = dict(zip(mapped_fields, row))
-                            else:
-                                geo['xmin'] = row[1]
-                                geo['ymin'] = row[2]
-                                geo['xmax'] = row[3]
-                                geo['ymax'] = row[4]
-                        else:
-                            if wkt_col >= 0:
-                                geo['wkt'] = geometry_ops.generalize_geometry(str(row[wkt_col]), generalize_value)
-                                mapped_cols = dict(zip(mapped_fields, row))
-                            else:
-                                geo['wkt'] = geometry_ops.generalize_geometry(str(row[0]), generalize_value)
-                        if not mapped_cols:
-                            mapped_cols = dict(zip(mapped_fields[5:], row[5:]))
-                        if 'Polygon' in geom_type:
-                            mapped_cols['geometry_type'] = 'Polygon'
-                        elif 'Polyline' in geom_type:
-                            mapped_cols['geometry_type'] = 'Polyline'
-                        else:
-                            mapped_cols['geometry_type'] = 'Point'
-                else:
-                    mapped_cols = dict(zip(mapped_fields, row))
+                    if resume_key:
+                        job.checkpoint(tbl, position)
+                row_id = row[-1] if id_key else i
+                started = metrics.start()
+                geo, mapped_cols = row_mapper.map_row(row, row_id)
+                metrics.stop('map', started)
+                if resume_key:
+                    position = [row[-1], i]
 
                 # Create an entry to send to ZMQ for indexing.
-                mapped_cols['format_type'] = 'Record'
-                mapped_cols['format'] = 'application/vnd.sqlserver.record'
-                if 'id' in mapped_cols:
-                    mapped_cols['id'] = '{0}{1}'.format(random.randint(0, 1000000), mapped_cols['id'])
-                else:
-                    mapped_cols['id'] = "{0}{1}".format(random.randint(0, 1000000), i)
-                entry['id'] = '{0}_{1}_{2}'.format(location_id, tbl, i)
+                entry['id'] = '{0}_{1}_{2}'.format(location_id, tbl, row_id)
                 entry['location'] = location_id
                 entry['action'] = action_type
 
                 # If the table supports relates/joins, handle them and add them as links.
                 if job.related_tables:
                     links = []
-                    related_field_names = [d[0] for d in row.cursor_description[len(columns):]]
-                    related_field_types = dict(zip(related_field_names, [d[1] for d in row.cursor_description[len(columns):]]))
-                    mapped_related_fields = []
-                    for related_table in job.related_tables:
-                        mapped_related_fields += job.map_fields(related_table, related_field_names, related_field_types)
+                    if mapped_related_fields is None:
+                        related_field_names = [d[0] for d in row.cursor_description[len(columns):]]
+                        related_field_types = dict(zip(related_field_names, [d[1] for d in row.cursor_description[len(columns):]]))
+                        mapped_related_fields = []
+                        for related_table in job.related_tables:
+                            mapped_related_fields += job.map_fields(related_table, related_field_names, related_field_types)
                     link['relation'] = 'contains'
                     link = dict(zip(mapped_related_fields, row[len(columns):]))
                     try:
-                        link['id'] = "{0}{1}".format(random.randint(0, 1000000), link['id'])
+                        link['id'] = '{0}_{1}'.format(tbl, link['id'])
                     except KeyError:
-                        link['id'] = "{0}{1}".format(random.randint(0, 1000000), i)
+                        link['id'] = '{0}_{1}'.format(tbl, i)
 
                     # Send this link as an entry and set extract to true.
                     link_entry = {}
@@ -340,9 +570,9 @@ def run_job(job):
                 link['relation'] = 'contains'
                 link = dict(zip(mapped_related_fields, row[len(columns):]))
                 try:
-                    link['id'] = "{0}{1}".format(random.randint(0, 1000000), link['id'])
+                    link['id'] = '{0}_{1}'.format(tbl, link['id'])
                 except KeyError:
-                    link['id'] = "{0}{1}".format('0000', i)
+                    link['id'] = '{0}_{1}'.format(tbl, i)
                 link_entry = {}
                 link_entry['id'] = "{0}{1}".format(link['id'], location_id)
                 link_entry['action'] = action_type
@@ -355,16 +585,20 @@ def run_job(job):
                 entry['entry']['links'] = entry['entry'].pop('links', links)
 
             # Report status percentage.
-            if (i % increment) == 0:
-                status_writer.send_percent(i / row_count, '{0}: {1:%}'.format(tbl, i / row_count), 'sql_server')
+            status_writer.progress(tbl, i, row_count, 'sql_server', job.bytes_sent)
 
         # Send final entry.
-        job.send_entry(entry)
-        status_writer.send_percent(1, '{0}: {1:%}'.format(tbl, 1), 'sql_server')
-
+        if entry:
+            job.send_entry(entry)
+        job.flush_entries()
+        job.checkpoint(tbl, None, done=True)
+        status_writer.send_percent(1, '{0}: {1:.1%}'.format(tbl, 1), 'sql_server')
+
+    # Keep the SRIDs read while indexing in the snapshot.
+    job.save_catalog()
     sql_entry = {}
     sql_properties = {}
-    sql_entry['id'] = job.location_id + str(random.randint(0, 1000))
+    sql_entry['id'] = '{0}_{1}'.format(job.location_id, job.sql_connection_info['connection']['database'])
     sql_entry['location'] = job.location_id
     sql_entry['action'] = job.action_type
     sql_properties['_discoveryID'] = job.discovery_id
@@ -376,3 +610,4 @@ def run_job(job):
     sql_entry['entry'] = {'fields': sql_properties}
     sql_entry['entry']['links'] = sql_links
     job.send_entry(sql_entry)
+    job.flush_entries()
@@ -0,0 +1,162 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-table and per-stage timings and counters of a location job.
+
+Each process has one collector. Workers time a stage with start and stop
+(or wrap a cursor with timed) and count things with count:
+
+    t = metrics.start()
+    geo, mapped_cols = row_mapper.map_row(row, i)
+    metrics.stop('map', t)
+
+Stages are attributed to the current table (set_table). Wall time is
+time.time() and CPU time is the process CPU time (time.clock), so CPU time
+of a stage includes any other thread running at the same time.
+"""
+import os
+import time
+
+_wall = time.time
+_cpu = time.clock
+
+
+class Metrics(object):
+    """Accumulates wall and CPU time and call counts per table and stage, and counters per table."""
+    def __init__(self):
+        self.enabled = True
+        self.interval = 0
+        self.on_snapshot = None
+        self.table = ''
+        self._stages = {}
+        self._counts = {}
+        self._started = (time.time(), time.clock())
+        self._next_snapshot = 0
+
+    def configure(self, enabled=True, interval=0, on_snapshot=None):
+        """Turns collection on or off and sets a callback for snapshots of the summary every interval seconds."""
+        self.enabled = enabled
+        self.interval = interval
+        self.on_snapshot = on_snapshot
+        self._next_snapshot = time.time() + interval if interval else 0
+
+    def set_table(self, table):
+        """Sets the table that following stages and counts are attributed to."""
+        self.table = table
+
+    def start(self):
+        """Returns the start of a stage to pass to stop."""
+        if self.enabled:
+            return _wall(), _cpu()
+
+    def stop(self, stage, started, table=None):
+        """Adds the time since started to a stage of the table (the current table by default)."""
+        if not started:
+            return
+        wall = _wall()
+        cpu = _cpu()
+        # Stages are only timed on one thread each (encode and send may run on the sender thread),
+        # so totals are updated without a lock.
+        try:
+            totals = self._stages[(table or self.table, stage)]
+        except KeyError:
+            totals = self._stages[(table or self.table, stage)] = [0., 0., 0]
+        totals[0] += wall - started[0]
+        totals[1] += cpu - started[1]
+        totals[2] += 1
+        if self._next_snapshot and wall >= self._next_snapshot:
+            self._next_snapshot = wall + self.interval
+            if self.on_snapshot:
+                self.on_snapshot(self.summary())
+
+    def count(self, name, n=1, table=None):
+        """Adds n to a counter of the table (the current table by default)."""
+        if not self.enabled:
+            return
+        key = (table or self.table, name)
+        self._counts[key] = self._counts.get(key, 0) + n
+
+    def timed(self, stage, iterable, table=None):
+        """Iterates over iterable (such as a cursor), adding the time each item takes to a stage."""
+        if not self.enabled:
+            for item in iterable:
+                yield item
+            return
+        iterator = iter(iterable)
+        while True:
+            started = _wall(), _cpu()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.stop(stage, started, table)
+                return
+            self.stop(stage, started, table)
+            yield item
+
+    def summary(self):
+        """Returns the totals as a dictionary that can be encoded as JSON."""
+        tables = {}
+        totals = {}
+        stages = self._stages.items()
+        counts = self._counts.items()
+        for (table, stage), (wall, cpu, calls) in stages:
+            t = tables.setdefault(table, {'stages': {}, 'counts': {}})
+            t['stages'][stage] = {'wall': round(wall, 6), 'cpu': round(cpu, 6), 'calls': calls}
+            total = totals.setdefault(stage, {'wall': 0., 'cpu': 0., 'calls': 0})
+            total['wall'] += wall
+            total['cpu'] += cpu
+            total['calls'] += calls
+        counters = {}
+        for (table, name), n in counts:
+            tables.setdefault(table, {'stages': {}, 'counts': {}})['counts'][name] = n
+            counters[name] = counters.get(name, 0) + n
+        for total in totals.values():
+            total['wall'] = round(total['wall'], 6)
+            total['cpu'] = round(total['cpu'], 6)
+        return {'pid': os.getpid(),
+                'wall': round(time.time() - self._started[0], 6),
+                'cpu': round(time.clock() - self._started[1], 6),
+                'stages': totals,
+                'counts': counters,
+                'tables': tables}
+
+    def merge(self, summary):
+        """Adds the table totals of a summary from another process (such as a pool process)."""
+        if not self.enabled or not summary:
+            return
+        for table, totals in summary['tables'].items():
+            for stage, stage_totals in totals['stages'].items():
+                merged = self._stages.setdefault((table, stage), [0., 0., 0])
+                merged[0] += stage_totals['wall']
+                merged[1] += stage_totals['cpu']
+                merged[2] += stage_totals['calls']
+            for name, n in totals['counts'].items():
+                self._counts[(table, name)] = self._counts.get((table, name), 0) + n
+
+    def reset(self):
+        """Clears the totals (for example in a new pool process)."""
+        self._stages.clear()
+        self._counts.clear()
+        self._started = (time.time(), time.clock())
+
+
+collector = Metrics()
+configure = collector.configure
+set_table = collector.set_table
+start = collector.start
+stop = collector.stop
+count = collector.count
+timed = collector.timed
+summary = collector.summary
+merge = collector.merge
+reset = collector.reset
@@ -14,6 +14,7 @@
 # limitations under the License.
 from __future__ import unicode_literals
 import sys
+import time
 
 
 S_SEP = ">>"
@@ -41,16 +42,18 @@ class Writer(object):
     def __init__(self):
         """Initialize Writer call."""
         self._io = sys.stdout
+        self._parts = []
 
     def __w(self, msg):
-        """Write to wrapped output thing. """
-        self._io.write(msg)
-        self._io.flush()
+        """Add to the message being written."""
+        self._parts.append(msg)
 
     def __fl(self):
-        """Send newline and flush wrapped output thing."""
-        self._io.write("\n")
+        """Write the message with a newline and flush wrapped output thing."""
+        self._parts.append("\n")
+        self._io.write("".join(self._parts))
         self._io.flush()
+        self._parts = []
 
     def __send(self, key, val):
         """Write a key value pair to output thing. """
@@ -58,7 +61,7 @@ class Writer(object):
             self.__w("{0}{1}={2}".format(S_SEP, key, val))
 
     def format_output(func):
-        """Decorator used to wrap the output with markers. """
+        """Decorator used to wrap the output with markers. The message is written and flushed once."""
         def inner(*args, **kwargs):
             inst = args[0]
             inst.__w(S_FLAG)
@@ -98,3 +101,88 @@ class Writer(object):
         self.__send(S_KEY_STATE, statev)
         if msg:
             self.__send(S_KEY_MSG, msg)
+
+
+class ProgressWriter(Writer):
+    """Writer that sends percent updates at most once per interval (in seconds).
+
+    Updates in between are held and the latest one is sent when the interval has passed,
+    a table completes or flush is called. progress can be called for every row and adds
+    the rows/s, MB/s and ETA of the table to the message. Other messages are sent as they come.
+    """
+    def __init__(self, interval=2.):
+        super(ProgressWriter, self).__init__()
+        self.interval = interval
+        self._sent = 0.
+        self._pending = None
+        self._pending_rows = None
+        self._table = None
+        self._started = 0.
+        self._start_bytes = 0
+
+    def send_percent(self, pct, msg, name):
+        now = time.time()
+        if pct < 1 and now - self._sent < self.interval:
+            self._pending = (pct, msg, name)
+            self._pending_rows = None
+            return
+        self._pending = None
+        self._pending_rows = None
+        self._sent = now
+        super(ProgressWriter, self).send_percent(pct, msg, name)
+
+    def progress(self, table, rows, total, name, nbytes=0):
+        """Reports the rows processed so far for a table of total rows.
+        nbytes is a running count of bytes sent, such as Job.bytes_sent. total may be an
+        estimate: once rows passes it, the percent stays below 100 and no ETA is given.
+        """
+        now = time.time()
+        if table != self._table:
+            self._table = table
+            self._started = now
+            self._start_bytes = nbytes
+        if rows != total and now - self._sent < self.interval:
+            # The message is only built if the update is still held when the writer is flushed.
+            self._pending = None
+            self._pending_rows = (table, rows, total, name, nbytes, now)
+            return
+        pct, msg = self._progress_message(table, rows, total, nbytes, now)
+        self.send_percent(pct, msg, name)
+
+    def _progress_message(self, table, rows, total, nbytes, now):
+        """Returns the percent and message of a progress update."""
+        if not total:
+            pct = 0.
+        elif rows > total:
+            pct = .99
+        else:
+            pct = float(rows) / total
+        elapsed = now - self._started
+        msg = "{0}: {1:.1%}".format(table, pct)
+        if elapsed > 0:
+            rate = rows / elapsed
+            msg += " ({0:,.0f} rows/s, {1:.2f} MB/s".format(rate, (nbytes - self._start_bytes) / elapsed / 1048576.)
+            if rate and total and rows < total:
+                msg += ", ETA {0}".format(format_eta((total - rows) / rate))
+            msg += ")"
+        return pct, msg
+
+    def flush(self):
+        """Sends the update that is being held, if any. Call this when a table ends."""
+        if self._pending_rows:
+            table, rows, total, name, nbytes, now = self._pending_rows
+            pct, msg = self._progress_message(table, rows, total, nbytes, now)
+            self._pending = (pct, msg, name)
+            self._pending_rows = None
+        if self._pending:
+            pct, msg, name = self._pending
+            self._pending = None
+            self._sent = time.time()
+            super(ProgressWriter, self).send_percent(pct, msg, name)
+
+
+def format_eta(seconds):
+    """Formats a number of seconds as H:MM:SS."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
@@ -0,0 +1,217 @@
+# (C) Copyright 2014 Voyager Search
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local stores of the entries indexed for each location (delta indexing), of checkpoints (resume),
+of schema catalog snapshots and of change stream resume tokens."""
+import os
+import json
+import sqlite3
+import collections
+
+
+def _connect(path):
+    """Opens a store shared by the processes of a job, creating its folder if needed."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by another process.
+            pass
+    connection = sqlite3.connect(path, timeout=300, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+class ChangeStore(object):
+    """Records the id and a content digest of each entry sent for a location in a SQLite database.
+
+    Each run of a location is numbered. An entry is changed if it is new or its digest differs
+    from the last run, and entries that were not seen during the current run are deleted.
+    Several processes of the same run can share the store.
+    """
+    def __init__(self, path, location_id, commit_every=10000):
+        self._location_id = location_id
+        self._commit_every = commit_every
+        self._seen = []
+        self._connection = _connect(path)
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS runs (location TEXT PRIMARY KEY, run INTEGER)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries (location TEXT, id TEXT, digest TEXT, run INTEGER, '
+                                 'PRIMARY KEY (location, id))')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS failures (location TEXT, name TEXT, run INTEGER, '
+                                 'PRIMARY KEY (location, name))')
+        self._connection.commit()
+        self.run = self._current_run()
+
+    def _current_run(self):
+        row = self._connection.execute('SELECT run FROM runs WHERE location = ?', (self._location_id,)).fetchone()
+        return row[0] if row else 0
+
+    def begin_run(self):
+        """Starts a new run of the location and returns its number."""
+        self.run = self._current_run() + 1
+        self._connection.execute('INSERT OR REPLACE INTO runs (location, run) VALUES (?, ?)', (self._location_id, self.run))
+        self._connection.execute('DELETE FROM failures WHERE location = ?', (self._location_id,))
+        self._connection.commit()
+        return self.run
+
+    def changed(self, entry_id, digest):
+        """Returns True if the entry is new or its digest changed. Either way, it is marked as seen in this run."""
+        changed = self.is_changed(entry_id, digest)
+        self.seen([(entry_id, digest)])
+        return changed
+
+    def is_changed(self, entry_id, digest):
+        """Returns True if the entry is new or its digest changed, without marking it as seen."""
+        row = self._connection.execute('SELECT digest FROM entries WHERE location = ? AND id = ?',
+                                       (self._location_id, entry_id)).fetchone()
+        return row is None or row[0] != digest
+
+    def seen(self, entries):
+        """Marks a list of (id, digest) pairs as seen in this run."""
+        # Writes are held and committed in batches so processes sharing the store only lock it briefly.
+        self._seen.extend((self._location_id, entry_id, digest, self.run) for entry_id, digest in entries)
+        if len(self._seen) >= self._commit_every:
+            self.commit()
+
+    def fail(self, name):
+        """Records that a table (or an entry) was not completely indexed in this run."""
+        self._connection.execute('INSERT OR REPLACE INTO failures (location, name, run) VALUES (?, ?, ?)',
+                                 (self._location_id, name, self.run))
+        self._connection.commit()
+
+    def failures(self):
+        """Returns the names of the tables (or entries) that were not completely indexed in this run."""
+        return [row[0] for row in self._connection.execute('SELECT name FROM failures WHERE location = ? AND run = ?',
+                                                           (self._location_id, self.run))]
+
+    def deleted(self):
+        """Returns the ids of the entries that were not seen in this run and removes them from the store."""
+        self.commit()
+        ids = [row[0] for row in self._connection.execute('SELECT id FROM entries WHERE location = ? AND run < ?',
+                                                          (self._location_id, self.run))]
+        self._connection.execute('DELETE FROM entries WHERE location = ? AND run < ?', (self._location_id, self.run))
+        self._connection.commit()
+        return ids
+
+    def commit(self):
+        """Writes the entries seen since the last commit."""
+        if self._seen:
+            self._connection.executemany('INSERT OR REPLACE INTO entries (location, id, digest, run) VALUES (?, ?, ?, ?)',
+                                         self._seen)
+            self._seen = []
+        self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+
+class CheckpointStore(object):
+    """Records how far each table (or part of a table) of a location has been indexed, so an
+    interrupted job can resume. A checkpoint is a JSON position such as the last key indexed,
+    and a table that was indexed completely is marked as done.
+    """
+    def __init__(self, path, location_id):
+        self._location_id = location_id
+        self._connection = _connect(path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS checkpoints (location TEXT, name TEXT, position TEXT, '
+                                 'done INTEGER, PRIMARY KEY (location, name))')
+        self._connection.commit()
+
+    def get(self, name):
+        """Returns the position and done flag of a checkpoint, or (None, False) if there is none."""
+        row = self._connection.execute('SELECT position, done FROM checkpoints WHERE location = ? AND name = ?',
+                                       (self._location_id, name)).fetchone()
+        if not row:
+            return None, False
+        return json.loads(row[0]), bool(row[1])
+
+    def save(self, checkpoints):
+        """Saves a dictionary of checkpoint names and (position, done) pairs."""
+        self._connection.executemany('INSERT OR REPLACE INTO checkpoints (location, name, position, done) VALUES (?, ?, ?, ?)',
+                                     [(self._location_id, name, json.dumps(position, default=str), int(done))
+                                      for name, (position, done) in checkpoints.iteritems()])
+        self._connection.commit()
+
+    def clear(self):
+        """Removes the checkpoints of the location."""
+        self._connection.execute('DELETE FROM checkpoints WHERE location = ?', (self._location_id,))
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class CatalogStore(object):
+    """Keeps a snapshot of the schema catalog of each location (tables, columns, keys and so on, as
+    JSON) with the fingerprint of the schema it was read from. A snapshot is only returned for the
+    same fingerprint, so a schema change makes the worker read the catalog again.
+    """
+    def __init__(self, path, location_id):
+        self._location_id = location_id
+        self._connection = _connect(path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS catalogs (location TEXT PRIMARY KEY, fingerprint TEXT, '
+                                 'catalog TEXT)')
+        self._connection.commit()
+
+    def get(self, fingerprint):
+        """Returns the snapshot saved with the fingerprint, or None."""
+        row = self._connection.execute('SELECT catalog FROM catalogs WHERE location = ? AND fingerprint = ?',
+                                       (self._location_id, fingerprint)).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0], object_pairs_hook=collections.OrderedDict)
+
+    def save(self, fingerprint, catalog):
+        """Replaces the snapshot of the location."""
+        self._connection.execute('INSERT OR REPLACE INTO catalogs (location, fingerprint, catalog) VALUES (?, ?, ?)',
+                                 (self._location_id, fingerprint, json.dumps(catalog, default=str)))
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class ResumeTokenStore(object):
+    """Keeps the change stream resume token of each collection of a location (as extended JSON), so the
+    next run resumes the change stream after the last change that was indexed. Unlike checkpoints,
+    tokens are kept when a job completes.
+    """
+    def __init__(self, path, location_id):
+        self._location_id = location_id
+        self._connection = _connect(path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS tokens (location TEXT, name TEXT, token TEXT, '
+                                 'PRIMARY KEY (location, name))')
+        self._connection.commit()
+
+    def get(self, name):
+        """Returns the token of a collection, or None."""
+        row = self._connection.execute('SELECT token FROM tokens WHERE location = ? AND name = ?',
+                                       (self._location_id, name)).fetchone()
+        return row[0] if row else None
+
+    def save(self, name, token):
+        """Replaces the token of a collection."""
+        self._connection.execute('INSERT OR REPLACE INTO tokens (location, name, token) VALUES (?, ?, ?)',
+                                 (self._location_id, name, token))
+        self._connection.commit()
+
+    def delete(self, name):
+        """Removes the token of a collection, so it is indexed from the start."""
+        self._connection.execute('DELETE FROM tokens WHERE location = ? AND name = ?', (self._location_id, name))
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
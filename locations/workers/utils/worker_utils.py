@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import re
 import sys
 import itertools
 import os
@@ -31,15 +32,53 @@ for lib in libs:
     sys.path.append(lib)
 from osgeo import ogr
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import metrics
 
 
 class InvalidToken(Exception):
     pass
 
 
+def split_key_range(low, high, count):
+    """Split the integer keys from low to high (inclusive) into at most count
+    half-open (start, stop) ranges of about equal width."""
+    width = max((high - low) // count + 1, 1)
+    ranges = []
+    start = low
+    while start <= high:
+        ranges.append((start, min(start + width, high + 1)))
+        start += width
+    return ranges
+
+
+def like(name, pattern):
+    """Returns True if a name matches a SQL LIKE pattern (case insensitive). * is also a wild card."""
+    expression = ''.join('.*' if c in '%*' else '.' if c == '_' else re.escape(c) for c in pattern)
+    return re.match('{0}$'.format(expression), name, re.IGNORECASE | re.DOTALL) is not None
+
+
+def wkb_to_wkt(wkb):
+    """Returns the well-known text of a well-known binary geometry (such as a database returns)."""
+    if wkb is None:
+        return None
+    geometry = ogr.CreateGeometryFromWkb(str(wkb))
+    if geometry:
+        return geometry.ExportToWkt()
+
+
+def simplify_factor(generalize_value):
+    """Returns the simplification tolerance for a generalize setting, as a fraction of the larger side
+    of each geometry's envelope. Used when the database simplifies geometries instead of GeometryOps.
+    """
+    return float(generalize_value) * 0.01
+
+
 class ArcGISServiceHelper(object):
     """ArcGIS Server and Portal helper class."""
-    def __init__(self, portal_url, username, password, verify_ssl, referer='', token_expiration=60, instance=''):
+    def __init__(self, portal_url, username, password, verify_ssl, referer='', token_expiration=60, instance='', pool_size=4):
+        self._session = self._create_session(pool_size)
         self._username = username
         self._password = password
         self._verify_ssl = verify_ssl
@@ -58,6 +97,18 @@ class ArcGISServiceHelper(object):
         self.oid_field_name = 'objectid'
         self.token = self._generate_token()
 
+    def _create_session(self, pool_size):
+        """Returns a session that keeps connections alive for reuse by up to pool_size threads,
+        requests gzip responses and retries connection errors and busy servers with backoff.
+        """
+        session = requests.Session()
+        retries = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        return session
+
     def _generate_token(self):
         """Generates a token required for ArcGIS Online authentication."""
         try:
@@ -67,7 +118,7 @@ class ArcGISServiceHelper(object):
                           'expiration': str(self._token_expiration)}
 
             url = "{0}/{1}/tokens/generateToken".format(self._portal_url, self._instance)
-            response = requests.post(url + "?f=json", query_dict, verify=self._verify_ssl)
+            response = self._session.post(url + "?f=json", query_dict, verify=self._verify_ssl)
             token = response.json()
 
             if "token" not in token:
@@ -94,7 +145,7 @@ class ArcGISServiceHelper(object):
                           'token': token,
                           'q': '''title:"{0}" AND owner:"{1}" AND type:"{2}"'''.format(service_name, self._username, service_type)}
 
-            response = requests.get(service_url, params=query_dict, verify=self._verify_ssl)
+            response = self._session.get(service_url, params=query_dict, verify=self._verify_ssl)
             data = response.json()
             if 'error' in data:
                 if data['error']['message'] == "Invalid Token":
@@ -120,9 +171,9 @@ class ArcGISServiceHelper(object):
             else:
                 service_url = search_url
         if self.token:
-            r = requests.get(service_url, params={'f': 'json', 'token': self.token, 'referer': self._referer}, verify=self._verify_ssl)
+            r = self._session.get(service_url, params={'f': 'json', 'token': self.token, 'referer': self._referer}, verify=self._verify_ssl)
         else:
-            r = requests.get(service_url, params={'f': 'json'}, verify=self._verify_ssl)
+            r = self._session.get(service_url, params={'f': 'json'}, verify=self._verify_ssl)
         items = r.json()
         if 'error' in items:
             if items['error']['message'] == "Invalid Token":
@@ -131,21 +182,38 @@ class ArcGISServiceHelper(object):
                 raise Exception(items['error']['message'])
         return service_url, items
 
-    def get_item_row_count(self, url, layer_id, token, where):
-        """Returns the row count of a service layer or table.
+    def get_max_record_count(self, url, layer_id, token):
+        """Returns the maximum number of records a service layer or table returns per query.
+        :param url: Service url
+        :param layer_id: service layer/table ID
+        :param token: token value
+        """
+        if self.token:
+            query = {'token': token, 'f': 'json'}
+        else:
+            query = {'f': 'json'}
+        response = self._session.get('{0}/{1}'.format(url, layer_id), params=query, verify=self._verify_ssl)
+        try:
+            return int(response.json().get('maxRecordCount') or 1000)
+        except (ValueError, TypeError):
+            return 1000
+
+    def get_item_row_count(self, url, layer_id, token, where, page_size=1000):
+        """Returns the row count of a service layer or table and the offset of each page.
         :param url: Service url
         :param layer_id: service layer/table ID
         :param token: token value
+        :param page_size: number of records per page
         """
         if self.token:
             query = {'where': where, 'returnCountOnly':True, 'token': token, 'f': 'json'}
         else:
             query = {'where': where, 'returnCountOnly':True, 'f': 'json'}
 
-        response = requests.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
+        response = self._session.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
         data = response.json()
         num_records = data['count']
-        id_groups = range(0, num_records, 1000)
+        id_groups = range(0, num_records, page_size)
         return id_groups, num_records
 
     def get_item_fields(self, url, layer_id, token):
@@ -158,7 +226,7 @@ class ArcGISServiceHelper(object):
             query = {'where': '1=1', 'outFields': '*', 'returnGeometry': False, 'token': token, 'f': 'json'}
         else:
             query = {'where': '1=1', 'outFields': '*', 'returnGeometry': False, 'f': 'json'}
-        response = requests.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
+        response = self._session.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
         data = response.json()
         fields = data['fields']
         return fields
@@ -180,7 +248,7 @@ class ArcGISServiceHelper(object):
         else:
             query = {'spatialRel': spatial_rel, 'where': where, 'outFields': out_fields, 'resultOffset': resultOffset, 'resultRecordCount': resultRecordCount, 'returnGeometry': return_geometry, 'outSR': out_sr, 'f': response_format}
         try:
-            response = requests.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
+            response = self._session.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
             data = response.json()
         except ValueError:
             if self.token:
@@ -189,7 +257,7 @@ class ArcGISServiceHelper(object):
             else:
                 query = {'spatialRel': spatial_rel, 'where': where, 'outFields': out_fields, 'resultOffset': resultOffset, 'resultRecordCount': resultRecordCount,
                          'returnGeometry': return_geometry, 'outSR': out_sr, 'f': 'json'}
-            response = requests.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
+            response = self._session.get('{0}/{1}/query?'.format(url, layer_id), params=query, verify=self._verify_ssl)
             data = response.json()
         return data
 
@@ -365,6 +433,13 @@ class GeometryOps(object):
         :param wkt: the well-known text string of the geometry to be generalized
         :param tolerance: a simplification tolerance
         """
+        started = metrics.start()
+        generalized = self.__generalize_geometry(wkt, tolerance)
+        metrics.stop('generalize', started)
+        metrics.count('geometries_generalized')
+        return generalized
+
+    def __generalize_geometry(self, wkt, tolerance):
         try:
             # If Polyline and tolerance is 1, just get the first, mid and last points.
             wkt = wkt.upper().replace('NAN', '0')